@@ -0,0 +1,261 @@
+"""
+Simplifications done on the AST of a class before code generation. They only change how much code is generated, never what it does.
+1. Constant folding: an operator whose operands are all constants is computed now, with the 16 bit wrap around of the Hack CPU.
+   < and > look at the sign of the wrapped difference, like the translated code does, not at the exact one.
+   `true` is -1, `false` and `null` are 0. A division by zero is left alone so it still fails when the program runs.
+2. Identities: x+0, x-0, x*1, x/1, x|0, x&-1 and their mirror images become x, --x and ~~x become x, 0-x, x*-1 and x/-1 become -x.
+   x*0, x&0 and x|-1 become a constant only if x has no subroutine call in it, since the call could have a side effect.
+   / and the * that stay multiplications count as calls, to Math.divide and Math.multiply (a division by zero fails).
+3. Reassociation: (x + 3) - 5 becomes x - 2. + and - wrap around, so regrouping the constants gives the same result. Same for & | and *.
+4. Constant conditions: an if whose condition is a constant is replaced by the branch that runs, a while(false) is dropped.
+Folded constants can be negative, and code generation handles IntegerConstant values from -32768 to 32767.
+"""
+from parser import BinaryExpr, UnaryExpr, IntegerConstant, ArrayAccess, SubroutineCall
+
+TRUE = -1
+# Multiplying by a constant is done with doublings and additions instead of calling Math.multiply, which loops over all 16 bits.
+# A power of two is always worth it, other constants only if they take at most this many doublings and additions
+MAX_MULTIPLY_STEPS = 8
+# Can be turned off, to measure what it saves (see benchmark.py)
+REDUCE_MULTIPLICATIONS = True
+
+
+def to_word(value):
+    # Wrap an integer to the signed 16 bit range of the Hack CPU
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+def divide(a, b):
+    # Jack's division truncates toward zero, like Math.divide
+    if b == 0:
+        return None
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+FOLDS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": divide,
+    "&": lambda a, b: a & b,
+    "|": lambda a, b: a | b,
+    # The CPU compares by the sign of a - b, which wraps around, so 32767 < -2 is true on it. Folding has to agree
+    "<": lambda a, b: TRUE if to_word(a - b) < 0 else 0,
+    ">": lambda a, b: TRUE if to_word(a - b) > 0 else 0,
+    "=": lambda a, b: TRUE if a == b else 0,
+}
+
+UNARY_FOLDS = {"-": lambda a: -a, "~": lambda a: ~a}
+
+KEYWORD_VALUES = {"true": TRUE, "false": 0, "null": 0}
+
+
+def constant_value(node):
+    """
+    Returns the value of a constant expression as a signed 16 bit integer, None if it is not a constant.
+    """
+    if node.type == "integerConstant":
+        # A literal too large for a word is left for the later stages to complain about
+        return node.value if -0x8000 <= node.value <= 0x7FFF else None
+    if node.type == "keywordConstant":
+        return KEYWORD_VALUES.get(node.value)
+    return None
+
+
+def constant_factor(node):
+    """
+    Returns the constant of a multiplication worth turning into additions, with the other operand. None if there is none.
+    """
+    if not REDUCE_MULTIPLICATIONS:
+        return None
+    for factor_node, operand in ((node.right, node.left), (node.left, node.right)):
+        factor = constant_value(factor_node)
+        if factor is None or abs(factor) < 2:
+            continue
+        magnitude = abs(factor)
+        steps = magnitude.bit_length() - 1 + bin(magnitude).count("1") - 1
+        if magnitude & (magnitude - 1) == 0 or steps <= MAX_MULTIPLY_STEPS:
+            return factor, operand
+    return None
+
+
+def has_call(node):
+    """
+    True if evaluating the expression could call a subroutine. A division calls Math.divide, which can fail,
+    and a multiplication calls Math.multiply unless it is turned into additions.
+    """
+    match node.type:
+        case "subroutineCall":
+            return True
+        case "binaryExpr":
+            if node.op == "/" or (node.op == "*" and constant_factor(node) is None):
+                return True
+            return has_call(node.left) or has_call(node.right)
+        case "unaryExpr":
+            return has_call(node.operand)
+        case "parenExpr":
+            return has_call(node.expression)
+        case "arrayAccess":
+            return has_call(node.index)
+        case _:
+            return False
+
+
+def has_array_access(node):
+    """
+    True if evaluating the expression could set THAT: it reads an array, directly or in the arguments of a call.
+    """
+    match node.type:
+        case "arrayAccess":
+            return True
+        case "subroutineCall":
+            return any(has_array_access(argument) for argument in node.arguments)
+        case "binaryExpr":
+            return has_array_access(node.left) or has_array_access(node.right)
+        case "unaryExpr":
+            return has_array_access(node.operand)
+        case "parenExpr":
+            return has_array_access(node.expression)
+        case _:
+            return False
+
+
+def add_offset(base, offset):
+    # base + offset, written as a subtraction when the offset is negative so the constant needs no neg
+    offset = to_word(offset)
+    if offset == 0:
+        return base
+    if 0 < offset or offset == -0x8000:
+        return BinaryExpr("+", base, IntegerConstant(offset))
+    return BinaryExpr("-", base, IntegerConstant(-offset))
+
+
+def simplify_binary(op, left, right):
+    """
+    Returns the simplest expression equal to `left op right`, where both operands are already folded.
+    """
+    left_value = constant_value(left)
+    right_value = constant_value(right)
+
+    if left_value is not None and right_value is not None:
+        result = FOLDS[op](left_value, right_value)
+        if result is not None:
+            return IntegerConstant(to_word(result))
+        return BinaryExpr(op, left, right)
+
+    if right_value is not None:
+        if op in "+-":
+            offset = right_value if op == "+" else -right_value
+            # (x + c1) + c2 is x + (c1 + c2)
+            if left.type == "binaryExpr" and left.op in "+-":
+                inner_value = constant_value(left.right)
+                if inner_value is not None:
+                    return add_offset(left.left, offset + (inner_value if left.op == "+" else -inner_value))
+            return add_offset(left, offset)
+        if (op in "*/" and right_value == 1) or (op == "|" and right_value == 0) or (op == "&" and right_value == TRUE):
+            return left
+        if op in "*/" and right_value == -1:
+            return simplify_unary("-", left)
+        if not has_call(left) and ((op in "*&" and right_value == 0) or (op == "|" and right_value == TRUE)):
+            return IntegerConstant(right_value)
+        # (x & c1) & c2 is x & (c1 & c2), and the same for | and *
+        if op in "&|*" and left.type == "binaryExpr" and left.op == op:
+            inner_value = constant_value(left.right)
+            if inner_value is not None:
+                return simplify_binary(op, left.left, IntegerConstant(to_word(FOLDS[op](inner_value, right_value))))
+
+    if left_value is not None:
+        if (op in "+|" and left_value == 0) or (op == "*" and left_value == 1) or (op == "&" and left_value == TRUE):
+            return right
+        if op == "*" and left_value == -1:
+            return simplify_unary("-", right)
+        if op == "-" and left_value == 0:
+            return simplify_unary("-", right)
+        if not has_call(right) and ((op in "*&" and left_value == 0) or (op == "|" and left_value == TRUE)):
+            return IntegerConstant(left_value)
+
+    return BinaryExpr(op, left, right)
+
+
+def simplify_unary(op, operand):
+    value = constant_value(operand)
+    if value is not None:
+        return IntegerConstant(to_word(UNARY_FOLDS[op](value)))
+    # --x and ~~x are x
+    if operand.type == "unaryExpr" and operand.op == op:
+        return operand.operand
+    return UnaryExpr(op, operand)
+
+
+def fold_expression(node):
+    """
+    Returns a simplified copy of an expression. Nodes that do not change are shared with the original tree.
+    """
+    match node.type:
+        case "binaryExpr":
+            # Walk the left spine with a loop, long chains like a + b + c + ... would overflow the Python stack
+            operations = []
+            while node.type == "binaryExpr":
+                operations.append(node)
+                node = node.left
+            result = fold_expression(node)
+            for operation in reversed(operations):
+                result = simplify_binary(operation.op, result, fold_expression(operation.right))
+            return result
+        case "unaryExpr":
+            return simplify_unary(node.op, fold_expression(node.operand))
+        case "parenExpr":
+            # Parentheses only group, the tree already says the same
+            return fold_expression(node.expression)
+        case "arrayAccess":
+            return ArrayAccess(node.name, fold_expression(node.index))
+        case "subroutineCall":
+            return SubroutineCall(node.receiver, node.name, [fold_expression(argument) for argument in node.arguments])
+        case _:
+            return node
+
+
+def fold_statements(statements):
+    """
+    Folds the expressions of a list of statements in place, and returns the list without the branches that can never run.
+    """
+    folded = []
+    for statement in statements:
+        match statement.type:
+            case "letStatement":
+                if statement.index is not None:
+                    statement.index = fold_expression(statement.index)
+                statement.value = fold_expression(statement.value)
+            case "doStatement":
+                statement.call = fold_expression(statement.call)
+            case "returnStatement":
+                if statement.value is not None:
+                    statement.value = fold_expression(statement.value)
+            case "ifStatement":
+                statement.condition = fold_expression(statement.condition)
+                value = constant_value(statement.condition)
+                # The code for `if` jumps away when `not condition` is 0, so only -1 takes the first branch: `if (1)` runs the else
+                if value is not None:
+                    folded.extend(fold_statements(statement.statements if value == TRUE else statement.else_statements or []))
+                    continue
+                statement.statements = fold_statements(statement.statements)
+                if statement.else_statements is not None:
+                    statement.else_statements = fold_statements(statement.else_statements)
+            case "whileStatement":
+                statement.condition = fold_expression(statement.condition)
+                value = constant_value(statement.condition)
+                if value is not None and value != TRUE:
+                    continue
+                statement.statements = fold_statements(statement.statements)
+        folded.append(statement)
+    return folded
+
+
+def fold_class(class_node):
+    """
+    Runs every simplification on a class, in place, and returns it.
+    """
+    for subroutine in class_node.subroutine_decs:
+        subroutine.statements = fold_statements(subroutine.statements)
+    return class_node
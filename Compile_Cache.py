@@ -0,0 +1,95 @@
+"""
+The incremental compilation cache of a directory, kept in <directory>/.jack_cache.json.
+For every .jack file it remembers:
+1. The hash of the source it was compiled from.
+2. The name of the class and its signature (the kind, types and name of each subroutine), which is what other classes compile against.
+3. The signature of every class of the directory that the file calls, as it was when the file was compiled.
+4. The VM code, so a deleted or edited .vm file can be restored without compiling, and the Jack line of each of its instructions for the source map.
+The whole cache is dropped when the compiler version changes.
+"""
+import hashlib
+import json
+import os
+
+CACHE_FILENAME = ".jack_cache.json"
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def class_signature(class_node):
+    # Two versions of a class have the same signature if a caller could not tell them apart
+    declarations = [
+        f"{subroutine.kind} {subroutine.return_type} {subroutine.name}({','.join(var_type for var_type, _ in subroutine.parameters)})"
+        for subroutine in class_node.subroutine_decs
+    ]
+    return hash_text(f"{class_node.name}:" + ";".join(declarations))[:16]
+
+
+def called_classes(vm_instructions):
+    """
+    Returns the names of the classes called by a list of VM instructions (`call Class.subroutine.n n`).
+    """
+    return {instruction.split()[1].split(".")[0] for instruction in vm_instructions if instruction.startswith("call ")}
+
+
+class A_Compile_Cache:
+    def __init__(self, directory, compiler_version):
+        self.path = os.path.join(directory, CACHE_FILENAME)
+        self.compiler_version = compiler_version
+        self.entries = {}
+        self.modified = False
+        try:
+            with open(self.path, "r") as cache_file:
+                saved = json.load(cache_file)
+            if saved.get("compiler_version") == compiler_version:
+                self.entries = saved["files"]
+        except (OSError, ValueError, KeyError):
+            # A missing or unreadable cache just means everything gets compiled
+            self.entries = {}
+
+    def lookup(self, filename, source_hash):
+        """
+        Returns the entry of a file if it was compiled from exactly this source, None otherwise.
+        """
+        entry = self.entries.get(filename)
+        if entry and entry["source_hash"] == source_hash:
+            return entry
+        return None
+
+    def is_up_to_date(self, entry, signatures):
+        """
+        An entry is still valid if every class it called still has the signature it was compiled against.
+        """
+        return all(signatures.get(class_name) == signature for class_name, signature in entry["dependencies"].items())
+
+    def store(self, filename, source_hash, class_name, signature, dependencies, vm_code, jack_lines):
+        self.entries[filename] = {
+            "source_hash": source_hash,
+            "class_name": class_name,
+            "signature": signature,
+            "dependencies": dependencies,
+            "vm_hash": hash_text(vm_code),
+            "vm": vm_code,
+            "jack_lines": jack_lines,
+        }
+        self.modified = True
+
+    def forget(self, filename):
+        if self.entries.pop(filename, None) is not None:
+            self.modified = True
+
+    def keep_only(self, filenames):
+        # Drop the entries of deleted files
+        for filename in set(self.entries) - set(filenames):
+            self.forget(filename)
+
+    def save(self):
+        if not self.modified and os.path.exists(self.path):
+            return
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as cache_file:
+            cache_file.write(json.dumps({"compiler_version": self.compiler_version, "files": self.entries}))
+        os.replace(temporary_path, self.path)
+        self.modified = False
@@ -0,0 +1,169 @@
+"""
+The Hack assembler, in Python so a program can go from .vm to .hack in one process. It does the same as assembler.lua:
+1. First pass: every (LABEL) gets the address of the next instruction, and MACRO_name ... MEND blocks are put aside.
+2. Second pass: @value and the predefined symbols, R0 to R15 among them, are encoded, other symbols are variables from address 16 to 255.
+   A C-instruction dest=comp;jump is encoded from its three fields: 111, a and the 6 comp bits, the 3 dest bits, the 3 jump bits.
+   A line naming a macro is replaced by the lines of the macro, which are already binary.
+The input is either .asm text or the assembly VM_translator builds in memory, as a list of texts of one or more lines.
+Spaces are ignored everywhere, like the Lua version does.
+Unlike the Lua version, R16 and up are ordinary variables, and running out of addresses for the variables is an error.
+"""
+import sys
+import os
+import argparse
+from Source_Map import write_map
+
+PREDEFINED_SYMBOLS = {"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4, "SCREEN": 16384, "KBD": 24576}
+PREDEFINED_SYMBOLS.update({f"R{register}": register for register in range(16)})
+# The variables end where the stack starts
+FIRST_VARIABLE_ADDRESS = 16
+LAST_VARIABLE_ADDRESS = 255
+
+# The a bit and the 6 c bits of every computation using A. The same computation on M has M instead of A, and the a bit set
+A_COMPUTATIONS = {
+    "0": 0b0101010, "1": 0b0111111, "-1": 0b0111010,
+    "D": 0b0001100, "A": 0b0110000, "!D": 0b0001101, "!A": 0b0110001, "-D": 0b0001111, "-A": 0b0110011,
+    "D+1": 0b0011111, "A+1": 0b0110111, "D-1": 0b0001110, "A-1": 0b0110010,
+    "D+A": 0b0000010, "D-A": 0b0010011, "A-D": 0b0000111, "D&A": 0b0000000, "D|A": 0b0010101,
+    # The same operations written the other way around
+    "1+D": 0b0011111, "1+A": 0b0110111, "A+D": 0b0000010, "A&D": 0b0000000, "A|D": 0b0010101,
+}
+COMPUTATIONS = dict(A_COMPUTATIONS)
+COMPUTATIONS.update({computation.replace("A", "M"): bits | 0b1000000 for computation, bits in A_COMPUTATIONS.items() if "A" in computation})
+DESTINATION_BITS = {"A": 0b100, "D": 0b010, "M": 0b001}
+JUMPS = {"": 0, "JGT": 1, "JEQ": 2, "JGE": 3, "JLT": 4, "JNE": 5, "JLE": 6, "JMP": 7}
+
+
+def numbered_lines(asm):
+    """
+    Yields (line number, instruction) for the instructions of assembly given as a text or as a list of texts, without spaces,
+    comments and blank lines. A list is numbered like the text it makes when joined, which is what VM_translator writes to the .asm file.
+    """
+    text = asm if isinstance(asm, str) else "".join(asm)
+    for number, line in enumerate(text.split("\n"), 1):
+        line = line.split("//")[0].replace(" ", "").replace("\t", "").replace("\r", "")
+        if line:
+            yield number, line
+
+
+def clean_lines(asm):
+    """
+    Yields the instructions of assembly given as a text or as a list of texts, without spaces, comments and blank lines.
+    """
+    for _, line in numbered_lines(asm):
+        yield line
+
+
+def encode_computation(instruction: str) -> int:
+    destination, _, rest = instruction.rpartition("=")
+    computation, _, jump = rest.partition(";")
+    if computation not in COMPUTATIONS or jump not in JUMPS:
+        raise ValueError(f"Unknown C-instruction: {instruction}")
+    destination_bits = 0
+    for register in destination:
+        if register not in DESTINATION_BITS:
+            raise ValueError(f"Unknown destination in C-instruction: {instruction}")
+        destination_bits |= DESTINATION_BITS[register]
+    return 0b111 << 13 | COMPUTATIONS[computation] << 6 | destination_bits << 3 | JUMPS[jump]
+
+
+def assemble(asm):
+    """
+    Returns the machine code of assembly given as a text or as a list of texts, as a list of 16 bit words.
+    """
+    return assemble_program(asm)[0]
+
+
+def assemble_program(asm):
+    """
+    Same as assemble, and also returns the address of every label and the line of the assembly every word comes from,
+    for the tools that run the program like Hack_Profiler and for the source map of the .hack file.
+    """
+    symbols = dict(PREDEFINED_SYMBOLS)
+    labels = {}
+    macros = {}
+    instructions = []
+    instruction_lines = []
+    macro_name = None
+    for number, line in numbered_lines(asm):
+        if macro_name is not None:
+            if line.startswith("MEND"):
+                macro_name = None
+            else:
+                macros[macro_name].append(int(line, 2))
+        elif line.startswith("MACRO_"):
+            macro_name = line[len("MACRO_"):]
+            macros[macro_name] = []
+        elif line.startswith("("):
+            symbols[line[1:-1]] = labels[line[1:-1]] = len(instructions)
+        else:
+            instructions.append(line)
+            instruction_lines.append(number)
+
+    words = []
+    asm_lines = []
+    next_variable = FIRST_VARIABLE_ADDRESS
+    for instruction, number in zip(instructions, instruction_lines):
+        if instruction in macros:
+            # Every word of a macro comes from the line naming it
+            words.extend(macros[instruction])
+            asm_lines.extend([number] * len(macros[instruction]))
+            continue
+        asm_lines.append(number)
+        if instruction.startswith("@"):
+            value = instruction[1:]
+            if value.isdigit():
+                address = int(value)
+            else:
+                if value not in symbols:
+                    if next_variable > LAST_VARIABLE_ADDRESS:
+                        raise ValueError(f"Out of variable addresses, {value} would be at {next_variable}: {instruction}")
+                    symbols[value] = next_variable
+                    next_variable += 1
+                address = symbols[value]
+            if address > 0x7FFF:
+                raise ValueError(f"A-instruction out of range: {instruction}")
+            words.append(address)
+        else:
+            words.append(encode_computation(instruction))
+    return words, labels, asm_lines
+
+
+def write_hack(words, hack_filename: str) -> None:
+    """
+    Writes machine code to a .hack file, one binary word per line, in a single write.
+    """
+    with open(hack_filename, "w") as hack_file:
+        hack_file.write("".join(f"{word:016b}\n" for word in words))
+
+
+def assemble_file(asm_filename: str, source_map: bool = False) -> str:
+    """
+    Assembles foo.asm into foo.hack next to it, and returns the name of the .hack file.
+    With source_map, the line of foo.asm of every word goes to foo.hack.map, see Source_Map.
+    """
+    print(f"Processing:\t{asm_filename}")
+    with open(asm_filename, "r") as asm_file:
+        words, _, asm_lines = assemble_program(asm_file.read())
+    hack_filename = os.path.splitext(asm_filename)[0] + ".hack"
+    write_hack(words, hack_filename)
+    if source_map:
+        write_map(hack_filename, os.path.basename(asm_filename), asm_lines)
+    print(f"Assembled {asm_filename} -> {hack_filename}")
+    return hack_filename
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Assembles a .asm file, or every .asm file of a directory, into .hack files")
+    argument_parser.add_argument("path", help="a .asm file or a directory containing .asm files")
+    argument_parser.add_argument("--source-map", action="store_true", help="write the .asm line of every word to a .hack.map file next to each .hack file")
+    arguments = argument_parser.parse_args()
+    if os.path.isdir(arguments.path):
+        for filename in sorted(os.listdir(arguments.path)):
+            if filename.endswith(".asm"):
+                assemble_file(os.path.join(arguments.path, filename), arguments.source_map)
+    elif os.path.isfile(arguments.path):
+        assemble_file(arguments.path, arguments.source_map)
+    else:
+        print(f"Error: {arguments.path} does not exist")
+        sys.exit(1)
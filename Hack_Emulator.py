@@ -0,0 +1,335 @@
+"""
+An emulator of the Hack computer, to run the output of the toolchain without the CPU emulator of the course and to count its cycles.
+1. The ROM is decoded once: an A-instruction becomes its value, a C-instruction a tuple of the ALU function it computes,
+   whether it reads M, which registers it writes and the jump table of its condition. The run loop only unpacks them.
+2. RAM is a list of 32K unsigned 16 bit words, kept in range by every ALU function. NumPy is not a dependency of the toolchain.
+3. The screen is RAM[16384..24575], 32 words per row of 512 pixels with the lowest bit on the left, and the keyboard is RAM[24576].
+4. Programs end in an endless loop, like `(HALT) @HALT 0;JMP` or Sys.halt. A jump to the A-instruction right before it stops the run.
+5. run_compiled does not dispatch every instruction: the basic block from each address the program enters, up to the next jump,
+   is compiled once into a Python function that runs the whole block and returns A, D and the next pc.
+   Inside a block the value of A is known after every @value, so `@SP AM=M+1` becomes `ram[0] = A = (ram[0] + 1) & 65535`.
+   The blocks are cached per ROM, by hash, so every computer running the same program shares them.
+   The last instructions before max_cycles, and computations outside the Hack specification, go through the interpreter.
+One instruction is one cycle.
+"""
+import sys
+import argparse
+import hashlib
+from array import array
+
+RAM_SIZE = 32768
+ROM_SIZE = 32768
+SCREEN = 16384
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = 256
+WORDS_PER_ROW = SCREEN_WIDTH // 16
+KBD = 24576
+
+
+def to_signed(word: int) -> int:
+    return word - 0x10000 if word & 0x8000 else word
+
+
+def general_alu(control: int):
+    # The ALU of the Hack CPU for any 6 control bits: zx nx zy ny f no
+    def compute(x, y):
+        if control & 32:
+            x = 0
+        if control & 16:
+            x = ~x
+        if control & 8:
+            y = 0
+        if control & 4:
+            y = ~y
+        result = x + y if control & 2 else x & y
+        if control & 1:
+            result = ~result
+        return result & 0xFFFF
+    return compute
+
+
+# The computations of the Hack specification, on D (x) and on A or M (y), written out since they run for every instruction
+ALU_FUNCTIONS = {
+    0b101010: lambda x, y: 0,
+    0b111111: lambda x, y: 1,
+    0b111010: lambda x, y: 0xFFFF,
+    0b001100: lambda x, y: x,
+    0b110000: lambda x, y: y,
+    0b001101: lambda x, y: x ^ 0xFFFF,
+    0b110001: lambda x, y: y ^ 0xFFFF,
+    0b001111: lambda x, y: -x & 0xFFFF,
+    0b110011: lambda x, y: -y & 0xFFFF,
+    0b011111: lambda x, y: (x + 1) & 0xFFFF,
+    0b110111: lambda x, y: (y + 1) & 0xFFFF,
+    0b001110: lambda x, y: (x - 1) & 0xFFFF,
+    0b110010: lambda x, y: (y - 1) & 0xFFFF,
+    0b000010: lambda x, y: (x + y) & 0xFFFF,
+    0b010011: lambda x, y: (x - y) & 0xFFFF,
+    0b000111: lambda x, y: (y - x) & 0xFFFF,
+    0b000000: lambda x, y: x & y,
+    0b010101: lambda x, y: x | y,
+}
+
+
+# The same computations as Python expressions, for compiled blocks
+ALU_EXPRESSIONS = {
+    0b101010: "0",
+    0b111111: "1",
+    0b111010: "65535",
+    0b001100: "{x}",
+    0b110000: "{y}",
+    0b001101: "{x} ^ 65535",
+    0b110001: "{y} ^ 65535",
+    0b001111: "-{x} & 65535",
+    0b110011: "-{y} & 65535",
+    0b011111: "({x} + 1) & 65535",
+    0b110111: "({y} + 1) & 65535",
+    0b001110: "({x} - 1) & 65535",
+    0b110010: "({y} - 1) & 65535",
+    0b000010: "({x} + {y}) & 65535",
+    0b010011: "({x} - {y}) & 65535",
+    0b000111: "({y} - {x}) & 65535",
+    0b000000: "{x} & {y}",
+    0b010101: "{x} | {y}",
+}
+# When each jump is taken, on the result v of the computation
+JUMP_CONDITIONS = [None, "0 < v < 32768", "v == 0", "v < 32768", "v >= 32768", "v != 0", "v == 0 or v >= 32768", "True"]
+
+
+def jump_table(condition: int):
+    # For the 3 jump bits (lt eq gt), whether the jump is taken for every 16 bit result, None if it never is
+    if condition == 0:
+        return None
+    return bytes(
+        bool((condition & 4 and word & 0x8000) or (condition & 2 and word == 0) or (condition & 1 and 0 < word < 0x8000))
+        for word in range(0x10000)
+    )
+
+
+JUMP_TABLES = [jump_table(condition) for condition in range(8)]
+# A jump to the A-instruction right before it, which the decoder puts instead of the C-instruction
+HALT = "halt"
+
+
+def decode_instruction(word: int):
+    if not word & 0x8000:
+        return word
+    control = (word >> 6) & 0b111111
+    compute = ALU_FUNCTIONS.get(control) or general_alu(control)
+    return (compute, bool(word & 0x1000), bool(word & 0b001000), bool(word & 0b010000), bool(word & 0b100000), JUMP_TABLES[word & 0b111])
+
+
+def decode_program(words):
+    """
+    Decodes every word of a program once, see decode_instruction. The endless loops that end programs become HALT.
+    """
+    program = [decode_instruction(word) for word in words]
+    for address in range(1, len(words)):
+        instruction = program[address]
+        if instruction.__class__ is tuple and words[address] & 0b111 == 0b111 and not words[address] & 0b111000 and words[address - 1] == address - 1:
+            program[address] = HALT
+    return program
+
+
+def compile_block(words, start: int, ends=frozenset()):
+    """
+    Returns the function running the basic block that starts at start, and how many instructions it takes,
+    or None when the first instruction has to be interpreted. See item 5. The block also ends before any address in ends.
+    """
+    lines = []
+    known_A = None
+    address = start
+    end = len(words)
+    next_pc = None
+    while address < end and (address == start or address not in ends):
+        word = words[address]
+        if not word & 0x8000:
+            known_A = word
+            address += 1
+            continue
+        control = (word >> 6) & 0b111111
+        condition = word & 0b111
+        halts = condition == 0b111 and not word & 0b111000 and words[address - 1] == address - 1 if address else False
+        if control not in ALU_EXPRESSIONS or halts:
+            # Left to the interpreter, the block ends right before it
+            next_pc = address
+            break
+        a = "A" if known_A is None else str(known_A)
+        y = f"ram[{a}]" if word & 0x1000 else a
+        value = ALU_EXPRESSIONS[control].format(x="D", y=y)
+        targets = [target for bit, target in ((0b001000, f"ram[{a}]"), (0b010000, "D"), (0b100000, "A")) if word & bit]
+        if condition:
+            # The jump goes to A as it was before the instruction, and ends the block
+            jump_target = a
+            if "A" in targets and known_A is None:
+                lines.append("t = A")
+                jump_target = "t"
+            if condition == 0b111:
+                if targets:
+                    lines.append(f"{' = '.join(targets)} = {value}")
+            else:
+                lines.append(f"{' = '.join(targets + ['v'])} = {value}")
+            known_A = None if "A" in targets else known_A
+            address += 1
+            if condition == 0b111:
+                next_pc = jump_target
+            else:
+                next_pc = f"{jump_target} if {JUMP_CONDITIONS[condition]} else {address}"
+            break
+        if targets:
+            # Python assigns from left to right: M is written at the old A before A changes
+            lines.append(f"{' = '.join(targets)} = {value}")
+        if "A" in targets:
+            known_A = None
+        address += 1
+    if address == start:
+        return None
+    if next_pc is None:
+        next_pc = address
+    final_A = "A" if known_A is None else str(known_A)
+    source = f"def block(ram, A, D):\n" + "".join(f"    {line}\n" for line in lines) + f"    return {final_A}, D, {next_pc}\n"
+    namespace = {}
+    exec(compile(source, f"<block {start}>", "exec"), namespace)
+    return namespace["block"], address - start
+
+
+# The compiled blocks of every ROM run so far, by the hash of the ROM
+BLOCK_CACHE = {}
+
+
+def read_hack(hack_filename: str) -> list:
+    """
+    Returns the words of a .hack file, one binary number per line like Hack_Assembler and assembler.lua write them.
+    """
+    with open(hack_filename, "r") as hack_file:
+        return [int(line, 2) for line in hack_file.read().split()]
+
+
+class A_Hack_Computer:
+    def __init__(self, words):
+        if len(words) > ROM_SIZE:
+            raise ValueError(f"The program takes {len(words)} words, the ROM holds {ROM_SIZE}")
+        self.rom = array("H", words)
+        self.program = decode_program(words)
+        # Filled in as run_compiled enters each address: the block from there, or False when it is interpreted
+        self.rom_hash = hashlib.sha1(self.rom.tobytes()).hexdigest()
+        self.blocks = BLOCK_CACHE.setdefault(self.rom_hash, [None] * len(words))
+        self.reset()
+
+    def reset(self):
+        # RAM is cleared and the CPU starts again from address 0
+        self.ram = [0] * RAM_SIZE
+        self.A = 0
+        self.D = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def set_key(self, key_code: int):
+        # The code of the key pressed, 0 for none
+        self.ram[KBD] = key_code & 0xFFFF
+
+    def pixel(self, x: int, y: int) -> bool:
+        return bool(self.ram[SCREEN + y * WORDS_PER_ROW + x // 16] >> (x % 16) & 1)
+
+    def screen_rows(self):
+        """
+        Returns the screen as SCREEN_HEIGHT strings of SCREEN_WIDTH characters, # for a black pixel.
+        """
+        rows = []
+        for y in range(SCREEN_HEIGHT):
+            row_words = self.ram[SCREEN + y * WORDS_PER_ROW:SCREEN + (y + 1) * WORDS_PER_ROW]
+            rows.append("".join("#" if word >> bit & 1 else "." for word in row_words for bit in range(16)))
+        return rows
+
+    def run(self, max_cycles=None) -> int:
+        """
+        Runs until the program halts, leaves the ROM or max_cycles instructions were executed. Returns how many were.
+        """
+        program = self.program
+        ram = self.ram
+        A, D, pc = self.A, self.D, self.pc
+        end = len(program)
+        limit = float("inf") if max_cycles is None else max_cycles
+        cycles = 0
+        while cycles < limit and pc < end:
+            instruction = program[pc]
+            if instruction.__class__ is int:
+                A = instruction
+                pc += 1
+                cycles += 1
+                continue
+            if instruction is HALT:
+                self.halted = True
+                break
+            compute, reads_M, writes_M, writes_D, writes_A, jump = instruction
+            value = compute(D, ram[A] if reads_M else A)
+            cycles += 1
+            if writes_M:
+                ram[A] = value
+            if writes_D:
+                D = value
+            # The jump goes to A as it was before the instruction
+            if jump is not None and jump[value]:
+                pc = A
+            else:
+                pc += 1
+            if writes_A:
+                A = value
+        self.A, self.D, self.pc = A, D, pc
+        self.cycles += cycles
+        return cycles
+
+    def run_compiled(self, max_cycles=None) -> int:
+        """
+        Same as run, by compiled basic blocks, see item 5.
+        """
+        blocks = self.blocks
+        words = self.rom
+        ram = self.ram
+        A, D, pc = self.A, self.D, self.pc
+        end = len(blocks)
+        limit = float("inf") if max_cycles is None else max_cycles
+        compiled_cycles = interpreted_cycles = 0
+        while True:
+            while pc < end:
+                block = blocks[pc]
+                if block is None:
+                    block = blocks[pc] = compile_block(words, pc) or False
+                if block is False or compiled_cycles + interpreted_cycles + block[1] > limit:
+                    break
+                A, D, pc = block[0](ram, A, D)
+                compiled_cycles += block[1]
+            self.A, self.D, self.pc = A, D, pc
+            if pc >= end or compiled_cycles + interpreted_cycles >= limit:
+                break
+            # One instruction the blocks leave out, or the last ones before max_cycles
+            steps = 1 if blocks[pc] is False else limit - compiled_cycles - interpreted_cycles
+            interpreted_cycles += self.run(steps)
+            if self.halted:
+                break
+            A, D, pc = self.A, self.D, self.pc
+        self.cycles += compiled_cycles
+        return compiled_cycles + interpreted_cycles
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Runs a .hack program on an emulated Hack computer")
+    argument_parser.add_argument("program", help="a .hack file")
+    argument_parser.add_argument("--max-cycles", type=int, default=None, help="stop after this many instructions")
+    argument_parser.add_argument("--ram", nargs=2, type=int, metavar=("START", "COUNT"), help="print COUNT words of RAM from START when done")
+    argument_parser.add_argument("--interpreted", action="store_true", help="run one instruction at a time instead of by compiled blocks")
+    argument_parser.add_argument("--screen", action="store_true", help="print the screen when done")
+    arguments = argument_parser.parse_args()
+    computer = A_Hack_Computer(read_hack(arguments.program))
+    if arguments.interpreted:
+        computer.run(arguments.max_cycles)
+    else:
+        computer.run_compiled(arguments.max_cycles)
+    print(f"{computer.cycles} cycles, {'halted' if computer.halted else 'stopped'} at {computer.pc}")
+    if arguments.ram:
+        start, count = arguments.ram
+        print([to_signed(word) for word in computer.ram[start:start + count]])
+    if arguments.screen:
+        print("\n".join(computer.screen_rows()))
+    sys.exit(0)
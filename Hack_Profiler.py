@@ -0,0 +1,238 @@
+"""
+A profiler of compiled Jack programs, which runs them on Hack_Emulator and tells in which function every cycle was spent.
+1. Every function starts at the label VM_translator.convert_function writes for it, and every routine of starter_code.txt at its own label.
+   Each ROM address belongs to the function or routine of the closest of these labels before it, the bootstrap code to "bootstrap".
+   Other labels, like `Main.main.0$WHILE_EXP0` or the return labels of comparisons, stay in the function they are in.
+2. The program runs by the blocks of Hack_Emulator.compile_block, which end at the start of every function, so each block runs in one.
+3. The call stack follows the calling convention instead of the stack in RAM:
+   a call routine or COMP_BEGIN is pushed when a function jumps to it, and a call routine is replaced by the function it jumps to.
+   A return routine is pushed too, and leaves with the function that returned once it jumps back to the caller.
+4. The cycles of every block are added to the call stack it ran in. Exclusive cycles are those of the stacks a function is on top of,
+   inclusive cycles those of the stacks it is anywhere in, counted once for recursive calls.
+5. How many times every block ran gives the cycles of every ROM address, which the source maps (see Source_Map) turn into cycles per Jack line.
+The stacks are written in the collapsed format of flamegraph.pl, one `bootstrap;Sys.init.0;Main.main.0 1234` line per stack.
+"""
+import sys
+import argparse
+import re
+from Hack_Assembler import assemble_program
+from Hack_Emulator import A_Hack_Computer, compile_block
+from Source_Map import A_Source_Map
+
+BOOTSTRAP = "bootstrap"
+CALL_ROUTINES = {"CALL", "CALL_NO_ARGUMENTS", "CALL_LIGHT", "CALL_LIGHT_NO_ARGUMENTS"}
+RETURN_ROUTINES = {"RETURN", "RETURN_LIGHT"}
+COMPARISON_ROUTINE = "COMP_BEGIN"
+ROUTINES = CALL_ROUTINES | RETURN_ROUTINES | {COMPARISON_ROUTINE}
+# The end of the starter code, jumped over once at the start, and the labels inside COMP_BEGIN
+STARTER_SKIPS = {"SKIPo", "SKIP"}
+COMPARISON_ROUTINE_LABELS = {"EQ_BEGIN", "LT_BEGIN", "RETURN_TRUE", "RETURN_FALSE", "COMPLETE"}
+# The labels of the comparisons of a function, function.lt.0 and so on, see VM_translator.convert_Compare_Instruction
+COMPARISON_LABEL = re.compile(r"^(.*)\.(lt|gt|eq)\.\d+$")
+
+
+def function_labels(labels):
+    """
+    Returns the address of every function and routine of a program, from the addresses of its labels. See item 1.
+    """
+    starts = {}
+    for label, address in labels.items():
+        comparison = COMPARISON_LABEL.match(label)
+        if "$" in label or label in COMPARISON_ROUTINE_LABELS or (comparison and comparison.group(1) in labels):
+            continue
+        starts[label] = address
+    return starts
+
+
+def address_regions(labels, rom_size: int):
+    """
+    Returns, for every ROM address, the name of the function or routine it belongs to.
+    """
+    starts = sorted((address, BOOTSTRAP if label in STARTER_SKIPS else label) for label, address in function_labels(labels).items())
+    regions = [BOOTSTRAP] * rom_size
+    for i, (address, name) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else rom_size
+        regions[address:end] = [name] * (end - address)
+    return regions[:rom_size]
+
+
+class A_Profiler:
+    def __init__(self, words, labels):
+        self.computer = A_Hack_Computer(words)
+        self.regions = address_regions(labels, len(words))
+        self.region_starts = frozenset(address for address in range(len(words)) if address == 0 or self.regions[address] != self.regions[address - 1])
+        self.blocks = [None] * len(words)
+        # How many times the block of every address ran, and the instructions interpreted there
+        self.block_runs = [0] * len(words)
+        self.interpreted_runs = [0] * len(words)
+        # The cycles of every call stack, the calls of every function and of every caller to callee edge
+        self.stacks = {}
+        self.calls = {}
+        self.edges = {}
+
+    def enter(self, stack, region):
+        # The call stack once the program jumps into region, see item 3
+        top = stack[-1]
+        if region in ROUTINES:
+            self.calls[region] = self.calls.get(region, 0) + 1
+            self.edges[top, region] = self.edges.get((top, region), 0) + 1
+            return stack + (region,)
+        if top in CALL_ROUTINES and len(stack) > 1:
+            caller = stack[-2]
+            self.calls[region] = self.calls.get(region, 0) + 1
+            self.edges[caller, region] = self.edges.get((caller, region), 0) + 1
+            return stack[:-1] + (region,)
+        if top in RETURN_ROUTINES:
+            stack = stack[:-2]
+        elif top == COMPARISON_ROUTINE:
+            stack = stack[:-1]
+        # Back in a function of the stack, or somewhere the calling convention does not explain
+        if region in stack:
+            return stack[:len(stack) - stack[::-1].index(region)]
+        return stack[:-1] + (region,) if stack else (region,)
+
+    def run(self, max_cycles=None) -> int:
+        """
+        Runs the program like A_Hack_Computer.run_compiled, adding up the cycles of every call stack. Returns how many were run.
+        """
+        computer = self.computer
+        blocks = self.blocks
+        regions = self.regions
+        stacks = self.stacks
+        block_runs = self.block_runs
+        words = computer.rom
+        ram = computer.ram
+        A, D, pc = computer.A, computer.D, computer.pc
+        end = len(blocks)
+        limit = float("inf") if max_cycles is None else max_cycles
+        stack = (regions[pc],) if pc < end else (BOOTSTRAP,)
+        region = stack[-1]
+        cycles = 0
+        while pc < end and cycles < limit and not computer.halted:
+            if regions[pc] is not region:
+                region = regions[pc]
+                stack = self.enter(stack, region)
+            block = blocks[pc]
+            if block is None:
+                block = blocks[pc] = compile_block(words, pc, self.region_starts) or False
+            if block is False or cycles + block[1] > limit:
+                # Interpreted one instruction at a time, like in run_compiled
+                computer.A, computer.D, computer.pc = A, D, pc
+                ran = computer.run(1)
+                computer.cycles -= ran
+                self.interpreted_runs[pc] += ran
+                A, D, pc = computer.A, computer.D, computer.pc
+            else:
+                block_runs[pc] += 1
+                A, D, pc = block[0](ram, A, D)
+                ran = block[1]
+            stacks[stack] = stacks.get(stack, 0) + ran
+            cycles += ran
+        computer.A, computer.D, computer.pc = A, D, pc
+        computer.cycles += cycles
+        return cycles
+
+    def exclusive_cycles(self):
+        totals = {}
+        for stack, cycles in self.stacks.items():
+            totals[stack[-1]] = totals.get(stack[-1], 0) + cycles
+        return totals
+
+    def inclusive_cycles(self):
+        totals = {}
+        for stack, cycles in self.stacks.items():
+            for name in set(stack):
+                totals[name] = totals.get(name, 0) + cycles
+        return totals
+
+    def edge_cycles(self):
+        # The cycles spent in a callee called from a caller, inclusive, for every edge
+        totals = {}
+        for stack, cycles in self.stacks.items():
+            for edge in set(zip(stack, stack[1:])):
+                totals[edge] = totals.get(edge, 0) + cycles
+        return totals
+
+    def address_cycles(self):
+        """
+        Returns the cycles spent on every ROM address.
+        """
+        cycles = list(self.interpreted_runs)
+        for start, runs in enumerate(self.block_runs):
+            if runs:
+                for address in range(start, start + self.blocks[start][1]):
+                    cycles[address] += runs
+        return cycles
+
+    def line_cycles(self, source_map: A_Source_Map):
+        """
+        Returns the cycles of every (jack file, jack line), and of "bootstrap" for the code that has no Jack line.
+        """
+        totals = {}
+        for jack_line, cycles in zip(source_map.jack_lines(), self.address_cycles()):
+            if cycles:
+                totals[jack_line or BOOTSTRAP] = totals.get(jack_line or BOOTSTRAP, 0) + cycles
+        return totals
+
+    def line_report(self, source_map: A_Source_Map, top: int = 20) -> str:
+        """
+        Returns the Jack lines by cycles, with the ROM words each takes.
+        """
+        total = sum(self.stacks.values()) or 1
+        words = source_map.rom_words_per_line()
+        lines = [f"{'cycles':>10} {'%':>6} {'words':>6}  jack line"]
+        for jack_line, cycles in sorted(self.line_cycles(source_map).items(), key=lambda item: -item[1])[:top]:
+            name = f"{jack_line[0]}:{jack_line[1]}" if jack_line != BOOTSTRAP else "starter code and bootstrap"
+            lines.append(f"{cycles:>10} {cycles / total:>6.1%} {words.get(jack_line, 0):>6}  {name}")
+        return "\n".join(lines)
+
+    def report(self, top: int = 20) -> str:
+        """
+        Returns the functions by exclusive cycles and the call edges by inclusive cycles, the top of each.
+        """
+        total = sum(self.stacks.values()) or 1
+        exclusive = self.exclusive_cycles()
+        inclusive = self.inclusive_cycles()
+        lines = [f"{total} cycles", f"{'exclusive':>10} {'%':>6} {'inclusive':>10} {'%':>6} {'calls':>8}  function"]
+        for name, cycles in sorted(exclusive.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"{cycles:>10} {cycles / total:>6.1%} {inclusive[name]:>10} {inclusive[name] / total:>6.1%} {self.calls.get(name, 0):>8}  {name}")
+        lines.append(f"{'cycles':>10} {'%':>6} {'calls':>8}  call edge")
+        for (caller, callee), cycles in sorted(self.edge_cycles().items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"{cycles:>10} {cycles / total:>6.1%} {self.edges.get((caller, callee), 0):>8}  {caller} -> {callee}")
+        return "\n".join(lines)
+
+    def write_collapsed(self, filename: str) -> None:
+        """
+        Writes the call stacks in the collapsed format of flamegraph.pl, in a single write.
+        """
+        with open(filename, "w") as collapsed_file:
+            collapsed_file.write("".join(f"{';'.join(stack)} {cycles}\n" for stack, cycles in sorted(self.stacks.items()) if cycles))
+
+
+def profile_file(asm_filename: str, max_cycles=None):
+    """
+    Assembles a .asm file in memory and profiles it. Returns the profiler, and the .asm line of every ROM address.
+    """
+    with open(asm_filename, "r") as asm_file:
+        words, labels, asm_lines = assemble_program(asm_file.read())
+    profiler = A_Profiler(words, labels)
+    profiler.run(max_cycles)
+    return profiler, asm_lines
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Runs a .asm program on the emulator and reports the cycles spent in every function")
+    argument_parser.add_argument("program", help="a .asm file, like the combined file of VM_translator")
+    argument_parser.add_argument("--max-cycles", type=int, default=None, help="stop after this many instructions")
+    argument_parser.add_argument("--top", type=int, default=20, help="how many functions and call edges to report")
+    argument_parser.add_argument("--collapsed", metavar="FILE", help="write the call stacks for flamegraph.pl to FILE")
+    argument_parser.add_argument("--lines", action="store_true", help="also report the Jack lines by cycles, from the source maps of the program")
+    arguments = argument_parser.parse_args()
+    profiler, asm_lines = profile_file(arguments.program, arguments.max_cycles)
+    print(profiler.report(arguments.top))
+    if arguments.lines:
+        print(profiler.line_report(A_Source_Map(arguments.program, asm_lines), arguments.top))
+    if arguments.collapsed:
+        profiler.write_collapsed(arguments.collapsed)
+        print(f"Call stacks written to {arguments.collapsed}")
+    sys.exit(0)
@@ -4,13 +4,22 @@ When parsing the tree, there are things that need to be kept in mind
 2. The name of the current subroutine scope.
 3. The Symbol Table (ST) which for a scope maps an identifier to a tuple containing (type, kind, count). Kind refers to either static vs field or local vs argument). 
 4. The current max amount of the four types of variables.
-5. For each subroutine, I want to keep track of the amount of while and if statements. It maps a function name (in the proper {class}.{subroutine}.{arguments} format to a tuple that is (amount_of_while_statements, amount_of_if_statements))
+5. For each subroutine, I want to keep track of the amount of while and if statements. It maps a function name (in the proper {class}.{subroutine}.{arguments} format to a tuple that is (amount_of_while_statements, amount_of_if_statements, amount_of_string_constants))
+6. The string pool of the class, which maps every distinct string constant to the static variable caching it. It holds at most
+   MAX_POOLED_STRINGS strings, and never more than the static segment has room for after the declared statics.
+7. The line of the Jack statement being compiled, which the source map gives every VM instruction emitted meanwhile.
 """
 
 CLASS_INDEX = 0
 SUBROUTINE_INDEX = 1
 WHILE_INDEX = 0
 IF_INDEX = 1
+STRING_INDEX = 2
+STATEMENT_INDEXES = {"while": WHILE_INDEX, "if": IF_INDEX, "string": STRING_INDEX}
+# The statics of all the classes share RAM[16..255]
+STATIC_SEGMENT_SIZE = 240
+# Every pooled string takes a static and the 8 words of its guard in the ROM, which holds 32K words, so a class with many constants would run out of both
+MAX_POOLED_STRINGS = 32
 
 class A_Program_State:
     def __init__(self, a_class_name):
@@ -19,6 +28,8 @@ class A_Program_State:
         self.ST = [{}, {}]
         self.var_counts = {"static": 0, "field": 0, "argument" : 0, "local" : 0}
         self.PT = {}
+        self.string_pool = {}
+        self.line = 0
         
     def __repr__(self):
         print(f"Class: {self.class_name}, Subroutine: {self.subroutine_name}, ST: {self.ST}, Variables: {self.var_counts}")      
@@ -88,16 +99,26 @@ class A_Program_State:
     
     def add_function_statement_counter(self):
         #print(self.get_fuction_declaraction_name())
-        self.PT[self.get_fuction_declaraction_name()] = [0, 0]
+        self.PT[self.get_fuction_declaraction_name()] = [0, 0, 0]
     
     def get_statement_counter(self, statement_type):
         function_name = self.get_fuction_declaraction_name()
         if function_name in self.PT:
-            index = WHILE_INDEX if statement_type == "while" else IF_INDEX
+            index = STATEMENT_INDEXES[statement_type]
             #print(self.PT[function_name][index], function_name, statement_type)
             self.PT[function_name][index] += 1
             return self.PT[function_name][index]
         else:
             print(f"Error: Function '{function_name}' not found in PT.")
 
-                
+    def get_string_slot(self, string):
+        """
+        Returns the number of the static variable caching a string constant. The first use of a string gets a new one, after the declared statics.
+        Returns None once the pool is full, and the string is then built at every evaluation.
+        """
+        if string not in self.string_pool:
+            if len(self.string_pool) >= MAX_POOLED_STRINGS or self.var_counts["static"] >= STATIC_SEGMENT_SIZE:
+                return None
+            self.string_pool[string] = self.var_counts["static"]
+            self.var_counts["static"] += 1
+        return self.string_pool[string]
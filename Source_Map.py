@@ -0,0 +1,156 @@
+"""
+Source maps, which link every ROM address back to the Jack line it was compiled from. Each stage writes one next to its output file,
+with .map added to its name:
+1. better_compiler writes Foo.vm.map, the line of Foo.jack of every line of Foo.vm.
+2. VM_translator writes Prog.asm.map, the .vm file and line of every line of Prog.asm. The bootstrap, the routines of
+   starter_code.txt and the comments have none. Inlining and the peephole optimizer rewrite the VM code before it is translated,
+   so what they produce is matched back to the lines of the .vm file, see instruction_origins. Inlined code goes to the call it replaced.
+3. Hack_Assembler writes Prog.hack.map, the line of Prog.asm of every ROM address.
+A map is JSON, {"source": the file mapped to, "lines": [...]}. Lines start at 1, like in editors.
+Prog.asm.map maps to several files, so its source is null and its lines are [vm file, line] or null.
+A_Source_Map follows the chain from a ROM address to the .asm line, the .vm line and the Jack line.
+"""
+import sys
+import os
+import json
+import argparse
+import difflib
+
+MAP_SUFFIX = ".map"
+SEGMENTS = {"constant", "local", "argument", "this", "that", "pointer", "temp", "static"}
+
+
+def write_map(output_filename: str, source, lines) -> None:
+    """
+    Writes the source map of an output file next to it, in a single write.
+    """
+    with open(output_filename + MAP_SUFFIX, "w") as map_file:
+        map_file.write(json.dumps({"source": source, "lines": lines}))
+
+
+def read_map(output_filename: str):
+    """
+    Returns the source and the lines of the source map of an output file.
+    """
+    with open(output_filename + MAP_SUFFIX, "r") as map_file:
+        saved = json.load(map_file)
+    return saved["source"], saved["lines"]
+
+
+def first_operand(instruction):
+    # "move constant 7 that 0" -> "constant 7", "inplace add local 0 temp 1" -> "local 0", "add" -> None
+    parts = instruction.split()
+    for segment, index in zip(parts, parts[1:]):
+        if segment in SEGMENTS and index.isdigit():
+            return f"{segment} {index}"
+    return None
+
+
+def instruction_origins(original, final):
+    """
+    Returns, for every instruction of final, the position in original of the instruction it comes from.
+    An unchanged instruction comes from itself, and one that was only added from the instruction before it.
+    Instructions that replace others come, in order, from the push of their first operand, since a fused instruction starts
+    with the push it took the place of. Without one among the replaced instructions, they come from the one found before, or the first.
+    """
+    origins = []
+    matcher = difflib.SequenceMatcher(None, original, final, autojunk=False)
+    for tag, original_start, original_end, final_start, final_end in matcher.get_opcodes():
+        if tag == "equal":
+            origins.extend(range(original_start, original_end))
+        elif tag == "replace":
+            next_position = original_start
+            for instruction in final[final_start:final_end]:
+                push = f"push {first_operand(instruction)}"
+                match = next((position for position in range(next_position, original_end) if original[position] == push), None)
+                if match is not None:
+                    next_position = match + 1
+                origins.append(match if match is not None else max(next_position - 1, original_start))
+        elif tag == "insert":
+            origins.extend([max(original_start - 1, 0)] * (final_end - final_start))
+    return origins
+
+
+def line_origins(chunks, origins):
+    """
+    Returns the origin of every line of "".join(chunks), from the origin of every chunk.
+    A line belongs to the chunk its first instruction is in. Blank and comment lines have none.
+    """
+    lines = [None]
+    assigned = False
+    for chunk, origin in zip(chunks, origins):
+        for position, piece in enumerate(chunk.split("\n")):
+            if position:
+                lines.append(None)
+                assigned = False
+            if not assigned and piece.split("//")[0].strip():
+                lines[-1] = origin
+                assigned = True
+    return lines
+
+
+class A_Source_Map:
+    def __init__(self, asm_filename: str, rom_lines=None):
+        """
+        Loads the maps of a translated program from its .asm file. rom_lines, the .asm line of every ROM address,
+        comes from the .hack.map when it is not given.
+        """
+        directory = os.path.dirname(asm_filename)
+        _, self.asm_origins = read_map(asm_filename)
+        if rom_lines is None:
+            _, rom_lines = read_map(os.path.splitext(asm_filename)[0] + ".hack")
+        self.rom_lines = rom_lines
+        self.vm_maps = {}
+        for vm_filename in sorted({origin[0] for origin in self.asm_origins if origin}):
+            try:
+                self.vm_maps[vm_filename] = read_map(os.path.join(directory, vm_filename))
+            except OSError:
+                # A .vm file written by hand has no Jack source
+                pass
+
+    def locate(self, address: int):
+        """
+        Returns (asm line, vm file, vm line, jack file, jack line) for a ROM address, with None for what is not known.
+        """
+        asm_line = self.rom_lines[address]
+        origin = self.asm_origins[asm_line - 1]
+        if origin is None:
+            return asm_line, None, None, None, None
+        vm_filename, vm_line = origin
+        if vm_filename not in self.vm_maps:
+            return asm_line, vm_filename, vm_line, None, None
+        jack_filename, jack_lines = self.vm_maps[vm_filename]
+        return asm_line, vm_filename, vm_line, jack_filename, jack_lines[vm_line - 1]
+
+    def jack_lines(self):
+        """
+        Returns the (jack file, jack line) of every ROM address, None where there is none.
+        """
+        located = [self.locate(address) for address in range(len(self.rom_lines))]
+        return [(jack_filename, jack_line) if jack_filename else None for _, _, _, jack_filename, jack_line in located]
+
+    def rom_words_per_line(self):
+        """
+        Returns how many ROM words every Jack line takes.
+        """
+        words = {}
+        for jack_line in self.jack_lines():
+            if jack_line:
+                words[jack_line] = words.get(jack_line, 0) + 1
+        return words
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Looks up where ROM addresses come from, with the source maps of a translated program")
+    argument_parser.add_argument("program", help="the .asm file of the program, translated and assembled with source maps")
+    argument_parser.add_argument("addresses", nargs="*", type=int, help="ROM addresses to look up, every Jack line and its ROM words without any")
+    arguments = argument_parser.parse_args()
+    source_map = A_Source_Map(arguments.program)
+    if arguments.addresses:
+        for address in arguments.addresses:
+            asm_line, vm_filename, vm_line, jack_filename, jack_line = source_map.locate(address)
+            print(f"{address}: {os.path.basename(arguments.program)}:{asm_line} {vm_filename or '-'}:{vm_line or '-'} {jack_filename or '-'}:{jack_line or '-'}")
+    else:
+        for (jack_filename, jack_line), words in sorted(source_map.rom_words_per_line().items()):
+            print(f"{jack_filename}:{jack_line} {words} ROM words")
+    sys.exit(0)
@@ -0,0 +1,130 @@
+"""
+Inlining of small functions, done on the VM code of the whole program when it is linked.
+A call to a small enough function is replaced by the function's own instructions, which saves the CALL and RETURN routines of starter_code.txt.
+Inside the inlined code:
+1. The arguments are popped off the stack into new locals of the caller, and `argument i` becomes one of those locals.
+2. The callee's locals become more new locals of the caller, set to 0 first like on a real call.
+3. A `pop pointer` would change the caller's this or that, which RETURN normally restores. The caller's pointer is saved in a local before and put back after.
+4. Labels get a suffix unique to the call site, and `return` becomes a jump to the end, where the return value is on top of the stack like after a call.
+All the call sites of a caller use the same new locals, since one inlined call is over before the next starts.
+Inlining trades ROM for cycles, so a call is only inlined where it pays: inside a loop, or when it is the only call to the function,
+which then disappears from the program.
+A function is not inlined if it calls itself, or if it uses static variables and the caller is in another file: a static belongs to its file.
+"""
+
+INLINE_THRESHOLD = 12
+
+
+def can_inline(name, body, threshold):
+    instructions = body[1:]
+    if len(instructions) > threshold:
+        return False
+    return all(not (line.startswith("call ") and line.split()[1] == name) for line in instructions)
+
+
+def uses_statics(body):
+    return any(line.split()[1:2] == ["static"] for line in body)
+
+
+def loop_positions(body):
+    """
+    Returns the positions of the lines of a function that are inside a loop, between a label and a jump back to it.
+    """
+    labels = {}
+    positions = set()
+    for position, line in enumerate(body):
+        parts = line.split()
+        if parts[0] == "label":
+            labels[parts[1]] = position
+        elif parts[0] in {"goto", "if-goto"} and parts[1] in labels:
+            positions.update(range(labels[parts[1]], position + 1))
+    return positions
+
+
+def inline_call(body, amount_of_arguments, first_local, site):
+    """
+    Returns the instructions replacing one call to the function whose lines are body, with its arguments on the stack.
+    Its arguments and locals are mapped to the caller's locals from first_local on. Also returns how many locals that takes.
+    """
+    amount_of_locals = int(body[0].split()[2])
+    saved_pointers = sorted({line.split()[2] for line in body if line.startswith("pop pointer ")})
+    argument_local = lambda index: first_local + index
+    local_local = lambda index: first_local + amount_of_arguments + index
+    saved_local = {pointer: first_local + amount_of_arguments + amount_of_locals + i for i, pointer in enumerate(saved_pointers)}
+    end_label = f"INLINE.{site}_END"
+
+    inlined = [f"pop local {argument_local(index)}" for index in reversed(range(amount_of_arguments))]
+    for index in range(amount_of_locals):
+        inlined.extend(["push constant 0", f"pop local {local_local(index)}"])
+    for pointer in saved_pointers:
+        inlined.extend([f"push pointer {pointer}", f"pop local {saved_local[pointer]}"])
+
+    instructions = body[1:]
+    for position, line in enumerate(instructions):
+        parts = line.split()
+        command = parts[0]
+        if command in {"push", "pop"} and parts[1] in {"argument", "local"}:
+            index = int(parts[2])
+            inlined.append(f"{command} local {argument_local(index) if parts[1] == 'argument' else local_local(index)}")
+        elif command in {"label", "goto", "if-goto"}:
+            inlined.append(f"{command} {parts[1]}.INLINE.{site}")
+        elif command == "return":
+            # The last return simply falls through to the end
+            if position != len(instructions) - 1:
+                inlined.append(f"goto {end_label}")
+        else:
+            inlined.append(line)
+    if "return" in instructions[:-1]:
+        inlined.append(f"label {end_label}")
+
+    for pointer in saved_pointers:
+        inlined.extend([f"push local {saved_local[pointer]}", f"pop pointer {pointer}"])
+    return inlined, amount_of_arguments + amount_of_locals + len(saved_pointers)
+
+
+def inline_functions(program, threshold=INLINE_THRESHOLD):
+    """
+    Inlines the calls to every function of at most threshold instructions, in a program given as [(file name, {function name: lines})].
+    Returns the new program, with the number of call sites inlined for every function.
+    """
+    function_files = {name: file_name for file_name, functions in program for name in functions}
+    inlinable = {
+        name: body
+        for _, functions in program
+        for name, body in functions.items()
+        if can_inline(name, body, threshold)
+    }
+    call_counts = {}
+    for _, functions in program:
+        for body in functions.values():
+            for line in body:
+                if line.startswith("call "):
+                    call_counts[line.split()[1]] = call_counts.get(line.split()[1], 0) + 1
+
+    inlined_sites = {}
+    new_program = []
+    for file_name, functions in program:
+        new_functions = {}
+        for caller, body in functions.items():
+            caller_locals = int(body[0].split()[2])
+            extra_locals = 0
+            new_body = []
+            in_loop = loop_positions(body)
+            for position, line in enumerate(body[1:], 1):
+                parts = line.split()
+                callee = parts[1] if parts[0] == "call" else None
+                if (
+                    callee in inlinable and callee != caller
+                    and (position in in_loop or call_counts[callee] == 1)
+                    and (function_files[callee] == file_name or not uses_statics(inlinable[callee]))
+                ):
+                    site = inlined_sites.get(callee, 0)
+                    instructions, locals_used = inline_call(inlinable[callee], int(parts[2]), caller_locals, f"{callee}.{site}")
+                    new_body.extend(instructions)
+                    extra_locals = max(extra_locals, locals_used)
+                    inlined_sites[callee] = site + 1
+                else:
+                    new_body.append(line)
+            new_functions[caller] = [f"function {caller} {caller_locals + extra_locals}"] + new_body
+        new_program.append((file_name, new_functions))
+    return new_program, inlined_sites
@@ -0,0 +1,68 @@
+"""
+The link step of translate_directory. The .vm files of a program are looked at as a whole before anything is translated:
+1. Every file is split into its functions, from one `function` line to the next.
+2. The call graph is followed from Sys.init.0, which the bootstrap calls. Jack has no function pointers, so a function that no `call` reaches can never run.
+3. Only the reachable functions are translated. The routines of starter_code.txt (CALL, RETURN, COMP_BEGIN) are always part of the program.
+4. Every function that never does `pop pointer` is called with the light protocol of CALL_LIGHT and RETURN_LIGHT: THIS and THAT are not
+   saved and restored around it. They cannot change during the call, since the functions it calls either also never change them
+   or restore them when they return.
+"""
+
+ENTRY_POINT = "Sys.init.0"
+
+
+def split_functions(lines):
+    """
+    Maps the name of every function of a .vm file, in file order, to its lines, the `function` line included.
+    """
+    functions = {}
+    body = None
+    for line in lines:
+        if line.startswith("function "):
+            body = functions.setdefault(line.split()[1], [])
+        if body is None:
+            raise ValueError(f"VM instruction outside of a function: {line}")
+        body.append(line)
+    return functions
+
+
+def called_functions(body):
+    return {line.split()[1] for line in body if line.startswith("call ")}
+
+
+def reachable_functions(functions, roots=(ENTRY_POINT,)):
+    """
+    Returns the names of the functions reachable from the roots through calls, and the names that are called but never defined.
+    """
+    reachable = set()
+    undefined = set()
+    to_visit = list(roots)
+    while to_visit:
+        name = to_visit.pop()
+        if name in reachable or name in undefined:
+            continue
+        if name not in functions:
+            undefined.add(name)
+            continue
+        reachable.add(name)
+        to_visit.extend(called_functions(functions[name]))
+    return reachable, undefined
+
+
+def light_functions(functions):
+    """
+    Returns the names of the functions that can use the light call protocol, the ones that never set THIS or THAT.
+    """
+    return {name for name, body in functions.items() if not any(line.startswith("pop pointer ") for line in body)}
+
+
+def count_rom_words(asm):
+    """
+    The number of instructions an assembly text takes in ROM: everything but comments, blank lines and (labels).
+    """
+    count = 0
+    for line in asm.split("\n"):
+        line = line.split("//")[0].strip()
+        if line and not line.startswith("("):
+            count += 1
+    return count
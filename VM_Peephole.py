@@ -0,0 +1,317 @@
+"""
+The peephole optimizer, run on the VM code of each function right before it is translated.
+The code is cut into groups with the stack effect of each instruction, like VM_translator.group does: a group starts on an empty
+expression stack and ends when the stack is back to where it started (or below), or at a label, a jump, a call or a return.
+Inside a group, the patterns listed at the bottom of VM_translator.py are rewritten into fused instructions that the translator knows:
+1. push S i, pop T j               -> move S i T j               T j = S i, without going through the stack
+2. push S i, push T j, op, pop S i -> inplace op S i T j         S i = S i op T j, for op in add sub and or (either order when op commutes)
+3. push S i, neg|not, pop S i      -> inplace neg|not S i
+4. push S i, neg|not               -> push-neg S i | push-not S i
+5. push T j, op                    -> op T j                     the top of the stack op T j, for op in add sub and or
+Nothing is fused across a label, since another path could jump in between.
+Before the groups are made, a comparison that only feeds a jump is fused with it, which the compiler emits for every if and while:
+6. lt|gt|eq, [not,] if-goto L      -> branch cond L              jump to L if cond holds between the top two values, which are popped
+   push T j, lt|gt|eq, [not,] if-goto L -> branch cond L T j     the right hand side is read directly
+   cond is the jump condition of the Hack CPU on the difference: lt gt eq, or ge le ne when the comparison is negated.
+Even before that, a function calling itself right before returning reuses its own frame (tail call elimination):
+7. call F n, return (inside F)     -> pop argument n-1, ..., pop argument 0, push constant 0, pop local i (for every local), goto TAIL_CALL
+   with `label TAIL_CALL` right after the function line. The stack is empty under the arguments, since a return statement starts on
+   an empty expression stack, so the recursion runs in constant stack space. THIS and THAT are still restored by the one return at the end.
+The jumps are then cleaned up (see clean_jumps), which also makes longer groups since fewer labels cut them:
+9. A jump to a label followed by `goto L` jumps to L directly, a `goto L` right before `label L` is dropped, the code after a goto or a
+   return is dropped up to the next label, and labels that no jump uses are dropped.
+After the groups, THAT is not set again to the value it already has (see reuse_that_pointer):
+8. push S i, pop pointer 1 | move S i pointer 1 | push S i, add T j, pop pointer 1  -> nothing, when THAT was last set from the same
+   locals, arguments or constants, none of them was written since, and no label was passed. Calls keep THAT, and cannot write locals.
+"""
+
+BINARY_OPERATIONS = {"add", "sub", "and", "or"}
+COMMUTATIVE_OPERATIONS = {"add", "and", "or"}
+UNARY_OPERATIONS = {"neg", "not"}
+TAIL_CALL_LABEL = "TAIL_CALL"
+JUMPS = {"goto", "if-goto", "branch"}
+# The segments whose values only change through an explicit pop, even across calls
+STABLE_SEGMENTS = {"local", "argument", "constant"}
+GROUP_ENDS = {"label", "goto", "if-goto", "function", "return", "call", "branch"}
+COMPARISONS = {"lt", "gt", "eq"}
+NEGATED_CONDITIONS = {"lt": "ge", "gt": "le", "eq": "ne"}
+# Pattern 8 can be turned off, to measure what it saves (see benchmark.py)
+REUSE_THAT_POINTER = True
+
+
+def stack_effect(parts):
+    """
+    How many values a VM instruction adds to the stack (negative when it takes them off).
+    """
+    match parts[0]:
+        case "push":
+            return 1
+        case "pop" | "add" | "sub" | "and" | "or" | "eq" | "gt" | "lt" | "if-goto" | "return":
+            return -1
+        case "call":
+            # The arguments are replaced by the return value
+            return 1 - int(parts[2])
+        case _:
+            return 0
+
+
+def split_groups(lines):
+    """
+    Cuts VM instructions into groups that leave the stack where they found it. Labels, jumps, calls and returns are groups of their own.
+    """
+    groups = []
+    current = []
+    running_SP_count = 0
+    for line in lines:
+        parts = line.split()
+        if parts[0] in GROUP_ENDS:
+            if current:
+                groups.append(current)
+            groups.append([line])
+            current = []
+            running_SP_count = 0
+            continue
+        current.append(line)
+        running_SP_count += stack_effect(parts)
+        # Going below the start means the group used a value pushed before it, like the result of a call: it ends there too
+        if running_SP_count <= 0:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def operand(parts):
+    # "push local 3" -> "local 3"
+    return f"{parts[1]} {parts[2]}"
+
+
+def optimize_group(group):
+    """
+    Rewrites one group with the fused instructions. Returns the new instructions.
+    """
+    parts = [line.split() for line in group]
+    commands = [p[0] for p in parts]
+
+    if commands == ["push", "pop"]:
+        return [f"move {operand(parts[0])} {operand(parts[1])}"]
+    if len(group) == 4 and commands == ["push", "push", commands[2], "pop"] and commands[2] in BINARY_OPERATIONS:
+        target = operand(parts[3])
+        if operand(parts[0]) == target:
+            return [f"inplace {commands[2]} {target} {operand(parts[1])}"]
+        if operand(parts[1]) == target and commands[2] in COMMUTATIVE_OPERATIONS:
+            return [f"inplace {commands[2]} {target} {operand(parts[0])}"]
+    if len(group) == 3 and commands == ["push", commands[1], "pop"] and commands[1] in UNARY_OPERATIONS and operand(parts[0]) == operand(parts[2]):
+        return [f"inplace {commands[1]} {operand(parts[0])}"]
+
+    optimized = []
+    position = 0
+    while position < len(group):
+        if commands[position] == "push" and position + 1 < len(group):
+            following = commands[position + 1]
+            if following in UNARY_OPERATIONS:
+                optimized.append(f"push-{following} {operand(parts[position])}")
+                position += 2
+                continue
+            if following in BINARY_OPERATIONS:
+                optimized.append(f"{following} {operand(parts[position])}")
+                position += 2
+                continue
+        optimized.append(group[position])
+        position += 1
+    return optimized
+
+
+def fuse_branches(lines):
+    """
+    Replaces every comparison followed by an if-goto, with or without a not in between, by a branch instruction.
+    """
+    fused = []
+    for line in lines:
+        parts = line.split()
+        if parts[0] == "if-goto":
+            negated = bool(fused) and fused[-1] == "not"
+            comparison_position = len(fused) - 2 if negated else len(fused) - 1
+            if comparison_position >= 0 and fused[comparison_position] in COMPARISONS:
+                comparison = fused[comparison_position]
+                condition = NEGATED_CONDITIONS[comparison] if negated else comparison
+                del fused[comparison_position:]
+                if fused and fused[-1].startswith("push "):
+                    fused[-1] = f"branch {condition} {parts[1]} {operand(fused[-1].split())}"
+                else:
+                    fused.append(f"branch {condition} {parts[1]}")
+                continue
+        fused.append(line)
+    return fused
+
+
+def eliminate_tail_calls(lines):
+    """
+    Replaces every `call F n` followed by `return` inside F by a jump back to the start of F. lines can hold several functions.
+    """
+    tail_calling = set()
+    current = None
+    for position, line in enumerate(lines):
+        parts = line.split()
+        if parts[0] == "function":
+            current = parts[1]
+        elif parts[0] == "call" and parts[1] == current and position + 1 < len(lines) and lines[position + 1] == "return":
+            tail_calling.add(current)
+    if not tail_calling:
+        return lines
+
+    eliminated = []
+    amount_of_locals = 0
+    for line in lines:
+        parts = line.split()
+        if parts[0] == "function":
+            current, amount_of_locals = parts[1], int(parts[2])
+            eliminated.append(line)
+            if current in tail_calling:
+                eliminated.append(f"label {TAIL_CALL_LABEL}")
+        elif parts[0] == "return" and eliminated and eliminated[-1].split()[:2] == ["call", current]:
+            amount_of_arguments = int(eliminated.pop().split()[2])
+            eliminated.extend(f"pop argument {index}" for index in reversed(range(amount_of_arguments)))
+            for index in range(amount_of_locals):
+                eliminated.extend(["push constant 0", f"pop local {index}"])
+            eliminated.append(f"goto {TAIL_CALL_LABEL}")
+        else:
+            eliminated.append(line)
+    return eliminated
+
+
+def jump_target(parts):
+    # The label of goto L, if-goto L and branch cond L ...
+    return parts[2] if parts[0] == "branch" else parts[1]
+
+
+def clean_function_jumps(lines):
+    """
+    One round of clean_jumps on the lines of a single function. Returns the new lines, and whether anything changed.
+    """
+    parts = [line.split() for line in lines]
+    # Code right after an unconditional jump only runs if a label leads to it
+    reachable_lines = []
+    reachable = True
+    for line, line_parts in zip(lines, parts):
+        if line_parts[0] in {"label", "function"}:
+            reachable = True
+        if reachable:
+            reachable_lines.append(line_parts)
+        if line_parts[0] in {"goto", "return"}:
+            reachable = False
+    parts = reachable_lines
+
+    # A label followed by `goto L` (maybe after more labels) forwards to L
+    forward = {}
+    for position, line_parts in enumerate(parts):
+        if line_parts[0] == "label":
+            following = position + 1
+            while following < len(parts) and parts[following][0] == "label":
+                following += 1
+            if following < len(parts) and parts[following][0] == "goto":
+                forward[line_parts[1]] = parts[following][1]
+
+    def final_target(label):
+        seen = {label}
+        while label in forward and forward[label] not in seen:
+            label = forward[label]
+            seen.add(label)
+        return label
+
+    threaded = []
+    for position, line_parts in enumerate(parts):
+        if line_parts[0] in JUMPS:
+            target = final_target(jump_target(line_parts))
+            line_parts = line_parts[:-1] + [target] if line_parts[0] != "branch" else line_parts[:2] + [target] + line_parts[3:]
+            if line_parts[0] == "goto":
+                # Only labels between here and the target: the jump is not needed
+                following = position + 1
+                while following < len(parts) and parts[following][0] == "label" and parts[following][1] != target:
+                    following += 1
+                if following < len(parts) and parts[following] == ["label", target]:
+                    continue
+        threaded.append(line_parts)
+
+    used_labels = {jump_target(line_parts) for line_parts in threaded if line_parts[0] in JUMPS}
+    cleaned = [" ".join(line_parts) for line_parts in threaded if line_parts[0] != "label" or line_parts[1] in used_labels]
+    return cleaned, cleaned != lines
+
+
+def clean_jumps(lines):
+    """
+    Threads jumps to jumps, drops jumps to the next instruction, unreachable code and unused labels. lines can hold several functions.
+    """
+    functions = []
+    for line in lines:
+        if line.startswith("function ") or not functions:
+            functions.append([])
+        functions[-1].append(line)
+    cleaned = []
+    for function in functions:
+        changed = True
+        while changed:
+            function, changed = clean_function_jumps(function)
+        cleaned.extend(function)
+    return cleaned
+
+
+def that_pointer_setting(instructions, position):
+    """
+    If the instructions from position on set pointer 1 from variables, returns those variables and the amount of instructions. (None, 0) otherwise.
+    """
+    parts = [line.split() for line in instructions[position:position + 3]]
+    if parts[0][:1] == ["move"] and parts[0][3:] == ["pointer", "1"]:
+        return (operand(parts[0]),), 1
+    if len(parts) >= 2 and parts[0][0] == "push" and parts[1] == ["pop", "pointer", "1"]:
+        return (operand(parts[0]),), 2
+    if len(parts) == 3 and parts[0][0] == "push" and parts[1][0] == "add" and len(parts[1]) == 3 and parts[2] == ["pop", "pointer", "1"]:
+        return tuple(sorted((operand(parts[0]), f"{parts[1][1]} {parts[1][2]}"))), 3
+    return None, 0
+
+
+def written_operand(parts):
+    # The segment and index an instruction writes to, None for the ones that do not write a segment
+    match parts[0]:
+        case "pop":
+            return operand(parts)
+        case "move":
+            return f"{parts[3]} {parts[4]}"
+        case "inplace":
+            return f"{parts[2]} {parts[3]}"
+        case _:
+            return None
+
+
+def reuse_that_pointer(instructions):
+    """
+    Drops the instructions setting pointer 1 when it already holds the same value, like in `let a[i] = a[i] + 1`.
+    """
+    reused = []
+    that_base = None
+    position = 0
+    while position < len(instructions):
+        base, length = that_pointer_setting(instructions, position)
+        if base is not None:
+            if base != that_base:
+                reused.extend(instructions[position:position + length])
+                that_base = base if all(variable.split()[0] in STABLE_SEGMENTS for variable in base) else None
+            position += length
+            continue
+        parts = instructions[position].split()
+        written = written_operand(parts)
+        if parts[0] in {"label", "function"} or written == "pointer 1" or (that_base is not None and written in that_base):
+            that_base = None
+        reused.append(instructions[position])
+        position += 1
+    return reused
+
+
+def optimize_function(lines):
+    """
+    Returns the VM instructions of a function after the peephole optimizer.
+    """
+    grouped = split_groups(clean_jumps(fuse_branches(eliminate_tail_calls(lines))))
+    optimized = [instruction for group in grouped for instruction in optimize_group(group)]
+    return reuse_that_pointer(optimized) if REUSE_THAT_POINTER else optimized
@@ -1,9 +1,19 @@
 from enum import Enum
 import sys
 import os
+import argparse
+from VM_Linker import ENTRY_POINT, split_functions, reachable_functions, light_functions, count_rom_words
+from VM_Inliner import INLINE_THRESHOLD, inline_functions, loop_positions
+from VM_Peephole import split_groups, optimize_function
+from Hack_Assembler import assemble_program, write_hack
+from Source_Map import write_map, instruction_origins, line_origins
 # We need to keep track of the current scope when translating
 current_file = ""
 current_function = ""
+# With the top of the stack cached, True while the top value is in D instead of memory (SP then points to where it goes)
+top_in_D = False
+# The functions called with the light protocol of starter_code.txt, see VM_Linker.light_functions. Only known when a whole program is linked
+light_protocol_functions = set()
 # 1. Address (string + number)
     #Push + address
     #Pop + address
@@ -44,6 +54,9 @@ C_I_mapping = {
     "eq" : 0
 }
 
+# How comparisons are translated: all through the shared COMP_BEGIN routine (small), all inline (fast), or inline only inside loops
+COMPARISON_MODES = ("shared", "inline", "auto")
+
 class Address:
     def __init__(self, string_part: AddressType, number_part: int):
         self.s = string_part
@@ -148,6 +161,19 @@ class Address:
     def push_from_address(self) -> str:
         result = f"\n//push {self}\n"
         return result + self.set_D_reg_to_address_value() + "@SP\nAM=M+1\nA=A-1\nM=D\n"
+
+    #The fused instructions of the peephole optimizer write a value computed in D, so the destination has to be reached without D.
+    #Returns the code to run before D is computed and the code setting A to the address. Far offsets are computed into @13 beforehand.
+    def destination_address(self) -> tuple:
+        if self.s in {AddressType.LOCAL, AddressType.THAT, AddressType.THIS, AddressType.ARGUMENT}:
+            if self.n == 0:
+                return "", f"@{self.get_shortened_name()}\nA=M\n"
+            if self.n < 8:
+                return "", f"@{self.get_shortened_name()}\nA=M+1\n" + "A=A+1\n" * (self.n - 1)
+            return f"@{self.n}\nD=A\n@{self.get_shortened_name()}\nD=D+M\n@13\nM=D\n", "@13\nA=M\n"
+        if self.s in {AddressType.TEMP, AddressType.POINTER, AddressType.STATIC}:
+            return "", self.set_A_reg_to_address_value()
+        raise ValueError(f"Bad AddressType for a destination: {self.s}")
     
 def convert_math_instruction(instruction):
     operation_map = {
@@ -173,7 +199,143 @@ def convert_math_instruction(instruction):
     )
 
 
-def convert_Compare_Instruction(instruction):
+# The fused instructions of VM_Peephole. Their operands are written like the ones of push and pop
+def parse_address(segment, number):
+    return Address(AddressType[segment.upper()], int(number))
+
+operand_operation_map = {"add": "D+M", "sub": "M-D", "or": "D|M", "and": "D&M"}
+
+def convert_move(parts):
+    #move S i T j: T j = S i
+    source, destination = parse_address(parts[1], parts[2]), parse_address(parts[3], parts[4])
+    before, set_A = destination.destination_address()
+    result = f"\n//move {source} to {destination}\n"
+    if source.s == AddressType.CONSTANT and source.n in {0, 1}:
+        return result + before + set_A + f"M={source.n}\n"
+    return result + before + source.set_D_reg_to_address_value() + set_A + "M=D\n"
+
+def convert_push_unary(parts):
+    #push-neg S i, push-not S i: push the negation of S i
+    source = parse_address(parts[1], parts[2])
+    return f"\n//{parts[0]} {source}\n" + source.set_D_reg_to_address_value() + "@SP\nAM=M+1\nA=A-1\n" + ("M=-D\n" if parts[0] == "push-neg" else "M=!D\n")
+
+def convert_math_with_operand(parts):
+    #add S i (and sub, and, or): the top of the stack op S i, without pushing S i
+    source = parse_address(parts[1], parts[2])
+    result = f"\n//{parts[0]} {source}\n"
+    if source.s == AddressType.CONSTANT and source.n == 1 and parts[0] in {"add", "sub"}:
+        return result + "@SP\nA=M-1\n" + ("M=M+1\n" if parts[0] == "add" else "M=M-1\n")
+    return result + source.set_D_reg_to_address_value() + f"@SP\nA=M-1\nM={operand_operation_map[parts[0]]}\n"
+
+def convert_inplace(parts):
+    #inplace op S i T j: S i = S i op T j. inplace neg|not S i: S i = op S i
+    target = parse_address(parts[2], parts[3])
+    before, set_A = target.destination_address()
+    result = f"\n//{' '.join(parts)}\n" + before
+    if parts[1] in {"neg", "not"}:
+        return result + set_A + ("M=-M\n" if parts[1] == "neg" else "M=!M\n")
+    source = parse_address(parts[4], parts[5])
+    if source.s == AddressType.CONSTANT and source.n == 1 and parts[1] in {"add", "sub"}:
+        return result + set_A + ("M=M+1\n" if parts[1] == "add" else "M=M-1\n")
+    return result + source.set_D_reg_to_address_value() + set_A + f"M={operand_operation_map[parts[1]]}\n"
+
+
+def convert_branch(parts):
+    #branch cond L [S i]: jump to L if (the value below) - (the top, or S i) satisfies cond. No -1/0 is built and COMP_BEGIN is not involved
+    global current_function
+    result = f"\n//{' '.join(parts)}\n"
+    if len(parts) == 5:
+        right_side = parse_address(parts[3], parts[4])
+        if right_side.s == AddressType.CONSTANT and right_side.n == 0:
+            result += "@SP\nAM=M-1\nD=M\n"
+        else:
+            result += right_side.set_D_reg_to_address_value() + "@SP\nAM=M-1\nD=M-D\n"
+    else:
+        result += "@SP\nAM=M-1\nD=M\n@SP\nAM=M-1\nD=M-D\n"
+    return result + f"@{current_function}${parts[2]}\nD;J{parts[1].upper()}\n"
+
+
+#Inline, a comparison takes 11 words instead of 6, but 8 to 11 cycles instead of 33 to 37: true is written first and replaced by false if the jump is not taken
+#With the top of the stack cached in D, a push only loads D and the next instruction uses it from there. The value is spilled, written
+#to the stack, before any instruction that needs the stack in memory: labels (other paths arrive with it there), jumps, calls, returns,
+#comparisons and the fused instructions that use D themselves. An if-goto consumes D directly.
+def spill_top() -> str:
+    global top_in_D
+    if not top_in_D:
+        return ""
+    top_in_D = False
+    return "\n//spill D\n@SP\nAM=M+1\nA=A-1\nM=D\n"
+
+def address_without_D(address):
+    #The code setting A so that M is the value of the address, without touching D. None if the address needs D
+    if address.s == AddressType.CONSTANT:
+        return None
+    if address.s in {AddressType.LOCAL, AddressType.THAT, AddressType.THIS, AddressType.ARGUMENT} and address.n >= 4:
+        return None
+    return address.set_A_reg_to_address_value()
+
+cached_operation_map = {"add": "D=D+M", "sub": "D=M-D", "and": "D=D&M", "or": "D=D|M"}
+cached_operand_map = {"add": "D=D+{}", "sub": "D=D-{}", "and": "D=D&{}", "or": "D=D|{}"}
+
+def convert_cached(parts):
+    """
+    Translates an instruction when caching the top of the stack in D. Returns None for an instruction that needs the stack in memory,
+    the caller then spills D and translates it normally.
+    """
+    global top_in_D
+    command = parts[0]
+    result = f"\n//{' '.join(parts)} (top in D)\n"
+    if command in {"push", "push-neg", "push-not"}:
+        source = parse_address(parts[1], parts[2])
+        result = spill_top() + result + source.set_D_reg_to_address_value()
+        if command != "push":
+            result += "D=-D\n" if command == "push-neg" else "D=!D\n"
+        top_in_D = True
+        return result
+    if not top_in_D:
+        return None
+    if command == "pop":
+        before, set_A = parse_address(parts[1], parts[2]).destination_address()
+        if before:
+            return None
+        top_in_D = False
+        return result + set_A + "M=D\n"
+    if command in {"neg", "not"}:
+        return result + ("D=-D\n" if command == "neg" else "D=!D\n")
+    if command in cached_operation_map and len(parts) == 1:
+        return result + f"@SP\nAM=M-1\n{cached_operation_map[command]}\n"
+    if command in cached_operand_map:
+        source = parse_address(parts[1], parts[2])
+        if source.s == AddressType.CONSTANT:
+            if source.n == 1 and command in {"add", "sub"}:
+                return result + ("D=D+1\n" if command == "add" else "D=D-1\n")
+            return result + f"@{source.n}\n" + cached_operand_map[command].format("A") + "\n"
+        set_A = address_without_D(source)
+        if set_A is None:
+            return None
+        return result + set_A + cached_operand_map[command].format("M") + "\n"
+    if command == "if-goto":
+        top_in_D = False
+        return result + f"@{current_function}${parts[1]}\nD;JNE\n"
+    if command == "branch":
+        #D holds the right hand side, or with an operand the left one
+        if len(parts) == 3:
+            result += "@SP\nAM=M-1\nD=M-D\n"
+        else:
+            right_side = parse_address(parts[3], parts[4])
+            set_A = address_without_D(right_side)
+            if right_side.s == AddressType.CONSTANT:
+                result += "" if right_side.n == 0 else f"@{right_side.n}\nD=D-A\n"
+            elif set_A is not None:
+                result += set_A + "D=D-M\n"
+            else:
+                return None
+        top_in_D = False
+        return result + f"@{current_function}${parts[2]}\nD;J{parts[1].upper()}\n"
+    return None
+
+
+def convert_Compare_Instruction(instruction, inline=False):
     global current_function
     # Ensure the instruction is valid
     if instruction not in Compare_Instruction.__members__:
@@ -184,8 +346,16 @@ def convert_Compare_Instruction(instruction):
     return_label = (
         f"{current_function}.{instruction}.{C_I_mapping[instruction]}"
     )
-        
-    the_string_to_return += (
+
+    if inline:
+        the_string_to_return += (
+            "@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n"
+            f"@{return_label}\nD;J{instruction.upper()}\n"
+            "@SP\nA=M-1\nM=0\n"
+            f"({return_label})\n"
+        )
+    else:
+        the_string_to_return += (
             f"@{return_label}\nD=A\n@14\n"
             f"{comp_map[instruction]}"
             "@COMP_BEGIN\n0;JMP\n"
@@ -195,7 +365,7 @@ def convert_Compare_Instruction(instruction):
     return the_string_to_return
 
 def convert_return():
-    return f"\n//return\n@RETURN\n0;JMP\n"
+    return f"\n//return\n@{'RETURN_LIGHT' if current_function in light_protocol_functions else 'RETURN'}\n0;JMP\n"
 
 
 """
@@ -208,19 +378,23 @@ func_mapping = {"": 0}
 
 def convert_call(name_of_the_function_im_calling, number_of_arguments):
     #When I jump to the pre-defined CALL subroutine, I need the return address in the D register already, the function pointer in @13, and the number of arguments plus 5 in @14
+    #A light function gets a frame of 3 words instead of 5 (CALL_LIGHT), and without arguments @14 is not set (CALL_NO_ARGUMENTS)
     func_mapping[current_function] += 1
+    light = name_of_the_function_im_calling in light_protocol_functions
+    routine = "CALL_LIGHT" if light else "CALL"
+    if number_of_arguments == 0:
+        routine += "_NO_ARGUMENTS"
+        set_amount_of_arguments = ""
+    else:
+        set_amount_of_arguments = f"@{number_of_arguments + (3 if light else 5)}\nD=A\n@14\nM=D\n"
     return f"""\n//call {name_of_the_function_im_calling}
-@{number_of_arguments + 5}
-D=A
-@14
-M=D
-@{name_of_the_function_im_calling}
+{set_amount_of_arguments}@{name_of_the_function_im_calling}
 D=A
 @13
 M=D
 @{current_function}$ret.{func_mapping[current_function]}
 D=A
-@CALL
+@{routine}
 0;JMP
 ({current_function}$ret.{func_mapping[current_function]})
 
@@ -247,7 +421,6 @@ def convert_goto(name_of_the_label):
     return f"\n//goto {name_of_the_label}\n@{current_function}${name_of_the_label[1]}\n0;JMP\n"
     
 def convert_if_goto(label_name):
-    print(label_name)
     global current_file
     global current_function
     return f"\n//if-goto {label_name}\n@SP\nAM=M-1\nD=M\n" + f"@{current_function}${label_name[1]}\nD;JNE\n"
@@ -259,7 +432,7 @@ def give_starter_code() -> str:
     """
     Returns the string containing the starter code.
     """
-    with open("starter_code.txt", "r") as starter_file:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "starter_code.txt"), "r") as starter_file:
         return starter_file.read()
 
 #This is bootstrap code. It sets SP to 256. Then it calls Sys.init. This assume we have the starter code.
@@ -268,7 +441,7 @@ def give_boot_strap_code():
     #Since Sys.vm goes into an infinite loop after calling the OS inital functions and then calling Main.main, we don't care about the name of the "function" that calls Sys.init 
     global current_file
     current_file = ""
-    result += convert_call("Sys.init", 0)
+    result += convert_call(ENTRY_POINT, 0)
     return result
 
 
@@ -285,8 +458,83 @@ def remove_comments(lines):
             cleaned_lines.append(cleaned_line)
     return cleaned_lines
 
+
+def numbered_instructions(lines):
+    """
+    Same as remove_comments, with the line number of every instruction: a list of (line number, instruction).
+    """
+    numbered = []
+    for number, line in enumerate(lines, 1):
+        cleaned_line = line.split("//")[0].strip()
+        if cleaned_line:
+            numbered.append((number, cleaned_line))
+    return numbered
+
+command_map = {
+    "push": lambda parts: Address(AddressType[parts[1].upper()], int(parts[2])).push_from_address(),
+    "pop": lambda parts: Address(AddressType[parts[1].upper()], int(parts[2])).pop_to_address(),
+    "add": convert_math_instruction, "sub": convert_math_instruction,
+    "neg": convert_math_instruction, "and": convert_math_instruction,
+    "or": convert_math_instruction, "not": convert_math_instruction,
+    "eq": convert_Compare_Instruction, "gt": convert_Compare_Instruction, "lt": convert_Compare_Instruction,
+    "label": convert_lbl, "goto": convert_goto, "if-goto": convert_if_goto,
+    "function": lambda parts: convert_function(parts[1], int(parts[2])),
+    "call": lambda parts: convert_call(parts[1], int(parts[2])),
+    "return": lambda _: convert_return(),
+    "move": convert_move, "push-neg": convert_push_unary, "push-not": convert_push_unary, "inplace": convert_inplace,
+    "branch": convert_branch
+}
+fused_commands = {"move", "push-neg", "push-not", "inplace", "branch"}
+
+
+def translate_lines(lines, file_name: str, comparisons: str = "auto", cache_top: bool = True):
+    """
+    Translates VM instructions without comments, coming from the file file_name (which names its static variables), and returns the assembly.
+    comparisons is one of COMPARISON_MODES. With cache_top, the top of the stack is kept in D between instructions, see convert_cached.
+    """
+    return "".join(translate_instructions(lines, file_name, comparisons, cache_top))
+
+
+def translate_instructions(lines, file_name: str, comparisons: str = "auto", cache_top: bool = True):
+    """
+    Same as translate_lines, with the assembly of every VM instruction apart, for the source map.
+    The spill of the top of the stack at the end goes with the last instruction.
+    """
+    global current_file, top_in_D
+    current_file = file_name
+    top_in_D = False
+    if comparisons not in COMPARISON_MODES:
+        raise ValueError(f"Unknown comparison mode: {comparisons}")
+    in_loop = loop_positions(lines) if comparisons == "auto" else set()
+    asm = []
+    for position, line in enumerate(lines):
+        parts = line.split()
+        command = parts[0].lower()
+        if cache_top:
+            cached = convert_cached(parts)
+            if cached is not None:
+                asm.append(cached)
+                continue
+            spill = spill_top()
+        else:
+            spill = ""
+        if command in operand_operation_map and len(parts) == 3:
+            asm.append(spill + convert_math_with_operand(parts))
+        elif command in C_I_mapping:
+            asm.append(spill + convert_Compare_Instruction(command, comparisons == "inline" or position in in_loop))
+        elif command in command_map:
+            asm.append(spill + (command_map[command](parts) if command in {"push", "pop", "function", "call", "goto", "if-goto", "label"} | fused_commands else command_map[command](command)))
+        else:
+            raise ValueError(f"Unrecognized VM command: {line}")
+    if asm:
+        asm[-1] += spill_top()
+    else:
+        asm.append(spill_top())
+    return asm
+
+
 #When being run directly, the code translates a spefic .vm file into it's associated .asm file - without the starter code.
-def translate_vm(vm_filename: str):
+def translate_vm(vm_filename: str, peephole: bool = True, comparisons: str = "auto", cache_top: bool = True):
     """
     Translates a single .vm file into its corresponding .asm file.
     """
@@ -298,30 +546,41 @@ def translate_vm(vm_filename: str):
 
     asm_filename = vm_filename.replace('.vm', '.asm')
     with open(asm_filename, 'a') as asm_file:
-        global current_file
-        current_file = os.path.splitext(os.path.basename(vm_filename))[0]
-        
-        command_map = {
-            "push": lambda parts: Address(AddressType[parts[1].upper()], int(parts[2])).push_from_address(),
-            "pop": lambda parts: Address(AddressType[parts[1].upper()], int(parts[2])).pop_to_address(),
-            "add": convert_math_instruction, "sub": convert_math_instruction,
-            "neg": convert_math_instruction, "and": convert_math_instruction,
-            "or": convert_math_instruction, "not": convert_math_instruction,
-            "eq": convert_Compare_Instruction, "gt": convert_Compare_Instruction, "lt": convert_Compare_Instruction,
-            "label": convert_lbl, "goto": convert_goto, "if-goto": convert_if_goto,
-            "function": lambda parts: convert_function(parts[1], int(parts[2])),
-            "call": lambda parts: convert_call(parts[1], int(parts[2])),
-            "return": lambda _: convert_return()
-        }
-
-        for line in lines:
-            parts = line.split()
-            command = parts[0].lower()
-            if command in command_map:
-                asm_file.write(command_map[command](parts) if command in {"push", "pop", "function", "call", "goto", "if-goto", "label"} else command_map[command](command))
-            else:
-                raise ValueError(f"Unrecognized VM command: {line}")
+        asm_file.write(translate_lines(optimize_function(lines) if peephole else lines, os.path.splitext(os.path.basename(vm_filename))[0], comparisons, cache_top))
+
 
+def link_program(vm_files, remove_unreachable=True, inline_threshold=INLINE_THRESHOLD):
+    """
+    Reads every .vm file of a program and inlines the functions of at most inline_threshold instructions.
+    Returns the reachable functions of every file as [(file name, {function name: lines})],
+    and the unreachable ones as [(file name, function name, lines)]. Without remove_unreachable every function is kept.
+    """
+    program = []
+    for vm_file in vm_files:
+        with open(vm_file, 'r') as f:
+            program.append((os.path.splitext(os.path.basename(vm_file))[0], split_functions(remove_comments(f.readlines()))))
+
+    # Inlining comes first, a function whose calls were all inlined is then no longer reachable
+    if inline_threshold > 0:
+        program, inlined_sites = inline_functions(program, inline_threshold)
+        if inlined_sites:
+            print(f"Inlined {sum(inlined_sites.values())} calls to {len(inlined_sites)} functions:")
+            for name, sites in sorted(inlined_sites.items(), key=lambda item: (-item[1], item[0])):
+                print(f"    {name}: {sites} calls")
+
+    all_functions = {name: body for _, functions in program for name, body in functions.items()}
+    reachable, undefined = reachable_functions(all_functions)
+    for name in sorted(undefined):
+        print(f"Warning: {name} is called but no .vm file defines it")
+    if not remove_unreachable:
+        reachable = set(all_functions)
+
+    linked = []
+    unreachable = []
+    for file_name, functions in program:
+        linked.append((file_name, {name: body for name, body in functions.items() if name in reachable}))
+        unreachable.extend((file_name, name, body) for name, body in functions.items() if name not in reachable)
+    return linked, unreachable
 
 
 def give_bootstrap_code():
@@ -333,20 +592,29 @@ def give_bootstrap_code():
 D=A
 @SP
 M=D
-""" + convert_call("Sys.init", 0)
+""" + convert_call(ENTRY_POINT, 0)
 
 
-def translate_directory(directory_name: str):
+def translate_directory(directory_name: str, remove_unreachable: bool = True, inline_threshold: int = INLINE_THRESHOLD, peephole: bool = True, comparisons: str = "auto", cache_top: bool = True, light_calls: bool = True, assemble_output: bool = False, source_map: bool = False):
     """
     Translates all VM files in a directory.
     If `Sys.vm` is found, generates a single combined `.asm` file with bootstrap code.
+    Functions that cannot be reached from Sys.init are left out of it, unless remove_unreachable is False,
+    and calls to functions of at most inline_threshold VM instructions are inlined (0 turns inlining off).
+    With peephole, every function goes through the peephole optimizer before it is translated.
+    comparisons picks how the comparisons are translated, see COMPARISON_MODES, and cache_top keeps the top of the stack in D.
+    With light_calls, the functions that never set THIS or THAT are called without saving them, see VM_Linker.light_functions.
+    With assemble_output, the combined program is also assembled, from memory, into a .hack file next to the .asm file.
+    With source_map, the .asm file (and the .hack file) get their source maps, see Source_Map.
     Otherwise, each file is translated independently with starter code.
     The final combined .asm file is named after the lowest directory.
     """
+    global light_protocol_functions
     print(f"Translating directory: {directory_name}")
+    light_protocol_functions = set()
 
     # Collect all .vm files in the directory
-    vm_files = [os.path.join(directory_name, f) for f in os.listdir(directory_name) if f.endswith(".vm")]
+    vm_files = [os.path.join(directory_name, f) for f in sorted(os.listdir(directory_name)) if f.endswith(".vm")]
 
     if not vm_files:
         raise ValueError(f"No .vm files found in the directory: {directory_name}")
@@ -365,25 +633,82 @@ def translate_directory(directory_name: str):
         temp_asm_filename = os.path.join(directory_name, ".temp.asm")
         print(f"Temporary file: {temp_asm_filename}")
 
+        # The whole program is known once linked, so every call can use the protocol of the function it calls
+        linked, unreachable = link_program(vm_files, remove_unreachable, inline_threshold)
+        if light_calls:
+            light_protocol_functions = light_functions({name: body for _, functions in linked for name, body in functions.items()})
+
+        # The lines of the .vm files, as they were before inlining and the peephole optimizer, for the source map
+        original_functions = {}
+        if source_map:
+            for vm_file in vm_files:
+                with open(vm_file, 'r') as f:
+                    numbered = numbered_instructions(f.readlines())
+                # Like split_functions, which already checked that every instruction is inside a function
+                for number, line in numbered:
+                    if line.startswith("function "):
+                        original = original_functions[line.split()[1]] = (os.path.basename(vm_file), [], [])
+                    original[1].append(line)
+                    original[2].append(number)
+
+        # The assembly is collected in memory, written in one go and handed to the assembler as it is
+        asm_parts = []
+        # The .vm file and line of every part, for the source map. The bootstrap and starter code have none
+        part_origins = []
         with open(temp_asm_filename, "w") as temp_asm_file:
             # Write bootstrap code
-            temp_asm_file.write(give_bootstrap_code() + "\n")
+            asm_parts.append(give_bootstrap_code() + "\n")
             
             # Append starter code
-            temp_asm_file.write(give_starter_code() + "\n")
+            asm_parts.append(give_starter_code() + "\n")
+            part_origins.extend([None, None])
             
-            # Translate each VM file and append its content to the temp file
-            for vm_file in vm_files:
-                print(f"Translating file: {vm_file}")
-                translate_vm(vm_file)  # Generates a separate .asm file for each .vm file
-                asm_file = vm_file.replace(".vm", ".asm")
-                with open(asm_file, "r") as individual_asm_file:
-                    temp_asm_file.write(individual_asm_file.read())
-                os.remove(asm_file)  # Clean up the individual .asm file
+            # Translate the functions of each VM file that can run, and append them to the temp file
+            rom_words = 0
+            vm_instructions = fused_instructions = 0
+            for file_name, functions in linked:
+                print(f"Translating file: {file_name}.vm")
+                for name, linked_body in functions.items():
+                    vm_instructions += len(linked_body)
+                    body = linked_body
+                    if peephole:
+                        body = optimize_function(linked_body)
+                        fused_instructions += len(body)
+                    instructions_asm = translate_instructions(body, file_name, comparisons, cache_top)
+                    rom_words += count_rom_words("".join(instructions_asm))
+                    asm_parts.extend(instructions_asm)
+                    if source_map:
+                        # Matched back in two steps, the peephole optimizer's instructions to the inlined code they come from, and that to the .vm file
+                        vm_filename, original, numbers = original_functions[name]
+                        linked_origins = instruction_origins(original, linked_body)
+                        part_origins.extend([vm_filename, numbers[linked_origins[position]]] for position in instruction_origins(linked_body, body))
+            asm = "".join(asm_parts)
+            temp_asm_file.write(asm)
+
+        if peephole:
+            print(f"Peephole: {vm_instructions} VM instructions became {fused_instructions}")
+        if light_calls:
+            print(f"{len(light_protocol_functions)} of {sum(len(functions) for _, functions in linked)} functions use the light call protocol")
+
+        # Only report what was saved, translating the dropped functions to measure them
+        if unreachable:
+            saved = sorted(((count_rom_words(translate_lines(body, file_name, comparisons, cache_top)), name) for file_name, name, body in unreachable), reverse=True)
+            print(f"Removed {len(saved)} unreachable functions, saving {sum(words for words, _ in saved)} ROM words:")
+            for words, name in saved:
+                print(f"    {name}: {words} words")
 
         # Rename the temp file to the final combined .asm file
         os.rename(temp_asm_filename, combined_asm_filename)
-        print(f"Final combined file: {combined_asm_filename}")
+        print(f"Final combined file: {combined_asm_filename}, the translated functions take {rom_words} ROM words")
+        if source_map:
+            write_map(combined_asm_filename, None, line_origins(asm_parts, part_origins))
+        if assemble_output:
+            hack_filename = os.path.splitext(combined_asm_filename)[0] + ".hack"
+            words, _, asm_lines = assemble_program(asm)
+            write_hack(words, hack_filename)
+            if source_map:
+                write_map(hack_filename, os.path.basename(combined_asm_filename), asm_lines)
+            print(f"Assembled {hack_filename}: {len(words)} words")
     else:
         # If Sys.vm is not present, translate each file independently with starter code
         starter_code = give_starter_code()
@@ -392,92 +717,26 @@ def translate_directory(directory_name: str):
             with open(asm_file_name, "w") as asm_file:
                 asm_file.write(starter_code + "\n")  # Write starter code to each file
             print(f"Translating file independently: {vm_file}")
-            translate_vm(vm_file)  # Append VM translation to the respective .asm file
+            translate_vm(vm_file, peephole, comparisons, cache_top)  # Append VM translation to the respective .asm file
       
       
             
-#Recieve a foo.vm filw and return a g_foo.vim file        
+#Recieve a foo.vm file and write a g_foo.vm file, with the stack-balanced groups of VM_Peephole.split_groups separated by blank lines
 def group(filename: str):
     print(f"Grouping: {filename}")
     
     # Read VM file content
     with open(filename, 'r') as vm_file:
         lines = remove_comments(vm_file.readlines())
-    new_vm_filename = "g_" + filename
-    
-    #bookeep
-    running_SP_count = 0
-    with open(new_vm_filename, 'w') as new_vm_filename:
-        for line in lines:
-            parts = line.split()
-            command = parts[0].lower()
-            # Translate VM commands to assembly
-
-            if command == "push":
-                new_vm_filename.write(line)
-                running_SP_count += 1
-
-            elif command == "pop":
-                new_vm_filename.write(line)
-                running_SP_count += -1
-                
-            elif command in {"add", "sub", "and", "or"}:
-                new_vm_filename.write(line)
-                running_SP_count += -1
-                
-            elif command in {"neg", "not"}:
-                new_vm_filename.write(line)
-                running_SP_count += 0
-                
-            elif command in {"eq", "gt", "lt"}:
-                new_vm_filename.write(line)
-                running_SP_count += -1
-                
-            
-            elif command == "label":
-                new_vm_filename.write(line)
-                running_SP_count = 0
-                
-
-            elif command == "goto":
-                new_vm_filename.write(line)
-                running_SP_count = 0
-                
-
-            elif command == "if-goto":
-                new_vm_filename.write(line)
-                running_SP_count = 0
-                
-
-            elif command == "function":
-                new_vm_filename.write(line)
-                running_SP_count = 0
-                
-
-            #When calling a function with n arguments, it always turns the N arguments into 1 value. Therefore, it remove N-1. If N was zero, it adds 1
-            elif command == "call":
-                new_vm_filename.write(line)
-                running_SP_count -= int(parts[2]) - 1
-                
-            
-            elif command == "return":
-                new_vm_filename.write(line)
-                running_SP_count += -1
-                
-            
-            else:
-                raise ValueError(f"Unrecognized VM command: {line}")       
-            
-            
-            new_vm_filename.write("\n")
-            print(line)
-            
-            if running_SP_count == 0:
-                new_vm_filename.write("\n\n")
+    new_vm_filename = os.path.join(os.path.dirname(filename), "g_" + os.path.basename(filename))
+
+    with open(new_vm_filename, 'w') as new_vm_file:
+        for instructions in split_groups(lines):
+            new_vm_file.write("\n".join(instructions) + "\n\n\n")
     
 
 
-"""Types of optimizations
+"""Types of optimizations, done by VM_Peephole on these groups
 
 1. Push/Pop groups. A push instruction followed by a pop instruction. Even in the worst case scenario, we still save space by not using the stack.
 
@@ -487,5 +746,17 @@ def group(filename: str):
 
 
 """   
-print(translate_directory(sys.argv[1]))
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Translates the .vm files of a directory into Hack assembly")
+    argument_parser.add_argument("directory", help="a directory containing .vm files")
+    argument_parser.add_argument("--keep-unreachable", action="store_true", help="also translate the functions that cannot be reached from Sys.init")
+    argument_parser.add_argument("--no-peephole", action="store_true", help="translate the VM instructions one by one, without fusing them")
+    argument_parser.add_argument("--inline-threshold", type=int, default=INLINE_THRESHOLD, help=f"inline the functions of at most this many VM instructions, 0 to turn inlining off (default: {INLINE_THRESHOLD})")
+    argument_parser.add_argument("--comparisons", choices=COMPARISON_MODES, default="auto", help="translate eq, gt and lt through the shared COMP_BEGIN routine, inline, or inline only inside loops (default: auto)")
+    argument_parser.add_argument("--no-top-caching", action="store_true", help="always keep the top of the stack in memory instead of in the D register")
+    argument_parser.add_argument("--no-light-calls", action="store_true", help="save and restore THIS and THAT around every call, even to functions that never set them")
+    argument_parser.add_argument("--hack", action="store_true", help="also assemble the combined program into a .hack file")
+    argument_parser.add_argument("--source-map", action="store_true", help="write the .vm line of every line of the combined .asm file to a .asm.map file, and a .hack.map file with --hack")
+    arguments = argument_parser.parse_args()
+    translate_directory(arguments.directory, remove_unreachable=not arguments.keep_unreachable, inline_threshold=arguments.inline_threshold, peephole=not arguments.no_peephole, comparisons=arguments.comparisons, cache_top=not arguments.no_top_caching, light_calls=not arguments.no_light_calls, assemble_output=arguments.hack, source_map=arguments.source_map)
 #print(group(sys.argv[1]))
\ No newline at end of file
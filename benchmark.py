@@ -0,0 +1,1018 @@
+import io
+import sys
+import os
+import time
+import tempfile
+import gc
+import tracemalloc
+import shutil
+import contextlib
+import subprocess
+from parser import *
+from better_compiler import compile_tree, compile_class, emit_tree, process_directory
+import better_compiler
+import AST_Optimizer
+from Program_State import A_Program_State
+from VM_Linker import split_functions, count_rom_words
+from VM_Peephole import optimize_function, fuse_branches, clean_jumps
+import VM_Peephole
+import VM_translator
+import Hack_Assembler
+import Hack_Emulator
+import Hack_Profiler
+
+#Benchmarks for the toolchain. Run as: python3 benchmark.py <benchmark name> [size]
+#Every benchmark builds its own synthetic input, so nothing here depends on MY_OS compiling
+
+
+def generate_jack_class(amount_of_lines, class_name="Big"):
+    """
+    Returns the source of a syntactically valid Jack class with roughly amount_of_lines lines.
+    The bodies mix every statement type, comments and string constants so they look like real code.
+    """
+    lines = [f"/** Generated class with about {amount_of_lines} lines */", f"class {class_name} {{", "    static int counter;", "    field int x, y;", ""]
+    function_count = 0
+    while len(lines) < amount_of_lines:
+        lines.extend([
+            f"    // function number {function_count}",
+            f"    function int f{function_count}(int a, int b) {{",
+            "        var int i, sum;",
+            "        var Array arr;",
+            "        let i = 0;",
+            "        let sum = 0;",
+            "        /* a block comment",
+            "           spanning two lines */",
+            "        while (i < a) {",
+            "            let sum = sum + (i * b) - (counter / 2);",
+            "            if ((sum > 100) & ~(i = 3)) {",
+            "                let arr[i] = sum | 1;",
+            "            } else {",
+            "                do Output.printString(\"some text\");",
+            "            }",
+            "            let i = i + 1;",
+            "        }",
+            "        return sum;",
+            "    }",
+            "",
+        ])
+        function_count += 1
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_nested_jack_class(depth, width):
+    """
+    Returns a class whose only function nests depth if statements, with width statements at every level.
+    """
+    body = "        let x = x + 1;\n" * width
+    lines = ["class Nested {", "    function void f() {", "        var int x;"]
+    lines.extend(f"        if (x < {level}) {{" for level in range(depth))
+    lines.append(body)
+    for _ in range(depth):
+        lines.append("        }")
+        lines.append(body)
+    lines.extend(["        return;", "    }", "}"])
+    return "\n".join(lines) + "\n"
+
+
+def write_temporary_jack_file(amount_of_lines):
+    handle, filename = tempfile.mkstemp(suffix=".jack")
+    with os.fdopen(handle, "w") as file:
+        file.write(generate_jack_class(amount_of_lines))
+    return filename
+
+
+def best_time(function, repeats=3):
+    """
+    Returns the fastest of several runs of function(), in seconds, together with its last result.
+    """
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_tokenizer(amount_of_lines=100_000):
+    "Tokenizer throughput on one large generated .jack file"
+    filename = write_temporary_jack_file(amount_of_lines)
+    try:
+        size = os.path.getsize(filename)
+        elapsed, amount_of_tokens = best_time(lambda: sum(1 for _ in tokenize_file(filename)))
+        print(f"tokenize_file: {amount_of_lines} lines, {size} bytes, {amount_of_tokens} tokens")
+        print(f"    {elapsed:.3f}s, {amount_of_tokens / elapsed:,.0f} tokens/s, {size / elapsed / 1e6:.1f} MB/s")
+        tracemalloc.start()
+        sum(1 for _ in tokenize_file(filename))
+        print(f"    peak memory while streaming: {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB")
+        tracemalloc.stop()
+    finally:
+        os.remove(filename)
+
+
+# How much the cost per token may grow over the sizes of bench_parser_scaling before the parser counts as not linear.
+# Noise and caches stay well under it, popping tokens from the front of a list (quadratic) goes far over it
+MAX_PARSER_GROWTH = 3
+
+
+def bench_parser_scaling(largest=1_000_000):
+    "Parse time from 1k tokens up to [size] tokens, which should grow linearly"
+    # The generated class averages a little over 5 tokens per line
+    sizes = []
+    size = 1_000
+    while size <= largest:
+        sizes.append(size)
+        size *= 10
+
+    # The cyclic garbage collector rescans every live node as the tree grows, which would hide the parser's own complexity
+    per_token_times = []
+    for amount_of_tokens in sizes:
+        tokens = list(tokenize(generate_jack_class(amount_of_tokens // 5)))
+        gc.collect()
+        gc.disable()
+        try:
+            elapsed, _ = best_time(lambda: parse_list_of_token(tokens))
+        finally:
+            gc.enable()
+        per_token_times.append(elapsed / len(tokens))
+        print(f"{len(tokens):>9} tokens: {elapsed:.4f}s, {elapsed / len(tokens) * 1e6:.2f} us/token")
+
+    # A quadratic parser multiplies the cost per token by 10 at every step, a linear one keeps it flat
+    growth = per_token_times[-1] / min(per_token_times)
+    print(f"cost per token grew {growth:.2f}x over a {len(tokens) // sizes[0]}x larger input: {'linear' if growth < MAX_PARSER_GROWTH else 'NOT linear'}")
+    assert growth < MAX_PARSER_GROWTH, f"parse time is not linear in the number of tokens, the cost per token grew {growth:.2f}x"
+
+
+def measure_tree(sources):
+    """
+    Parses and compiles each source. Returns the memory held by the trees and the best parse and compile times.
+    """
+    token_lists = [list(tokenize(source)) for source in sources]
+    gc.collect()
+    tracemalloc.start()
+    trees = [parse_list_of_token(tokens) for tokens in token_lists]
+    tree_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    parse_time, trees = best_time(lambda: [parse_list_of_token(tokens) for tokens in token_lists])
+    compile_time, _ = best_time(lambda: [compile_tree(tree, A_Program_State("")) for tree in trees])
+    return tree_memory, parse_time, compile_time
+
+
+def bench_ast(amount_of_lines=50_000):
+    "Memory held by the AST and compile time, on MY_OS and on a generated class"
+    os_sources = list(read_os_classes().values())
+
+    for name, sources in [(f"MY_OS ({len(os_sources)} classes)", os_sources), (f"generated class, {amount_of_lines} lines", [generate_jack_class(amount_of_lines)])]:
+        tree_memory, parse_time, compile_time = measure_tree(sources)
+        print(f"{name}: trees hold {tree_memory / 1e6:.2f} MB, parse {parse_time:.3f}s, compile_tree {compile_time:.3f}s")
+
+
+def read_os_classes():
+    """
+    Returns the source of every class of MY_OS that parses, MY_OS is a work in progress and some classes do not yet.
+    Every class left out is reported, and the figures of the benchmarks using MY_OS only cover the others.
+    """
+    os_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MY_OS")
+    os_sources = {}
+    skipped = []
+    for filename in sorted(os.listdir(os_directory)):
+        if filename.endswith(".jack"):
+            with open(os.path.join(os_directory, filename)) as file:
+                source = file.read()
+            try:
+                parse_list_of_token(tokenize(source))
+                os_sources[filename] = source
+            except ValueError as e:
+                skipped.append(filename)
+                print(f"skipping {filename}: {e}")
+    print(f"MY_OS: {len(os_sources)} of {len(os_sources) + len(skipped)} classes parse" + (f", left out: {', '.join(skipped)}" if skipped else ""))
+    return os_sources
+
+
+# Idioms of a finished OS, which the MY_OS stubs do not have yet: named constants spelled out, masks, address arithmetic and endless loops
+CONSTANT_HEAVY_CLASS = """
+class Idioms {
+    static int color;
+    function void drawPixel(int x, int y) {
+        var int address, mask;
+        let address = 16384 + (y * (512 / 16)) + (x / 16);
+        let mask = ~(-1 - 1) + 0;
+        if (color = true) { do Memory.poke(address, Memory.peek(address) | mask); }
+        else { do Memory.poke(address, Memory.peek(address) & ~mask); }
+        return;
+    }
+    function int alloc(int size) {
+        var int block;
+        let block = 2048 + 0;
+        let block = ((block + 1) + 1) - 2;
+        if (false) { do Sys.error(5); }
+        return (block * 1) + (size - 0) + (2 * 3);
+    }
+    function void halt() {
+        while (true) { }
+        return;
+    }
+    function int word(int x) {
+        return (x & (255 * 256)) | (-(-x) & (~(~255)));
+    }
+}
+"""
+
+
+# The same idioms in a loop, for the minimal OS of the emulator (see EMULATED_CLASSES). The comparisons of out[2] overflow
+CONSTANT_HEAVY_MAIN = """
+class Main {
+    function void main() {
+        var Array out;
+        var int i, address, mask;
+        let out = 8000;
+        let i = 0;
+        while (i < (16 * 16)) {
+            let address = address + (16384 + (i * (512 / 16)) + (8 / 4)) - (16384 - 0);
+            let mask = (mask + (~(-1 - 1) + 0)) & (255 * 256 + 255);
+            let i = i + (2 - 1);
+        }
+        let out[0] = address;
+        let out[1] = mask;
+        let out[2] = (32767 < -2) & (-32767 > 2);
+        let out[3] = ((100 * 3) / 4) - (7 - 10);
+        return;
+    }
+}
+"""
+
+
+def bench_fold():
+    "VM instructions generated for every MY_OS class that parses and for a class of common OS idioms, and cycles of the idioms on the emulator, without and with constant folding"
+    total_before = total_after = 0
+    for filename, source in list(read_os_classes().items()) + [("Idioms", CONSTANT_HEAVY_CLASS)]:
+        before = len(compile_tree(parse_list_of_token(tokenize(source)), A_Program_State("")))
+        after = len(compile_class(parse_list_of_token(tokenize(source))))
+        total_before += before
+        total_after += after
+        print(f"{filename:>14}: {before:>5} -> {after:>5} VM instructions")
+    print(f"{'total':>14}: {total_before:>5} -> {total_after:>5} VM instructions, {1 - total_after / total_before:.1%} fewer")
+    print("The idioms in a loop on the emulator:")
+    compare_emulated([
+        ("without constant folding", [(better_compiler, dict(FOLD_CONSTANTS=False))]),
+        ("with constant folding", []),
+    ], dict(EMULATED_CLASSES, **{"Main.jack": CONSTANT_HEAVY_MAIN}))
+
+
+# Multiplications by small constants in a loop, like hashing and decimal parsing do, for the minimal OS of the emulator
+MULTIPLY_HEAVY_MAIN = """
+class Main {
+    function void main() {
+        var Array out;
+        var int i, hash, number, sum, polynomial;
+        let out = 8000;
+        let i = 0;
+        while (i < 200) {
+            let hash = (hash * 31) + i;
+            let number = (number * 10) + (i & 7);
+            let sum = (i * 3) + (i * 5) + (sum * 2);
+            let polynomial = polynomial + (((i * 7) + 3) * 12) - (i * -100);
+            let i = i + 1;
+        }
+        let out[0] = hash;
+        let out[1] = number;
+        let out[2] = sum;
+        let out[3] = polynomial;
+        return;
+    }
+}
+"""
+
+
+def bench_multiply():
+    "Multiplications by the constants 2 to 1024 that become additions, the VM code they take, and cycles of a multiplication heavy loop on the emulator"
+    lines = ["class Multiply {", "    function int f(int x) {", "        var int y;"]
+    lines.extend(f"        let y = x * {factor};" for factor in range(2, 1025))
+    lines.extend(["        return y;", "    }", "}"])
+    vm_instructions = compile_class(parse_list_of_token(tokenize("\n".join(lines))))
+    calls = sum(instruction == "call Math.multiply.2 2" for instruction in vm_instructions)
+    print(f"{1023 - calls} of 1023 multiplications by a constant need no call to Math.multiply")
+    print(f"{len(vm_instructions)} VM instructions for the whole class")
+    print("A multiplication heavy loop on the emulator:")
+    compare_emulated([
+        ("calling Math.multiply", [(AST_Optimizer, dict(REDUCE_MULTIPLICATIONS=False))]),
+        ("doublings and additions", []),
+    ], dict(EMULATED_CLASSES, **{"Main.jack": MULTIPLY_HEAVY_MAIN}))
+
+
+def bench_peephole():
+    "VM instructions and ROM words of every MY_OS class that parses, translated without and with the peephole optimizer"
+    totals = [0, 0, 0, 0]
+    for filename, source in read_os_classes().items():
+        class_name = filename.rsplit(".", 1)[0]
+        functions = split_functions(compile_class(parse_list_of_token(tokenize(source))))
+        plain = list(functions.values())
+        fused = [optimize_function(body) for body in functions.values()]
+        counts = [
+            sum(len(body) for body in plain),
+            sum(len(body) for body in fused),
+            sum(count_rom_words(VM_translator.translate_lines(body, class_name)) for body in plain),
+            sum(count_rom_words(VM_translator.translate_lines(body, class_name)) for body in fused),
+        ]
+        totals = [total + count for total, count in zip(totals, counts)]
+        print(f"{filename:>14}: {counts[0]:>5} -> {counts[1]:>5} VM instructions, {counts[2]:>6} -> {counts[3]:>6} ROM words")
+    print(f"{'total':>14}: {totals[0]:>5} -> {totals[1]:>5} VM instructions, {totals[2]:>6} -> {totals[3]:>6} ROM words, {1 - totals[3] / totals[2]:.1%} fewer")
+
+
+# Comparisons that do not feed a jump, so they are still translated: flags, and conditions joined with & and |
+COMPARISON_HEAVY_CLASS = """
+class Search {
+    function int count(Array a, int size, int low, int high) {
+        var int i, found;
+        while ((i < size) & ~(found = 100)) {
+            if ((a[i] > low) & (a[i] < high)) { let found = found + 1; }
+            let i = i + 1;
+        }
+        return found;
+    }
+    function boolean check(int x, int y) {
+        var boolean inside;
+        let inside = (x > 0) & (x < 512) & (y > 0) & (y < 256);
+        return inside | (x = y);
+    }
+}
+"""
+
+
+def bench_comparisons():
+    "ROM words of every MY_OS class that parses and of a comparison heavy class, with each way of translating comparisons"
+    sources = list(read_os_classes().items()) + [("Search", COMPARISON_HEAVY_CLASS)]
+    totals = {mode: 0 for mode in VM_translator.COMPARISON_MODES}
+    for filename, source in sources:
+        class_name = filename.rsplit(".", 1)[0]
+        functions = [optimize_function(body) for body in split_functions(compile_class(parse_list_of_token(tokenize(source)))).values()]
+        counts = {mode: sum(count_rom_words(VM_translator.translate_lines(body, class_name, mode)) for body in functions) for mode in VM_translator.COMPARISON_MODES}
+        totals = {mode: totals[mode] + counts[mode] for mode in totals}
+        print(f"{filename:>14}: " + ", ".join(f"{mode} {words:>6}" for mode, words in counts.items()) + " ROM words")
+    print(f"{'total':>14}: " + ", ".join(f"{mode} {words:>6}" for mode, words in totals.items()) + " ROM words")
+    print("Cycles for one comparison: shared 33 to 37 (the call into COMP_BEGIN and back), inline 8 to 11")
+
+
+# Array scans like the ones of MY_OS/Memory.jack, which does not parse yet: list nodes read with constant indices, and a[i] = a[i] + x
+ARRAY_HEAVY_CLASS = """
+class Heap {
+    function Array bestFit(Array list, int size) {
+        var Array node, best;
+        let node = list;
+        while (~(node = 0)) {
+            if ((node[1] = 1) & ~(node[0] < size)) {
+                if ((best = 0) | (node[0] < best[0])) { let best = node; }
+            }
+            let node = node[3];
+        }
+        return best;
+    }
+    function void link(Array node, Array previous, int size) {
+        let node[0] = size;
+        let node[1] = 1;
+        let node[2] = previous;
+        let node[3] = previous[3];
+        let previous[3] = node;
+        return;
+    }
+    function int scan(Array a, int n) {
+        var int i, sum;
+        while (i < n) {
+            let a[i] = a[i] + i;
+            let sum = sum + a[i];
+            let i = i + 1;
+        }
+        return sum;
+    }
+}
+"""
+
+
+# A first-fit scan of a free list, for the minimal OS of the emulator. Every node is [size, next]
+FIRST_FIT_MAIN = """
+class Main {
+    function Array firstFit(Array list, int size) {
+        var Array node;
+        let node = list;
+        while (~(node = 0)) {
+            if (~(node[0] < size)) {
+                let node[0] = node[0] - size;
+                return node;
+            }
+            let node = node[1];
+        }
+        return 0;
+    }
+
+    function void main() {
+        var Array out, heap, node, list, found;
+        var int i, hits, total;
+        let out = 8000;
+        let heap = Array.new(120);
+        let i = 0;
+        while (i < 30) {
+            let node = heap + (i * 4);
+            let node[0] = (i * 7) & 15;
+            let node[1] = list;
+            let list = node;
+            let i = i + 1;
+        }
+        let i = 0;
+        while (i < 200) {
+            let found = Main.firstFit(list, ((i * 5) & 7) + 1);
+            if (~(found = 0)) {
+                let hits = hits + 1;
+                let total = total + (found - heap);
+            }
+            let i = i + 1;
+        }
+        let out[0] = hits;
+        let out[1] = total;
+        let out[2] = list[0];
+        let out[3] = heap[0];
+        return;
+    }
+}
+"""
+
+
+def bench_arrays():
+    "Array accesses of a class scanning lists and arrays, the times THAT is set for them after the peephole optimizer, and cycles of a first-fit scan on the emulator"
+    functions = split_functions(compile_class(parse_list_of_token(tokenize(ARRAY_HEAVY_CLASS))))
+    for name, body in functions.items():
+        fused = optimize_function(body)
+        accesses = sum(line.startswith(("push that", "pop that")) for line in body)
+        that_settings = sum(line.endswith("pointer 1") for line in fused)
+        words = count_rom_words(VM_translator.translate_lines(fused, "Heap"))
+        print(f"{name:>16}: {accesses:>2} array accesses set THAT {that_settings:>2} times, {words:>4} ROM words")
+    print("A first-fit scan of a free list on the emulator:")
+    compare_emulated([
+        ("index added to the base", [(better_compiler, dict(CONSTANT_INDEXES=False)), (VM_Peephole, dict(REUSE_THAT_POINTER=False))]),
+        ("+ constant indexes", [(VM_Peephole, dict(REUSE_THAT_POINTER=False))]),
+        ("+ THAT reused", []),
+    ], dict(EMULATED_CLASSES, **{"Main.jack": FIRST_FIT_MAIN}))
+
+
+# Ifs with an else at the end of a loop, returns inside ifs and an endless loop, where the generated jumps lead to other jumps
+CONTROL_FLOW_CLASS = """
+class Loops {
+    function int count(int n) {
+        var int a;
+        while (n > 0) {
+            if (n & 1) { let a = a + 1; } else { let a = a - 1; }
+            let n = n - 1;
+            if (n = 5) { return a; } else { let a = a + 2; }
+        }
+        return a;
+    }
+    function int find(Array a, int n, int x) {
+        var int i;
+        while (true) {
+            if (i = n) { return -1; } else { if (a[i] = x) { return i; } }
+            let i = i + 1;
+        }
+        return 0;
+    }
+}
+"""
+
+
+def bench_jumps():
+    "Jumps, labels and ROM words of every MY_OS class that parses and of branchy classes, before and after VM_Peephole.clean_jumps"
+    totals = [0] * 6
+    sources = list(read_os_classes().items()) + [("Search", COMPARISON_HEAVY_CLASS), ("Heap", ARRAY_HEAVY_CLASS), ("Loops", CONTROL_FLOW_CLASS)]
+    for filename, source in sources:
+        class_name = filename.rsplit(".", 1)[0]
+        counts = [0] * 6
+        for body in split_functions(compile_class(parse_list_of_token(tokenize(source)))).values():
+            body = fuse_branches(body)
+            for offset, lines in ((0, body), (1, clean_jumps(body))):
+                counts[offset] += sum(line.startswith(("goto ", "if-goto ", "branch ")) for line in lines)
+                counts[2 + offset] += sum(line.startswith("label ") for line in lines)
+                counts[4 + offset] += count_rom_words(VM_translator.translate_lines(lines, class_name))
+        totals = [total + count for total, count in zip(totals, counts)]
+        print(f"{filename:>14}: {counts[0]:>4} -> {counts[1]:>4} jumps, {counts[2]:>4} -> {counts[3]:>4} labels, {counts[4]:>6} -> {counts[5]:>6} ROM words")
+    print(f"{'total':>14}: {totals[0]:>4} -> {totals[1]:>4} jumps, {totals[2]:>4} -> {totals[3]:>4} labels, {totals[4]:>6} -> {totals[5]:>6} ROM words")
+
+
+def bench_top_caching():
+    "ROM words of every MY_OS class that parses, translated with the top of the stack in memory and cached in D"
+    totals = [0, 0]
+    for filename, source in read_os_classes().items():
+        class_name = filename.rsplit(".", 1)[0]
+        functions = [optimize_function(body) for body in split_functions(compile_class(parse_list_of_token(tokenize(source)))).values()]
+        counts = [sum(count_rom_words(VM_translator.translate_lines(body, class_name, cache_top=cache_top)) for body in functions) for cache_top in (False, True)]
+        totals = [total + count for total, count in zip(totals, counts)]
+        print(f"{filename:>14}: {counts[0]:>6} -> {counts[1]:>6} ROM words")
+    print(f"{'total':>14}: {totals[0]:>6} -> {totals[1]:>6} ROM words, {1 - totals[1] / totals[0]:.1%} fewer")
+
+
+def bench_assembler(amount_of_lines=1_000):
+    "Assembling a program of a generated [size] line class, from .asm text and from the translator's list, and with assembler.lua if lua is installed"
+    functions = split_functions(compile_class(parse_list_of_token(tokenize(generate_jack_class(amount_of_lines)))))
+    asm_parts = [VM_translator.give_bootstrap_code(), VM_translator.give_starter_code()]
+    asm_parts.extend(VM_translator.translate_lines(optimize_function(body), "Big") for body in functions.values())
+    asm = "".join(asm_parts)
+    directory = tempfile.mkdtemp()
+    try:
+        asm_filename = os.path.join(directory, "Big.asm")
+        with open(asm_filename, "w") as file:
+            file.write(asm)
+        elapsed, words = best_time(lambda: Hack_Assembler.assemble(asm))
+        print(f"{len(words)} words, {asm.count(chr(10))} lines of assembly")
+        print(f"Hack_Assembler.assemble, text: {elapsed:.3f}s")
+        elapsed, _ = best_time(lambda: Hack_Assembler.assemble(asm_parts))
+        print(f"Hack_Assembler.assemble, translator list: {elapsed:.3f}s")
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, hack_filename = best_time(lambda: Hack_Assembler.assemble_file(asm_filename))
+        print(f"Hack_Assembler.assemble_file, .asm to .hack: {elapsed:.3f}s")
+        with open(hack_filename) as file:
+            python_output = file.read()
+        if shutil.which("lua") is None:
+            print("lua is not installed, assembler.lua not measured")
+            return
+        lua_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assembler.lua")
+        elapsed, _ = best_time(lambda: subprocess.run(["lua", lua_script, asm_filename], capture_output=True, check=True))
+        with open(hack_filename) as file:
+            same = file.read() == python_output
+        print(f"assembler.lua, .asm to .hack: {elapsed:.3f}s, {'same output' if same else 'DIFFERENT output'}")
+    finally:
+        shutil.rmtree(directory)
+
+
+# A minimal OS and a program for the emulator, which leaves its results in RAM[8000..]
+EMULATED_CLASSES = {
+    "Sys.jack": """
+class Sys {
+    function void init() {
+        do Memory.init();
+        do Math.init();
+        do Main.main();
+        do Sys.halt();
+        return;
+    }
+
+    function void halt() {
+        while (true) {
+        }
+        return;
+    }
+}
+""",
+    "Memory.jack": """
+class Memory {
+    static int free;
+
+    function void init() {
+        let free = 2048;
+        return;
+    }
+
+    function int alloc(int size) {
+        var int block;
+        let block = free;
+        let free = free + size;
+        return block;
+    }
+}
+""",
+    "Array.jack": """
+class Array {
+    function Array new(int size) {
+        return Memory.alloc(size);
+    }
+}
+""",
+    "Math.jack": """
+class Math {
+    static Array powersOfTwo;
+
+    function void init() {
+        var int i, p;
+        let powersOfTwo = Array.new(16);
+        let i = 0;
+        let p = 1;
+        while (i < 16) {
+            let powersOfTwo[i] = p;
+            let p = p + p;
+            let i = i + 1;
+        }
+        return;
+    }
+
+    function boolean bit(int x, int j) {
+        return ~((x & powersOfTwo[j]) = 0);
+    }
+
+    function int multiply(int x, int y) {
+        var int sum, shiftedX, j;
+        let sum = 0;
+        let shiftedX = x;
+        let j = 0;
+        while (j < 16) {
+            if (Math.bit(y, j)) {
+                let sum = sum + shiftedX;
+            }
+            let shiftedX = shiftedX + shiftedX;
+            let j = j + 1;
+        }
+        return sum;
+    }
+
+    function int divide(int x, int y) {
+        var int q;
+        if ((y > x) | (y < 0)) {
+            return 0;
+        }
+        let q = Math.divide(x, y + y);
+        if ((x - ((q + q) * y)) < y) {
+            return q + q;
+        }
+        return q + q + 1;
+    }
+}
+""",
+    "Main.jack": """
+class Main {
+    function void main() {
+        var Array a, out;
+        var int i, j, t, n, sum;
+        let out = 8000;
+        let n = 40;
+        let a = Array.new(n);
+        let i = 0;
+        while (i < n) {
+            let a[i] = (i * 37) - ((i * 91) / 7);
+            let i = i + 1;
+        }
+        let i = 1;
+        while (i < n) {
+            let t = a[i];
+            let j = i - 1;
+            while ((j > -1) & (a[j] > t)) {
+                let a[j + 1] = a[j];
+                let j = j - 1;
+            }
+            let a[j + 1] = t;
+            let i = i + 1;
+        }
+        let i = 0;
+        let sum = 0;
+        while (i < n) {
+            let sum = sum + (a[i] * (i + 1));
+            let i = i + 1;
+        }
+        let out[0] = a[0];
+        let out[1] = a[n - 1];
+        let out[2] = sum;
+        let out[3] = Main.fib(14);
+        return;
+    }
+
+    function int fib(int n) {
+        if (n < 2) {
+            return n;
+        }
+        return Main.fib(n - 1) + Main.fib(n - 2);
+    }
+}
+""",
+}
+
+
+def build_emulated_program(directory, classes=EMULATED_CLASSES, **options):
+    """
+    Writes classes, EMULATED_CLASSES by default, into directory, compiles and translates them with the options of
+    VM_translator.translate_directory, and returns the words of the program.
+    """
+    for filename, source in classes.items():
+        with open(os.path.join(directory, filename), "w") as file:
+            file.write(source)
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_directory(directory, use_cache=False)
+        VM_translator.translate_directory(directory, assemble_output=True, **options)
+    return Hack_Emulator.read_hack(os.path.join(directory, os.path.basename(directory) + ".hack"))
+
+
+def run_emulated(classes=EMULATED_CLASSES, **options):
+    """
+    Builds a program like build_emulated_program, in a temporary directory, and runs it. Returns the computer once it halted.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        computer = Hack_Emulator.A_Hack_Computer(build_emulated_program(directory, classes, **options))
+    finally:
+        shutil.rmtree(directory)
+    computer.run_compiled(100_000_000)
+    return computer
+
+
+@contextlib.contextmanager
+def changed_settings(module, **settings):
+    """
+    Changes settings of a module, like better_compiler.FOLD_CONSTANTS, for the duration of a with block.
+    """
+    saved = {name: getattr(module, name) for name in settings}
+    for name, value in settings.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def compare_emulated(configurations, classes, results=slice(8000, 8004)):
+    """
+    Runs classes once for every (name, [(module, settings), ...]) configuration and prints the cycles of each,
+    checking the results stay the same. Returns the computers.
+    """
+    computers = []
+    for name, changes in configurations:
+        with contextlib.ExitStack() as stack:
+            for module, settings in changes:
+                stack.enter_context(changed_settings(module, **settings))
+            computer = run_emulated(classes)
+        computers.append(computer)
+        same = computer.halted and computer.ram[results] == computers[0].ram[results]
+        print(f"{name:>28}: {computer.cycles:>8} cycles, {'same results' if same else 'DIFFERENT results'}")
+    return computers
+
+
+def bench_cycles():
+    "ROM words and cycles on the emulator of a small program on a minimal OS, with each optimization of the translator turned on in turn"
+    configurations = [
+        ("nothing", dict(inline_threshold=0, peephole=False, comparisons="shared", cache_top=False, light_calls=False)),
+        ("+ inlining", dict(peephole=False, comparisons="shared", cache_top=False, light_calls=False)),
+        ("+ peephole", dict(comparisons="shared", cache_top=False, light_calls=False)),
+        ("+ inline comparisons", dict(cache_top=False, light_calls=False)),
+        ("+ top of stack in D", dict(light_calls=False)),
+        ("+ light calls", dict()),
+    ]
+    directory = tempfile.mkdtemp()
+    try:
+        reference = None
+        for name, options in configurations:
+            computer = Hack_Emulator.A_Hack_Computer(build_emulated_program(directory, **options))
+            computer.run_compiled(100_000_000)
+            results = computer.ram[8000:8004]
+            reference = reference or results
+            state = "same results" if results == reference and computer.halted else "DIFFERENT results"
+            print(f"{name:>22}: {len(computer.rom):>5} ROM words, {computer.cycles:>8} cycles, {state}")
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_emulator():
+    "Instructions per second of the emulator on the program of the cycles benchmark, interpreted and by compiled blocks"
+    directory = tempfile.mkdtemp()
+    try:
+        words = build_emulated_program(directory)
+    finally:
+        shutil.rmtree(directory)
+    computers = []
+
+    def run(mode):
+        computer = Hack_Emulator.A_Hack_Computer(words)
+        getattr(computer, mode)()
+        computers.append(computer)
+        return computer.cycles
+
+    Hack_Emulator.BLOCK_CACHE.clear()
+    start = time.perf_counter()
+    cycles = run("run_compiled")
+    cold_time = time.perf_counter() - start
+    interpreted_time, _ = best_time(lambda: run("run"))
+    compiled_time, _ = best_time(lambda: run("run_compiled"))
+    same = all(computer.ram == computers[0].ram and computer.cycles == cycles for computer in computers)
+    print(f"{cycles} cycles, {len(words)} ROM words, {sum(bool(block) for block in Hack_Emulator.BLOCK_CACHE[computers[0].rom_hash])} blocks compiled")
+    print(f"interpreted: {interpreted_time:.3f}s, {cycles / interpreted_time / 1e6:.2f}M instructions/s")
+    print(f"compiled blocks, first run: {cold_time:.3f}s, {cycles / cold_time / 1e6:.2f}M instructions/s")
+    print(f"compiled blocks, cached: {compiled_time:.3f}s, {cycles / compiled_time / 1e6:.2f}M instructions/s, {interpreted_time / compiled_time:.1f}x, {'same state' if same else 'DIFFERENT state'}")
+
+# A String class for the minimal OS of the emulator, and a loop evaluating a string constant. Memory.alloc(0) reads the free pointer
+STRING_CLASSES = {
+    "String.jack": """
+class String {
+    field Array chars;
+    field int length;
+
+    constructor String new(int maxLength) {
+        let chars = Array.new(maxLength);
+        let length = 0;
+        return this;
+    }
+
+    method String appendChar(char c) {
+        let chars[length] = c;
+        let length = length + 1;
+        return this;
+    }
+
+    method int length() {
+        return length;
+    }
+
+    method char charAt(int i) {
+        return chars[i];
+    }
+}
+""",
+    "Main.jack": """
+class Main {
+    function void main() {
+        var Array out;
+        var String s;
+        var int i, sum, free;
+        let out = 8000;
+        let free = Memory.alloc(0);
+        let i = 0;
+        while (i < 20) {
+            let s = "hello!";
+            let sum = sum + s.length() + s.charAt(i & 3);
+            let i = i + 1;
+        }
+        let out[0] = sum;
+        let out[1] = Memory.alloc(0) - free;
+        return;
+    }
+}
+""",
+}
+
+
+def bench_strings():
+    "Heap words and cycles on the emulator of a loop evaluating a string constant 20 times, without and with the string pool"
+    computers = compare_emulated([
+        ("built at every evaluation", [(better_compiler, dict(POOL_STRINGS=False))]),
+        ("pooled", []),
+    ], dict(EMULATED_CLASSES, **STRING_CLASSES), results=slice(8000, 8001))
+    print("heap words used by the loop: " + " -> ".join(str(computer.ram[8001]) for computer in computers))
+
+
+def bench_profile():
+    "Where the cycles of the program of the cycles benchmark go, per function and call edge, and what profiling costs"
+    directory = tempfile.mkdtemp()
+    try:
+        words = build_emulated_program(directory)
+        with open(os.path.join(directory, os.path.basename(directory) + ".asm")) as file:
+            _, labels, _ = Hack_Assembler.assemble_program(file.read())
+    finally:
+        shutil.rmtree(directory)
+    profilers = []
+
+    def profile():
+        profiler = Hack_Profiler.A_Profiler(words, labels)
+        profiler.run()
+        profilers.append(profiler)
+
+    profile_time, _ = best_time(profile)
+    run_time, _ = best_time(lambda: Hack_Emulator.A_Hack_Computer(words).run_compiled())
+    print(profilers[0].report(10))
+    print(f"profiled: {profile_time:.3f}s, not profiled: {run_time:.3f}s, {profile_time / run_time:.2f}x")
+
+def bench_xml(amount_of_lines=100_000):
+    "Streaming the XML and the debug dump of a large generated class, and of 300 nested ifs, to files"
+    wide_tree = parse_list_of_token(tokenize(generate_jack_class(amount_of_lines)))
+    deep_tree = parse_list_of_token(tokenize(generate_nested_jack_class(300, 50)))
+    for name, writer, tree in [("write_xml", write_xml, wide_tree), ("write_tree_dump", write_tree_dump, wide_tree), ("write_xml, 300 nested ifs", write_xml, deep_tree)]:
+        handle, filename = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            def write_file():
+                with open(filename, "w") as file:
+                    writer(tree, file)
+            elapsed, _ = best_time(write_file)
+            size = os.path.getsize(filename)
+            tracemalloc.start()
+            write_file()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name}: {size / 1e6:.1f} MB written in {elapsed:.3f}s ({size / elapsed / 1e6:.1f} MB/s), peak memory {peak / 1e6:.2f} MB")
+        finally:
+            os.remove(filename)
+
+
+def bench_codegen(largest_depth=250):
+    "Code generation for ifs nested 25 levels deep up to [size], into a list and into a sink that only counts"
+    for depth in [25, 50, 100, 200, largest_depth]:
+        if depth > largest_depth:
+            break
+        tree = parse_list_of_token(tokenize(generate_nested_jack_class(depth, 20)))
+        elapsed, vm_instructions = best_time(lambda: compile_tree(tree, A_Program_State("")))
+        tracemalloc.start()
+        compile_tree(tree, A_Program_State(""))
+        list_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        amount_of_instructions = [0]
+        def count(instruction):
+            amount_of_instructions[0] += 1
+        emit_tree(tree, A_Program_State(""), count)
+        sink_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"depth {depth:>3}: {len(vm_instructions)} instructions in {elapsed:.4f}s ({elapsed / len(vm_instructions) * 1e6:.2f} us each), "
+              f"peak memory {list_peak / 1e6:.2f} MB into a list, {sink_peak / 1e6:.3f} MB into a counting sink")
+
+
+def generate_project(directory, amount_of_classes, lines_per_class):
+    """
+    Writes amount_of_classes generated classes into directory. Class i calls into class i + 1 so the cache has dependencies to track.
+    """
+    for i in range(amount_of_classes):
+        source = generate_jack_class(lines_per_class, f"C{i}")
+        call = f"        do C{(i + 1) % amount_of_classes}.f0(1, 2);\n        return sum;"
+        source = source.replace("        return sum;", call, 1)
+        with open(os.path.join(directory, f"C{i}.jack"), "w") as file:
+            file.write(source)
+
+
+def bench_incremental(amount_of_classes=200):
+    "Rebuild times of a [size] class project with the compilation cache: cold, unchanged, one body edited, one signature changed"
+    directory = tempfile.mkdtemp()
+    try:
+        generate_project(directory, amount_of_classes, 300)
+
+        def build():
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                start = time.perf_counter()
+                process_directory(directory)
+                elapsed = time.perf_counter() - start
+            return elapsed, output.getvalue().count("Successfully created")
+
+        def edit(class_name, old, new):
+            path = os.path.join(directory, f"{class_name}.jack")
+            with open(path) as file:
+                source = file.read()
+            with open(path, "w") as file:
+                file.write(source.replace(old, new, 1))
+
+        steps = [
+            ("cold build", lambda: None),
+            ("nothing changed", lambda: None),
+            ("one function body edited", lambda: edit("C7", "let i = 0;", "let i = 1;")),
+            ("one signature changed", lambda: edit("C7", "function int f1(int a, int b)", "function int f1(int a, int b, int c)")),
+        ]
+        for name, change in steps:
+            change()
+            elapsed, compiled = build()
+            print(f"{name}: {elapsed:.3f}s, {compiled} of {amount_of_classes} classes compiled")
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_parallel(amount_of_classes=400):
+    "Cold build of a [size] class project with 1, 2, 4 and 8 worker processes, checking that every build writes the same VM files"
+    directory = tempfile.mkdtemp()
+    try:
+        generate_project(directory, amount_of_classes, 1_000)
+        print(f"{amount_of_classes} classes of 1000 lines, {os.cpu_count()} cores available")
+        reference = None
+        single_worker_time = None
+        for workers in [1, 2, 4, 8]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, _ = best_time(lambda: process_directory(directory, use_cache=False, workers=workers), repeats=2)
+            vm_files = {}
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith(".vm"):
+                    with open(os.path.join(directory, filename)) as file:
+                        vm_files[filename] = file.read()
+            reference = reference or vm_files
+            single_worker_time = single_worker_time or elapsed
+            print(f"{workers} workers: {elapsed:.3f}s, {single_worker_time / elapsed:.2f}x, {'same output' if vm_files == reference else 'DIFFERENT output'}")
+    finally:
+        shutil.rmtree(directory)
+
+
+benchmarks = {
+    "tokenizer": bench_tokenizer,
+    "parser_scaling": bench_parser_scaling,
+    "ast": bench_ast,
+    "xml": bench_xml,
+    "fold": bench_fold,
+    "multiply": bench_multiply,
+    "strings": bench_strings,
+    "peephole": bench_peephole,
+    "comparisons": bench_comparisons,
+    "top_caching": bench_top_caching,
+    "arrays": bench_arrays,
+    "jumps": bench_jumps,
+    "assembler": bench_assembler,
+    "cycles": bench_cycles,
+    "emulator": bench_emulator,
+    "profile": bench_profile,
+    "codegen": bench_codegen,
+    "incremental": bench_incremental,
+    "parallel": bench_parallel,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) not in {2, 3} or sys.argv[1] not in benchmarks:
+        print("Usage: python3 benchmark.py <benchmark> [size]")
+        for name, function in benchmarks.items():
+            print(f"    {name}: {function.__doc__}")
+    elif len(sys.argv) == 3:
+        benchmarks[sys.argv[1]](int(sys.argv[2]))
+    else:
+        benchmarks[sys.argv[1]]()
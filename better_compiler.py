@@ -1,8 +1,14 @@
 import sys
 from parser import *
 import os
+import argparse
+import hashlib
 import traceback
+import concurrent.futures
 from Program_State import A_Program_State
+from AST_Optimizer import fold_class, constant_value, constant_factor, has_array_access, TRUE
+from Compile_Cache import A_Compile_Cache, hash_text, class_signature, called_classes
+from Source_Map import write_map
 #Now I need to turn a .jack file into a .vm file
 #Specifically, I have to compile the type of nodes: class, subroutineDec, statements, expressions
     # Structures are:
@@ -11,260 +17,552 @@ from Program_State import A_Program_State
     # expression, term, and expressionList
 
 
-#When compiling a node, ideally we should return a list of VM instructions. Or we add an item to a symbol table
-def compile_tree(node: Node, the_Program: A_Program_State):
-                   
-    def compile_subroutine_call(nodes: list) -> list:
-        """
-        Compiles a subroutine call into VM instructions.
-        """
-        vm_instructions = []
-
-        # Count the number of arguments in the expression list
-        amount_of_arguments = 0
-        for node in nodes[-2].children:
-            if node.type == "expression":
-                amount_of_arguments += 1
-                vm_instructions.extend(compile_tree(node, the_Program))
-
-        if len(nodes) in [4, 6]:  # Support for `func(args)` and `Class.func(args)`
-            if len(nodes) == 6:
-                # Handling `foo.bar(...)`, which could be a function or method call
-                the_foo = nodes[0].value
-                # Check if `foo` is a variable (method call) or a class (function call)
-                symbol = the_Program.lookup_symbol(the_foo)
-                if symbol:  # `the_foo` is a variable (method call)
-                    vm_instructions.insert(0, the_Program.handle_var_name(the_foo, True)[0])
-                    class_name = symbol[0]
-                    vm_instructions.append(f"call {class_name}.{nodes[2].value}.{amount_of_arguments + 1} {amount_of_arguments + 1}")
-                else:  # `the_foo` is a class (function call)
-                    vm_instructions.append(f"call {nodes[0].value}.{nodes[2].value}.{amount_of_arguments} {amount_of_arguments}")
-            else:
-                # Handling `foo(...)`, which is a method within the current class. Therefore I don't need to push the pointer, saving instructions
-                vm_instructions.extend(["push pointer 0", f"call {the_Program.get_class_name()}.{nodes[0].value}.{amount_of_arguments + 1} {amount_of_arguments + 1}"])
+# The code generator streams instructions into a sink: `emit` is any callable taking one VM instruction,
+# like list.append, a function writing to a file, or a downstream translator. Nothing is built up and copied.
+OPERATORS = {"+": "add", "-": "sub", "*": "call Math.multiply.2 2", "/": "call Math.divide.2 2",
+            "&": "and", "|": "or", "<": "lt", ">": "gt", "=": "eq"}
+UNARY_OPERATORS = {"-": "neg", "~": "not"}
+# Multiplying by a constant is done with doublings and additions instead of calling Math.multiply, see AST_Optimizer.constant_factor
+# Temporaries used while multiplying by a constant: the operand, and the running product when it has to be doubled
+MULTIPLY_OPERAND = "temp 1"
+MULTIPLY_PRODUCT = "temp 2"
+
+# The optimizations of the code generator can be turned off, to measure what each one saves (see benchmark.py).
+# Strength reduction is turned off with AST_Optimizer.REDUCE_MULTIPLICATIONS, since folding has to know which multiplications call
+FOLD_CONSTANTS = True
+POOL_STRINGS = True
+CONSTANT_INDEXES = True
+
+KEYWORD_CONSTANTS = {
+    "true": ("push constant 1", "neg"),
+    "false": ("push constant 0",),
+    "null": ("push constant 0",),
+    "this": ("push pointer 0",),
+}
 
-        return vm_instructions
+
+def emit_multiply_by_constant(operand, factor: int, the_Program: A_Program_State, emit) -> None:
+    """
+    Emits operand * factor as a chain of doublings and additions, reading the bits of the factor from the top.
+    Wraps around exactly like Math.multiply. The VM has no dup, so a value used twice is pushed twice from where it is kept.
+    """
+    if operand.type == "varName":
+        # A variable can simply be pushed again
+        operand_push = the_Program.handle_var_name(operand.name, True)[0]
+        emit(operand_push)
+    else:
+        emit_tree(operand, the_Program, emit)
+        emit(f"pop {MULTIPLY_OPERAND}")
+        operand_push = f"push {MULTIPLY_OPERAND}"
+        emit(operand_push)
+    product_is_operand = True
+    for bit in bin(abs(factor))[3:]:
+        if product_is_operand:
+            emit(operand_push)
+        else:
+            emit(f"pop {MULTIPLY_PRODUCT}")
+            emit(f"push {MULTIPLY_PRODUCT}")
+            emit(f"push {MULTIPLY_PRODUCT}")
+        emit("add")
+        product_is_operand = False
+        if bit == "1":
+            emit(operand_push)
+            emit("add")
+    if factor < 0:
+        emit("neg")
 
 
+def is_unchanged_by_calls(node, the_Program: A_Program_State) -> bool:
+    """
+    True if the expression only reads constants, locals and arguments, so evaluating anything else cannot change its value.
+    """
+    match node.type:
+        case "integerConstant" | "keywordConstant":
+            return True
+        case "varName":
+            return the_Program.handle_var_name(node.name, True)[0].split()[1] in {"local", "argument"}
+        case "binaryExpr":
+            return is_unchanged_by_calls(node.left, the_Program) and is_unchanged_by_calls(node.right, the_Program)
+        case "unaryExpr":
+            return is_unchanged_by_calls(node.operand, the_Program)
+        case "parenExpr":
+            return is_unchanged_by_calls(node.expression, the_Program)
+        case _:
+            return False
+
+
+def emit_that_pointer(name: str, index, the_Program: A_Program_State, emit) -> int:
+    """
+    Points THAT at the element name[index] and returns its offset from THAT.
+    With a constant index, THAT points at the array itself and the offset is the index, which saves the addition.
+    """
+    index_value = constant_value(index)
+    emit_index = not CONSTANT_INDEXES or index_value is None or index_value < 0
+    if emit_index:
+        emit_tree(index, the_Program, emit)
+    emit(the_Program.handle_var_name(name, True)[0])
+    if emit_index:
+        emit("add")
+    emit("pop pointer 1")
+    return 0 if emit_index else index_value
+
+
+def emit_statements(statements: list, the_Program: A_Program_State, emit) -> None:
+    "statements: statement*"
+    # What an if or a while emits after its statements belongs to its own line again
+    enclosing_line = the_Program.line
+    for statement in statements:
+        the_Program.line = statement.line
+        emit_tree(statement, the_Program, emit)
+    the_Program.line = enclosing_line
+
+
+def emit_subroutine_call(call: SubroutineCall, the_Program: A_Program_State, emit) -> None:
+    """
+    Emits the VM instructions of a subroutine call.
+    """
+    # Count the number of arguments in the expression list
+    amount_of_arguments = len(call.arguments)
+
+    if call.receiver is not None:
+        # Handling `foo.bar(...)`, which could be a function or method call
+        the_foo = call.receiver
+        # Check if `foo` is a variable (method call) or a class (function call)
+        symbol = the_Program.lookup_symbol(the_foo)
+        if symbol:  # `the_foo` is a variable (method call), the object goes first
+            emit(the_Program.handle_var_name(the_foo, True)[0])
+            for argument in call.arguments:
+                emit_tree(argument, the_Program, emit)
+            class_name = symbol[0]
+            emit(f"call {class_name}.{call.name}.{amount_of_arguments + 1} {amount_of_arguments + 1}")
+        else:  # `the_foo` is a class (function call)
+            for argument in call.arguments:
+                emit_tree(argument, the_Program, emit)
+            emit(f"call {the_foo}.{call.name}.{amount_of_arguments} {amount_of_arguments}")
+    else:
+        # Handling `foo(...)`, which is a method within the current class. Therefore I don't need to push the pointer, saving instructions
+        for argument in call.arguments:
+            emit_tree(argument, the_Program, emit)
+        emit("push pointer 0")
+        emit(f"call {the_Program.get_class_name()}.{call.name}.{amount_of_arguments + 1} {amount_of_arguments + 1}")
+
+
+def emit_tree(node, the_Program: A_Program_State, emit) -> None:
     match node.type:
         case "class":
             "'class': className '{' classVarDec* subroutineDec* '}'"
-            the_Program.set_class_name(node.children[1].value)
-            return [
-                instr for child in node.children[2:-1]
-                for instr in compile_tree(child, the_Program)
-            ]
+            the_Program.set_class_name(node.name)
+            for child in node.class_var_decs:
+                emit_tree(child, the_Program, emit)
+            for child in node.subroutine_decs:
+                emit_tree(child, the_Program, emit)
 
         case "classVarDec":
             "classVarDec: ('static'|'field') type varName (',' varName)* ';'"
-            for child in node.children[2:]:
-                if child.type == "identifier":
-                    the_Program.add_to_class_ST(child.value, node.children[1].value, node.children[0].value)
-            return []
+            for name in node.names:
+                the_Program.add_to_class_ST(name, node.var_type, node.kind)
 
         case "subroutineDec":
             "('constructor'|'function'|'method') ('void' | type) subroutineName '(' parameterList ')' subroutineBody"
             the_Program.reset_Subroutine_ST()
-            subroutine_type = node.children[0].value
+            subroutine_type = node.kind
             #If the function is a method, then there is always one "argument" - the pointer to the object
             if subroutine_type == "method":
                 the_Program.increment_var_counts_for_a_type("argument")
-            the_Program.set_subroutine_name(node.children[2].value)
-            compile_tree(node.children[4], the_Program)
+            the_Program.set_subroutine_name(node.name)
+            "parameterList: ((type varName) (',' type varName)*)?"
+            for var_type, name in node.parameters:
+                the_Program.add_to_subroutine_ST(name, var_type, "argument")
             the_Program.add_function_statement_counter()
-            vm_instructions = compile_tree(node.children[6], the_Program)
-            vm_instructions.insert(0, f"function {the_Program.get_fuction_declaraction_name()} {the_Program.get_var_counts_for_a_type('local')}")
+            "subroutineBody: '{' varDec* statements '}'"
+            for var_dec in node.var_decs:
+                emit_tree(var_dec, the_Program, emit)
+            # Every local is declared before the first statement, so the header can go out before the body
+            the_Program.line = node.line
+            emit(f"function {the_Program.get_fuction_declaraction_name()} {the_Program.get_var_counts_for_a_type('local')}")
             if subroutine_type == "method":
-                vm_instructions[1:1] = ["push argument 0", "pop pointer 0"]
+                emit("push argument 0")
+                emit("pop pointer 0")
             elif subroutine_type == "constructor":
-                vm_instructions[1:1] = [f"push constant {the_Program.get_var_counts_for_a_type('field')}", "call Memory.alloc.1 1", "pop pointer 0"]
-            return vm_instructions
-
-        case "parameterList":
-            "parameterList: ((type varName) (',' type varName)*)?"
-            for i in range(0, len(node.children), 3):
-                the_Program.add_to_subroutine_ST(node.children[i + 1].value, node.children[i].value, "argument")
-            return []
-
-        case "subroutineBody":
-            "subroutineBody: '{' varDec* statements '}'"
-            return [instr for child in node.children[1:-1] for instr in compile_tree(child, the_Program)]
+                emit(f"push constant {the_Program.get_var_counts_for_a_type('field')}")
+                emit("call Memory.alloc.1 1")
+                emit("pop pointer 0")
+            emit_statements(node.statements, the_Program, emit)
 
         case "varDec":
             "varDec: 'var' type varName (',' varName)* ';'"
-            for child in node.children[2:]:
-                if child.type == "identifier":
-                    the_Program.add_to_subroutine_ST(child.value, node.children[1].value, "local")
-            return []
-
-        case "statements":
-            "statements: statement*"
-            return [instr for child in node.children for instr in compile_tree(child, the_Program)]
-        
+            for name in node.names:
+                the_Program.add_to_subroutine_ST(name, node.var_type, "local")
+
         #if-goto jumps if the condition is true (when the top of the stack is not zero)
 
         case "whileStatement":
             "whileStatement: 'while' '(' expression ')' '{' statements '}'"
-            #print(node)
-            label_format = the_Program.get_fuction_declaraction_name() + ".WHILE." + str(the_Program.get_statement_counter("while"))   
-            #print(compile_tree(node.children[5], the_Program), node.children[5])       
-            return [f"label {label_format}_BEGIN"] + compile_tree(node.children[2], the_Program) + [f"not", f"if-goto {label_format}_END"] + compile_tree(node.children[5], the_Program) + [f"goto {label_format}_BEGIN", f"label {label_format}_END"]
-            
+            label_format = the_Program.get_fuction_declaraction_name() + ".WHILE." + str(the_Program.get_statement_counter("while"))
+            emit(f"label {label_format}_BEGIN")
+            # A while (true) loop has nothing to test, it is only left through a return
+            if constant_value(node.condition) != TRUE:
+                emit_tree(node.condition, the_Program, emit)
+                emit("not")
+                emit(f"if-goto {label_format}_END")
+            emit_statements(node.statements, the_Program, emit)
+            emit(f"goto {label_format}_BEGIN")
+            emit(f"label {label_format}_END")
 
         case "ifStatement":
             "'if' '(' expression ')' '{' statements '}' ('else' '{' statements '}')?"
             label_format = the_Program.get_fuction_declaraction_name() + ".IF." + str(the_Program.get_statement_counter('if'))
-            
+
             #No else:
                 #If the expression is not true, continue then jump to end
-            
+
             #With else:
                 #If the expression is not true, jump to the second statements
                 #Else, execute the first statements then jump to the end
-                
-            vm_instructions = []
-            if len(node.children) > 7:
-                vm_instructions += compile_tree(node.children[2], the_Program) + ["not", f"if-goto {label_format}_ELSE"] + compile_tree(node.children[5], the_Program) + [f"goto {label_format}_END", f"label {label_format}_ELSE"] + compile_tree(node.children[9], the_Program) + [f"label {label_format}_END"]
+
+            emit_tree(node.condition, the_Program, emit)
+            emit("not")
+            if node.else_statements is not None:
+                emit(f"if-goto {label_format}_ELSE")
+                emit_statements(node.statements, the_Program, emit)
+                emit(f"goto {label_format}_END")
+                emit(f"label {label_format}_ELSE")
+                emit_statements(node.else_statements, the_Program, emit)
             else:
-                vm_instructions += compile_tree(node.children[2], the_Program) + ["not", f"if-goto {label_format}_END"] + compile_tree(node.children[5], the_Program) + [f"label {label_format}_END"]
-            return vm_instructions
+                emit(f"if-goto {label_format}_END")
+                emit_statements(node.statements, the_Program, emit)
+            emit(f"label {label_format}_END")
 
         case "letStatement":
             "letStatement: 'let' varName ('[' expression ']')? '=' expression ';'"
-            var_name = node.children[1].value
-            if len(node.children) > 5:  
-                return compile_tree(node.children[3], the_Program) + the_Program.handle_var_name(var_name, push=True) + ["add", "pop pointer 1"] + compile_tree(node.children[-2], the_Program) + ["pop that 0"]
-            return compile_tree(node.children[-2], the_Program) + the_Program.handle_var_name(var_name, push=False)
+            var_name = node.name
+            if node.index is not None:
+                # Reading an array while evaluating the value would move THAT away from the element. A call does not, it restores THAT
+                if not has_array_access(node.value):
+                    offset = emit_that_pointer(var_name, node.index, the_Program, emit)
+                    emit_tree(node.value, the_Program, emit)
+                    emit(f"pop that {offset}")
+                elif is_unchanged_by_calls(node.index, the_Program) and is_unchanged_by_calls(VarName(var_name), the_Program):
+                    # The value cannot change the element it goes to, so it can be computed first
+                    emit_tree(node.value, the_Program, emit)
+                    emit(f"pop that {emit_that_pointer(var_name, node.index, the_Program, emit)}")
+                else:
+                    emit_tree(node.index, the_Program, emit)
+                    emit(the_Program.handle_var_name(var_name, push=True)[0])
+                    emit("add")
+                    emit_tree(node.value, the_Program, emit)
+                    emit("pop temp 0")
+                    emit("pop pointer 1")
+                    emit("push temp 0")
+                    emit("pop that 0")
+            else:
+                emit_tree(node.value, the_Program, emit)
+                emit(the_Program.handle_var_name(var_name, push=False)[0])
 
         case "doStatement":
             "doStatement: 'do' subroutineCall ';'"
-            return compile_subroutine_call(node.children[1:-1]) + ["pop temp 0"]
+            emit_subroutine_call(node.call, the_Program, emit)
+            emit("pop temp 0")
 
         case "returnStatement":
             "returnStatement: 'return' expression? ';'"
-            if len(node.children) == 3:
-                return compile_tree(node.children[1], the_Program) + ["return"]
+            if node.value is not None:
+                emit_tree(node.value, the_Program, emit)
             else:
-                return ["push constant 0", "return"]
+                emit("push constant 0")
+            emit("return")
 
-        case "expression":
+        case "binaryExpr":
             "term (op term)*"
-            vm_instructions = compile_tree(node.children[0], the_Program)
-            operators = {"+": "add", "-": "sub", "*": "call Math.multiply.2 2", "/": "call Math.divide.2 2",
-                        "&": "and", "|": "or", "<": "lt", ">": "gt", "=": "eq"}
-            for i in range(1, len(node.children), 2):
-                vm_instructions += compile_tree(node.children[i + 1], the_Program) + [operators[node.children[i].value]]
-            return vm_instructions
-
-        case "term":
-            """
-            term: integerConstant | stringConstant | keywordConstant | varName |
-                varName '[' expression ']' | subroutineCall |
-                '(' expression ')' | unaryOp term
-            """
-            first_child = node.children[0]
-            
-            if first_child.type == "integerConstant":
-                return [f"push constant {first_child.value}"]
-            
-            if first_child.type == "stringConstant":
-                return (
-                    [f"push constant {len(first_child.value)}", "call String.new.1 1"] + 
-                    [f"push constant {ord(c)}\ncall String.appendChar 2" for c in first_child.value]
-                )
-            
-            if first_child.type == "keyword":
-                # Map the keyword constants to assembly instructions
-                return {
-                    "true": ["push constant 1", "neg"],
-                    "false": ["push constant 0"],
-                    "null": ["push constant 0"],
-                    "this": ["push pointer 0"]
-                }.get(first_child.value, [])
-            
-            if first_child.type == "identifier" and len(node.children) > 1 and node.children[1].value == "[":
-                # Handling array indexing (e.g., varName[expression])
-                return (
-                    compile_tree(node.children[2], the_Program) + 
-                    the_Program.handle_var_name(first_child.value, True) +
-                    ["add", "pop pointer 1", "push that 0"]
-                )
-
-            
-            if first_child.type == "identifier" and len(node.children) > 1:
-                # Handling subroutine calls (e.g., varName(arg1, arg2))
-                return compile_subroutine_call(node.children)
-            
-            if first_child.type == "identifier":
-                # Handling varName
-                return the_Program.handle_var_name(first_child.value, True)
-            
-            if first_child.value == "(":
-                # Handling parentheses expression (e.g., (expression))
-                return compile_tree(node.children[1], the_Program)
-            
-            if first_child.type == "symbol" and first_child.value in "-~":
-                # Handling unary operators (e.g., -term or ~term)
-                #- is arithmetic negation;
-                #~ is  boolean negation
-                return compile_tree(node.children[1], the_Program) + [{"-": "neg", "~": "not"}[first_child.value]]
-            
-            return []
-
-
-        case "expressionList":
-            "(expression (',' expression)* )?"
-            return [instr for i in range(0, len(node.children), 2) for instr in compile_tree(node.children[i], the_Program)]
+            if node.op == "*" and (multiplication := constant_factor(node)):
+                factor, operand = multiplication
+                emit_multiply_by_constant(operand, factor, the_Program, emit)
+                return
+            # A chain like a + b - c is a left-leaning spine. Walking it with a loop keeps long chains off the Python stack
+            operations = []
+            while node.type == "binaryExpr" and not (node.op == "*" and constant_factor(node)):
+                operations.append(node)
+                node = node.left
+            emit_tree(node, the_Program, emit)
+            for operation in reversed(operations):
+                emit_tree(operation.right, the_Program, emit)
+                emit(OPERATORS[operation.op])
 
-        case _:
-            return []
+        #The rest are terms:
+        #integerConstant | stringConstant | keywordConstant | varName | varName '[' expression ']' | subroutineCall | '(' expression ')' | unaryOp term
+
+        case "integerConstant":
+            # Constant folding can produce negative values, which push constant cannot take directly
+            if node.value >= 0:
+                emit(f"push constant {node.value}")
+            elif node.value == -0x8000:
+                emit("push constant 32767")
+                emit("not")
+            else:
+                emit(f"push constant {-node.value}")
+                emit("neg")
+
+        case "stringConstant":
+            # Every distinct string of a class is built once, the first time it is evaluated, and then cached in a static variable.
+            # Later evaluations only push the cached String, so they neither rebuild it nor allocate. Past the size of the pool, it is built every time
+            slot = the_Program.get_string_slot(node.value) if POOL_STRINGS else None
+            if slot is not None:
+                label_format = the_Program.get_fuction_declaraction_name() + ".STRING." + str(the_Program.get_statement_counter("string"))
+                emit(f"push static {slot}")
+                emit(f"if-goto {label_format}_BUILT")
+            emit(f"push constant {len(node.value)}")
+            emit("call String.new.1 1")
+            for c in node.value:
+                emit(f"push constant {ord(c)}")
+                emit("call String.appendChar.2 2")
+            if slot is not None:
+                emit(f"pop static {slot}")
+                emit(f"label {label_format}_BUILT")
+                emit(f"push static {slot}")
+
+        case "keywordConstant":
+            # Map the keyword constants to assembly instructions
+            for instruction in KEYWORD_CONSTANTS.get(node.value, ()):
+                emit(instruction)
+
+        case "arrayAccess":
+            # Handling array indexing (e.g., varName[expression])
+            emit(f"push that {emit_that_pointer(node.name, node.index, the_Program, emit)}")
+
+        case "subroutineCall":
+            # Handling subroutine calls (e.g., varName(arg1, arg2))
+            emit_subroutine_call(node, the_Program, emit)
+
+        case "varName":
+            emit(the_Program.handle_var_name(node.name, True)[0])
 
-def create_vm_file(filename):
-    # Step 1: Process the file to get the list of tokens
-    tokens = process_file(filename)
+        case "parenExpr":
+            # Handling parentheses expression (e.g., (expression))
+            emit_tree(node.expression, the_Program, emit)
 
-    # Step 2: Parse the list of tokens to generate the node tree
+        case "unaryExpr":
+            # Handling unary operators (e.g., -term or ~term)
+            #- is arithmetic negation;
+            #~ is  boolean negation
+            emit_tree(node.operand, the_Program, emit)
+            emit(UNARY_OPERATORS[node.op])
+
+
+def compile_tree(node, the_Program: A_Program_State) -> list:
+    """
+    Returns the VM instructions of a node as a list. Use emit_tree to send them somewhere else without building the list.
+    """
+    vm_instructions = []
+    emit_tree(node, the_Program, vm_instructions.append)
+    return vm_instructions
+
+# Any change to the compiler's own source invalidates every cached .vm file
+def compute_compiler_version():
+    digest = hashlib.sha256()
+    compiler_directory = os.path.dirname(os.path.abspath(__file__))
+    for module in ("better_compiler.py", "parser.py", "Program_State.py", "AST_Optimizer.py"):
+        with open(os.path.join(compiler_directory, module), "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+COMPILER_VERSION = compute_compiler_version()
+
+
+def simplify_class(class_node):
+    # Step 3: Simplify the node tree, see AST_Optimizer
+    return fold_class(class_node) if FOLD_CONSTANTS else class_node
+
+
+def compile_class(class_node):
+    # Step 3: Simplify the node tree, then convert it to a list of VM instructions
+    return compile_tree(simplify_class(class_node), A_Program_State(""))
+
+
+def compile_class_with_lines(class_node):
+    """
+    Same as compile_class, and also returns the Jack line of every VM instruction, for the source map of the .vm file.
+    """
+    the_Program = A_Program_State("")
+    vm_instructions = []
+    jack_lines = []
+
+    def emit(instruction):
+        vm_instructions.append(instruction)
+        jack_lines.append(the_Program.line)
+
+    emit_tree(simplify_class(class_node), the_Program, emit)
+    return vm_instructions, jack_lines
+
+
+def write_vm_file(vm_filename, vm_code):
+    with open(vm_filename, 'w') as f:
+        f.write(vm_code)
+    print(f"VM file saved as {vm_filename}")
+
+
+def create_vm_file(filename, source_map=False):
+    # Step 1: Process the file to get the tokens
+    tokens = tokenize_file(filename)
+
+    # Step 2: Parse the tokens to generate the node tree
     node_tree = parse_list_of_token(tokens)
 
-    # Step 3: Convert the node tree to an XML string
-    list_of_vm_instructions = compile_tree(node_tree, A_Program_State(""))
+    # Step 3 and 4: Stream the VM instructions straight into the .vm file, and the Jack line of each into its source map
+    vm_filename = filename.rsplit('.', 1)[0] + '.vm'  # Replace .jack with .vm
+    the_Program = A_Program_State("")
+    jack_lines = []
+
+    def emit(instruction):
+        f.write(instruction + "\n")
+        if source_map:
+            jack_lines.append(the_Program.line)
 
-    # Step 4: Save the XML string to a file
-    vm_filename = filename.rsplit('.', 1)[0] + '.vm'  # Replace .jack with .xml
     with open(vm_filename, 'w') as f:
-        for instruction in list_of_vm_instructions:
-            f.write(instruction + "\n")
+        emit_tree(simplify_class(node_tree), the_Program, emit)
     print(f"VM file saved as {vm_filename}")
+    if source_map:
+        write_map(vm_filename, os.path.basename(filename), jack_lines)
+
+
+def compile_source(source):
+    """
+    Parses and compiles the source of one class. Runs in a worker process in parallel mode, so it only takes and returns plain values:
+    ("ok", class name, signature, VM code, called classes, Jack line of every VM instruction) or ("error", message).
+    """
+    try:
+        class_node = parse_list_of_token(tokenize(source))
+        vm_instructions, jack_lines = compile_class_with_lines(class_node)
+        vm_code = "".join(instruction + "\n" for instruction in vm_instructions)
+        return "ok", class_node.name, class_signature(class_node), vm_code, sorted(called_classes(vm_instructions)), jack_lines
+    except Exception as e:
+        # The traceback has to be formatted here, it does not survive the trip back from a worker
+        return "error", f"{e}, {traceback.format_exc()}"
+
+
+def compile_sources(sources, workers=1):
+    """
+    Compiles a list of sources and returns the results of compile_source in the same order, whatever the order the workers finish in.
+    """
+    if workers <= 1 or len(sources) <= 1:
+        return [compile_source(source) for source in sources]
+    workers = min(workers, len(sources))
+    # Several files per task keeps the cost of sending work to the processes low when there are many small classes
+    chunksize = max(1, len(sources) // (workers * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(compile_source, sources, chunksize=chunksize))
+
+
+def process_directory(directory, use_cache=True, workers=1, source_maps=False):
+    """
+    Compiles every .jack file in a directory. With the cache, a file is only recompiled when its source changed,
+    the compiler changed, or a class it calls changed signature. Everything else reuses the VM code from the last run.
+    With workers > 1 the files are compiled by a pool of processes. The output is the same as with one worker, in the same order.
+    With source_maps, every .vm file gets its source map, see Source_Map.
+    Returns a dictionary from the name of every file that failed to its error, which are also reported together at the end.
+    """
+    filenames = sorted(f for f in os.listdir(directory) if f.endswith(".jack"))
+    cache = A_Compile_Cache(directory, COMPILER_VERSION if use_cache else "")
+    cache.keep_only(filenames)
+    errors = {}
+
+    # Step 1: Hash every source and keep the ones that changed
+    sources = {}
+    source_hashes = {}
+    signatures = {}
+    for filename in filenames:
+        try:
+            with open(os.path.join(directory, filename), 'r') as f:
+                sources[filename] = f.read()
+        except OSError as e:
+            cache.forget(filename)
+            errors[filename] = str(e)
+            continue
+        source_hashes[filename] = hash_text(sources[filename])
+        entry = cache.lookup(filename, source_hashes[filename]) if use_cache else None
+        if entry:
+            signatures[entry["class_name"]] = entry["signature"]
+        else:
+            cache.forget(filename)
+    changed = [filename for filename in sources if filename not in cache.entries]
+
+    # Step 2: Compile the changed files. Compiling a class does not need the other classes, so they are all independent
+    results = dict(zip(changed, compile_sources([sources[filename] for filename in changed], workers)))
+    for result in results.values():
+        if result[0] == "ok":
+            signatures[result[1]] = result[2]
+
+    # Step 3: An unchanged file still has to be recompiled if a class it calls changed signature
+    outdated = [filename for filename, entry in cache.entries.items() if not cache.is_up_to_date(entry, signatures)]
+    results.update(zip(outdated, compile_sources([sources[filename] for filename in outdated], workers)))
+
+    # Step 4: Store and write what was compiled, in the order of the files, and remember what each file calls
+    for filename in sorted(results):
+        result = results[filename]
+        if result[0] == "error":
+            cache.forget(filename)
+            errors[filename] = result[1]
+            continue
+        _, class_name, signature, vm_code, calls, jack_lines = result
+        dependencies = {
+            called: signatures[called]
+            for called in calls
+            if called in signatures and called != class_name
+        }
+        cache.store(filename, source_hashes[filename], class_name, signature, dependencies, vm_code, jack_lines)
+        vm_filename = os.path.join(directory, filename.rsplit('.', 1)[0] + '.vm')
+        write_vm_file(vm_filename, vm_code)
+        if source_maps:
+            write_map(vm_filename, filename, jack_lines)
+        print(f"Successfully created VM file from {filename}")
+
+    # Step 5: Files that were not compiled keep their .vm file, which is rewritten only if it is missing or was edited
+    for filename, entry in sorted(cache.entries.items()):
+        if filename in results:
+            continue
+        vm_filename = os.path.join(directory, filename.rsplit('.', 1)[0] + '.vm')
+        try:
+            with open(vm_filename, 'r') as f:
+                vm_is_intact = hash_text(f.read()) == entry["vm_hash"]
+        except OSError:
+            vm_is_intact = False
+        if not vm_is_intact:
+            write_vm_file(vm_filename, entry["vm"])
+        if source_maps:
+            write_map(vm_filename, filename, entry["jack_lines"])
+        print(f"{filename} is up to date")
+
+    if use_cache:
+        cache.save()
+
+    for filename in sorted(errors):
+        print(f"Error processing {filename}: {errors[filename]}")
+    if errors:
+        print(f"{len(errors)} of {len(filenames)} files failed to compile: {', '.join(sorted(errors))}")
+    return errors
+
 
-def process_directory(directory):
-    # Process each .jack file in the directory
-    for filename in os.listdir(directory):
-        if filename.endswith(".jack"):
-            file_path = os.path.join(directory, filename)
-            try:
-                create_vm_file(file_path)
-                print(f"Successfully created VM file from {filename}")
-            except Exception as e:
-                print(f"Error processing {filename}: {e}, {traceback.format_exc()}")
-                
-                
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 compiler.py <filename or directory>")
+    argument_parser = argparse.ArgumentParser(description="Compiles a .jack file, or every .jack file in a directory, into .vm files")
+    argument_parser.add_argument("path", help="a .jack file or a directory containing .jack files")
+    argument_parser.add_argument("--no-cache", action="store_true", help="recompile every file of a directory, ignoring and not updating the cache")
+    argument_parser.add_argument("--source-map", action="store_true", help="write the Jack line of every VM instruction to a .vm.map file next to each .vm file")
+    argument_parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes compiling the files of a directory in parallel, 0 for one per core (default: 1)")
+    arguments = argument_parser.parse_args()
+    input_path = arguments.path
+
+    if os.path.isdir(input_path):
+        # If input is a directory, process all .jack files in the directory
+        workers = arguments.jobs or os.cpu_count() or 1
+        if process_directory(input_path, use_cache=not arguments.no_cache, workers=workers, source_maps=arguments.source_map):
+            sys.exit(1)
+    elif os.path.isfile(input_path) and input_path.endswith(".jack"):
+        # If input is a single file, process that specific file
+        try:
+            create_vm_file(input_path, arguments.source_map)
+            print(f"Successfully created VM file from {input_path}")
+        except FileNotFoundError:
+            print(f"Error: File '{input_path}' not found.")
+        except Exception as e:
+            print(f"An unexpected error occurred while processing {input_path}: {e}, {traceback.format_exc()}")
     else:
-        input_path = sys.argv[1]
-        
-        if os.path.isdir(input_path):
-            # If input is a directory, process all .jack files in the directory
-            process_directory(input_path)
-        elif os.path.isfile(input_path) and input_path.endswith(".jack"):
-            # If input is a single file, process that specific file
-            try:
-                create_vm_file(input_path)
-                print(f"Successfully created VM file from {input_path}")
-            except FileNotFoundError:
-                print(f"Error: File '{input_path}' not found.")
-            except Exception as e:
-                print(f"An unexpected error occurred while processing {input_path}: {e}, {traceback.format_exc()}")
-        else:
-            print("Error: Please provide a valid .jack file or a directory containing .jack files.")
+        print("Error: Please provide a valid .jack file or a directory containing .jack files.")
@@ -1,239 +1,399 @@
+import io
 import re
 import sys
+from collections import namedtuple
 
-keywords = {"class", "function", "method", "static", "field", "var", "int", "char", "boolean", "void", "true", "false", "null", "this", "let", "do", "if", "else", "while", "return"}
+keywords = {"class", "constructor", "function", "method", "static", "field", "var", "int", "char", "boolean", "void", "true", "false", "null", "this", "let", "do", "if", "else", "while", "return"}
 
 symbols = {'(', ')', '{', '}', ';', '[', ']', ',', '.', '+', '-', '<', '>', '=', '~', '|', "&", '*', '/'}
 
 
-# Turns a .jack into a list of tokens
-def process_file(filename):
+Token = namedtuple("Token", ["kind", "text", "line", "column"])
+
+# One alternation covers everything the tokenizer can meet, so the source is scanned exactly once.
+# Whitespace, comments and string constants may span lines, so those are the only matches that need their newlines counted
+token_pattern = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<stringConstant>"[^"]*")
+  | (?P<word>\w+)
+  | (?P<symbol>[^\s\w])
+""", re.VERBOSE | re.DOTALL)
+
+
+def tokenize(source):
     """
-    Reads a file character by character, removes comments manually, and returns a list of tokens.
+    Lazily yields a Token(kind, text, line, column) for every token of a Jack source string, skipping whitespace and comments.
+    kind is one of keyword, symbol, integerConstant, stringConstant or identifier. Lines and columns start at 1.
     """
-    # Step 1: Read the file
-    with open(filename, 'r') as file:
-        chars = list(file.read())
-
-    # Step 2: Remove comments manually
-    def remove_comments(chars):
-        """
-        Removes single-line, block, and JavaDoc comments from a list of characters manually.
-        """
-        in_single_line_comment = False
-        in_block_comment = False
-        result = []
-        i = 0
-
-        while i < len(chars):
-            if in_single_line_comment:
-                # End single-line comment at newline
-                if chars[i] == '\n':
-                    in_single_line_comment = False
-                    result.append(chars[i])  # Keep the newline
-            elif in_block_comment:
-                # End block comment at */
-                if chars[i] == '*' and i + 1 < len(chars) and chars[i + 1] == '/':
-                    in_block_comment = False
-                    i += 1  # Skip '/'
+    # Token(...) goes through the namedtuple's Python level __new__, tuple.__new__ builds the same object at half the cost
+    make_token = tuple.__new__
+    intern = sys.intern
+    line = 1
+    line_start = 0
+    for match in token_pattern.finditer(source):
+        kind = match.lastgroup
+        text = match.group()
+
+        if kind == "word":
+            column = match.start() - line_start + 1
+            if text in keywords:
+                yield make_token(Token, ("keyword", intern(text), line, column))
+            elif text.isdigit():
+                yield make_token(Token, ("integerConstant", text, line, column))
             else:
-                # Start of a single-line comment
-                if chars[i] == '/' and i + 1 < len(chars) and chars[i + 1] == '/':
-                    in_single_line_comment = True
-                    i += 1  # Skip the second '/'
-                # Start of a block comment
-                elif chars[i] == '/' and i + 1 < len(chars) and chars[i + 1] == '*':
-                    in_block_comment = True
-                    i += 1  # Skip the '*'
-                else:
-                    # Regular code
-                    result.append(chars[i])
-            i += 1
+                yield make_token(Token, ("identifier", intern(text), line, column))
 
-        return ''.join(result)
+        elif kind == "symbol":
+            yield make_token(Token, ("symbol", text, line, match.start() - line_start + 1))
 
-    cleaned_code = remove_comments(chars)
+        else:
+            start = match.start()
+            if kind == "stringConstant":
+                yield make_token(Token, ("stringConstant", text, line, start - line_start + 1))
+            # space, comment or string: keep the line count in step with the source
+            newlines = text.count("\n")
+            if newlines:
+                line += newlines
+                line_start = start + text.rindex("\n") + 1
 
-    # Step 3: Tokenize the cleaned code
-    # Match words, string constants, or symbols but ignore whitespace
-    # Match strings in double quotes and treat them as a single token
-    tokens = re.findall(r'"[^"]*"|\w+|[^\s\w]', cleaned_code)
 
-    return tokens
+def tokenize_file(filename):
+    """
+    Reads a .jack file once and lazily yields its tokens.
+    """
+    with open(filename, 'r') as file:
+        source = file.read()
+    yield from tokenize(source)
+
+
+# Turns a .jack into a list of tokens
+def process_file(filename):
+    """
+    Returns the text of every token in a .jack file, with comments removed. String constants keep their quotes.
+    """
+    return [token.text for token in tokenize_file(filename)]
 
 
 # Turns a list of tokens into an AST
 # There is no opertor priority, except the fact that expressions in parenthesis happen first
 # Code is just statements and expressions
 
-class Node:
-    def __init__(self, value="", type=""):
+# Each construct has its own slotted node class that only keeps what the compiler needs: punctuation is implied by the node's class.
+# `type` is a class attribute naming the construct, which is what compile_tree matches on.
+# Statements remember the line they start on. A list of statements is a plain Python list
+
+class AST_Node:
+    __slots__ = ()
+
+    def __repr__(self):
         """
-        Initialize a node with a value and an empty list of children.
-        If the type is not provided, it will be determined based on the value.
+        Return the tree in the nested Node(...) format of the old parse tree, punctuation included, for debugging.
         """
+        return dump_tree(self)
+
+    __str__ = __repr__
+
+
+class ClassDec(AST_Node):
+    __slots__ = ("name", "class_var_decs", "subroutine_decs")
+    type = "class"
+
+    def __init__(self, name, class_var_decs, subroutine_decs):
+        self.name = name
+        self.class_var_decs = class_var_decs
+        self.subroutine_decs = subroutine_decs
+
+
+class ClassVarDec(AST_Node):
+    __slots__ = ("kind", "var_type", "names")
+    type = "classVarDec"
+
+    def __init__(self, kind, var_type, names):
+        self.kind = kind  # 'static' or 'field'
+        self.var_type = var_type
+        self.names = names
+
+
+class SubroutineDec(AST_Node):
+    __slots__ = ("kind", "return_type", "name", "parameters", "var_decs", "statements", "line")
+    type = "subroutineDec"
+
+    def __init__(self, kind, return_type, name, parameters, var_decs, statements, line):
+        self.kind = kind  # 'constructor', 'function' or 'method'
+        self.return_type = return_type
+        self.name = name
+        self.parameters = parameters  # list of (type, varName)
+        self.var_decs = var_decs
+        self.statements = statements
+        self.line = line
+
+
+class VarDec(AST_Node):
+    __slots__ = ("var_type", "names")
+    type = "varDec"
+
+    def __init__(self, var_type, names):
+        self.var_type = var_type
+        self.names = names
+
+
+class LetStatement(AST_Node):
+    __slots__ = ("name", "index", "value", "line")
+    type = "letStatement"
+
+    def __init__(self, name, index, value, line):
+        self.name = name
+        self.index = index  # None unless this is `let name[index] = value`
         self.value = value
-        self.type = type
-        self.children = []
-
-        # Automatically determine the type if not provided
-        if not type:
-            if value.startswith('"') and value.endswith('"'):
-                # Handle string constants (strip the quotes)
-                self.type = "stringConstant"
-                self.value = value[1:-1]
-            elif value.isdigit():
-                # Handle integer constants
-                self.type = "integerConstant"
-                self.value = int(value)  # Store as an integer
-            elif value in keywords:
-                # Handle predefined keywords
-                self.type = "keyword"
-            elif value in symbols:
-                self.type = "symbol"
-            else:
-                self.type = "identifier"
+        self.line = line
+
+
+class IfStatement(AST_Node):
+    __slots__ = ("condition", "statements", "else_statements", "line")
+    type = "ifStatement"
+
+    def __init__(self, condition, statements, else_statements, line):
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements  # None when there is no else
+        self.line = line
+
+
+class WhileStatement(AST_Node):
+    __slots__ = ("condition", "statements", "line")
+    type = "whileStatement"
+
+    def __init__(self, condition, statements, line):
+        self.condition = condition
+        self.statements = statements
+        self.line = line
+
+
+class DoStatement(AST_Node):
+    __slots__ = ("call", "line")
+    type = "doStatement"
+
+    def __init__(self, call, line):
+        self.call = call
+        self.line = line
+
+
+class ReturnStatement(AST_Node):
+    __slots__ = ("value", "line")
+    type = "returnStatement"
+
+    def __init__(self, value, line):
+        self.value = value  # None for a bare `return;`
+        self.line = line
+
+
+# Expressions. Jack evaluates left to right, so `a + b * c` is BinaryExpr('*', BinaryExpr('+', a, b), c)
+
+class BinaryExpr(AST_Node):
+    __slots__ = ("op", "left", "right")
+    type = "binaryExpr"
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class UnaryExpr(AST_Node):
+    __slots__ = ("op", "operand")
+    type = "unaryExpr"
+
+    def __init__(self, op, operand):
+        self.op = op  # '-' or '~'
+        self.operand = operand
+
+
+class ParenExpr(AST_Node):
+    __slots__ = ("expression",)
+    type = "parenExpr"
+
+    def __init__(self, expression):
+        self.expression = expression
+
+
+class IntegerConstant(AST_Node):
+    __slots__ = ("value",)
+    type = "integerConstant"
+
+    def __init__(self, value):
+        self.value = value
+
+
+class StringConstant(AST_Node):
+    __slots__ = ("value",)
+    type = "stringConstant"
+
+    def __init__(self, value):
+        self.value = value  # without the quotes
+
+
+class KeywordConstant(AST_Node):
+    __slots__ = ("value",)
+    type = "keywordConstant"
+
+    def __init__(self, value):
+        self.value = value  # 'true', 'false', 'null' or 'this'
+
+
+class VarName(AST_Node):
+    __slots__ = ("name",)
+    type = "varName"
+
+    def __init__(self, name):
+        self.name = name
+
 
-    def add_child(self, child):
+class ArrayAccess(AST_Node):
+    __slots__ = ("name", "index")
+    type = "arrayAccess"
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class SubroutineCall(AST_Node):
+    __slots__ = ("receiver", "name", "arguments")
+    type = "subroutineCall"
+
+    def __init__(self, receiver, name, arguments):
+        self.receiver = receiver  # className or varName before the '.', None for `name(...)`
+        self.name = name
+        self.arguments = arguments
+
+
+class TokenCursor:
+    """
+    A read position in a list of tokens, with lookahead. Tokens are read by index instead of being popped off the front of the list.
+    """
+    __slots__ = ("tokens", "texts", "position")
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+        self.texts = [token.text for token in self.tokens]
+        self.position = 0
+
+    def peek(self, offset=0):
         """
-        Add a child node to this node.
+        Returns the text of the token offset places ahead, or "" past the end of the file.
         """
-        self.children.append(child)
+        index = self.position + offset
+        return self.texts[index] if index < len(self.texts) else ""
 
-    def add_children(self, the_children):
+    def take(self):
         """
-        Add multiple child nodes to this node.
+        Consumes the current token and returns its text.
         """
-        self.children.extend(the_children)
+        if self.position >= len(self.texts):
+            last_line = self.tokens[-1].line if self.tokens else 1
+            raise ValueError(f"Unexpected end of file after line {last_line}")
+        self.position += 1
+        return self.texts[self.position - 1]
 
-    def __repr__(self, level=0):
+    def expect(self, text):
         """
-        Return a string representation of the node for debugging, including children.
-        It will print the node in a nested format to show its structure.
+        Consumes the current token, which has to be the given keyword or symbol.
         """
-        indent = "  " * level  # Indentation based on the depth of the node
-        result = ""
-        if self.value or self.value == 0:
-            result = f"{indent}Node(value={repr(self.value)}, type={self.type})\n"
-        else:
-            result = f"{indent}Node(type={self.type})\n"
-        if self.children:
-            for child in self.children:
-                result += child.__repr__(level + 1)
-
-        return result
+        if self.peek() != text:
+            found = self.peek() or "end of file"
+            raise ValueError(f"Expected '{text}' but found '{found}' at line {self.line()}")
+        self.position += 1
 
-    def __str__(self, level=0):
+    def line(self):
         """
-        Return a string representation of the node for debugging, including children.
-        It will print the node in a nested format to show its structure.
+        Returns the line of the current token.
         """
-        indent = "  " * level  # Indentation based on the depth of the node
-        result = ""
-        if self.value or self.value == 0:
-            result = f"{indent}Node(value={repr(self.value)}, type={self.type})\n"
-        else:
-            result = f"{indent}Node(type={self.type})\n"
-        if self.children:
-            for child in self.children:
-                result += child.__repr__(level + 1)
-
-        return result
-    
-    
+        if self.position < len(self.tokens):
+            return self.tokens[self.position].line
+        return self.tokens[-1].line if self.tokens else 1
+
+
 def parse_list_of_token(tokens):
-    # Each subfunction treats tokens like a global, deleting from the start when done with each token
+    # Each subfunction shares one cursor over the tokens. take() consumes the current token, peek(k) looks k tokens ahead without consuming
+    # Nothing is ever removed from the token list, so every step is O(1) and parsing is linear in the size of the file
     # Sometimes we need to look ahead to the next token, since Jack is not a pure LL(0) language
     # There are only five 'things' in Jack - five types of tokens: keywords, symbols, integerConstants, StringConstants, and identifiers (anything else not starting with a digit)
-    # Each token is associated with a type. We can say these nodes 'contain' actual value, they refer to actual tokens and do not point to other nodes
-    # However, we need to add structure
     # Structures are:
-    # class, classVarDec, subroutineDec, parameterList, subroutineBody, varDec
-    # statements, whileStatement, ifStatement, returnStatement, letStatement, doStatement
-    # expression, term, and expressionList
-    # Each structure (called terminal elements in the book) creates a node of that type. Instead of holding a value, it holds a list of nodes.
-
-    head = tokens[0] if tokens else None
+    # class, classVarDec, subroutineDec, varDec
+    # whileStatement, ifStatement, returnStatement, letStatement, doStatement
+    # and the expression nodes: binary and unary operations, constants, variables, array accesses and subroutine calls
+    # Each structure creates a node of its own class. Punctuation is checked by position and then dropped, it is not stored in the tree
+
+    cursor = TokenCursor(tokens)
+    peek = cursor.peek
+    take = cursor.take
+    expect = cursor.expect
+    current_line = cursor.line
+    head = peek()
 
     # Helper functions
     def parse_class():
-        # Creates a class node with a list of children
-        class_node = Node("", 'class')
-        #'class', className, '{'
-        class_node.add_children([Node(tokens.pop(0), "keyword"),Node(tokens.pop(0), "identifier"), Node(tokens.pop(0), "symbol")])
-        while tokens[0] in {"static", "field"}:
-            class_node.add_child(parse_classVarDec())
-
-        while tokens[0] in {"constructor", "function", "method"}:
-            class_node.add_child(parse_subroutineDec())
-
-        class_node.add_child(Node(tokens.pop(0), "symbol"))  # '}'
-        return class_node
+        expect('class')
+        name = take()
+        expect('{')
+        class_var_decs = []
+        while peek() in {"static", "field"}:
+            class_var_decs.append(parse_classVarDec())
+
+        subroutine_decs = []
+        while peek() in {"constructor", "function", "method"}:
+            subroutine_decs.append(parse_subroutineDec())
+
+        expect('}')
+        return ClassDec(name, class_var_decs, subroutine_decs)
+
+    def parse_var_names():
+        # varName (',' varName)* ';'
+        names = [take()]
+        while peek() == ',':
+            take()
+            names.append(take())
+        expect(';')
+        return names
 
     def parse_classVarDec():
-        classVar_node = Node("", 'classVarDec')
-        children = [Node(tokens.pop(0), "keyword"), Node(tokens.pop(0))]  # 'static' or 'field', type
-
-        while True:
-            children.append(Node(tokens.pop(0), "identifier"))  # varName
-            if tokens[0] != ',':
-                break
-            children.append(Node(tokens.pop(0), "symbol"))  # ','
-
-        children.append(Node(tokens.pop(0), "symbol"))  # ';'
-        classVar_node.add_children(children)
-        return classVar_node
+        kind = take()  # 'static' or 'field'
+        var_type = take()
+        return ClassVarDec(kind, var_type, parse_var_names())
 
     def parse_subroutineDec():
-        subroutineDec_node = Node("", 'subroutineDec')
-        subroutineDec_node.add_children([
-            Node(tokens.pop(0), "keyword"),  # 'constructor', 'function', or 'method'
-            Node(tokens.pop(0)),  # 'void' or type
-            Node(tokens.pop(0), "identifier"),  # subroutineName
-            Node(tokens.pop(0), "symbol")  # '('
-        ])
-        subroutineDec_node.add_child(parse_parameterList())
-        subroutineDec_node.add_children([
-            Node(tokens.pop(0), "symbol"),  # ')'
-            parse_subroutineBody()
-        ])
-        return subroutineDec_node
+        line = current_line()
+        kind = take()  # 'constructor', 'function', or 'method'
+        return_type = take()  # 'void' or type
+        name = take()
+        expect('(')
+        parameters = parse_parameterList()
+        expect(')')
+        # subroutineBody: '{' varDec* statements '}'
+        expect('{')
+        var_decs = []
+        while peek() == 'var':
+            var_decs.append(parse_varDec())
+        statements = parse_statements()
+        expect('}')
+        return SubroutineDec(kind, return_type, name, parameters, var_decs, statements, line)
 
     def parse_parameterList():
-        parameterList_node = Node("", 'parameterList')
-        while tokens[0] != ')':
+        parameters = []
+        while peek() != ')':
             #type varName
-            parameterList_node.add_children([Node(tokens.pop(0)), Node(tokens.pop(0), "identifier")])
-            if tokens[0] == ',':
-                parameterList_node.add_child(Node(tokens.pop(0), "symbol"))  # ','
-        return parameterList_node
-
-    def parse_subroutineBody():
-        # { varDecs* statements }
-        subroutineBody_node = Node("", 'subroutineBody')
-        subroutineBody_node.add_child(Node(tokens.pop(0), "symbol"))  # '{'
-        while tokens[0] == 'var':
-            subroutineBody_node.add_child(parse_varDec())
-        subroutineBody_node.add_children([parse_statements(), Node(tokens.pop(0), "symbol")])
-        return subroutineBody_node
+            parameters.append((take(), take()))
+            if peek() == ',':
+                take()
+        return parameters
 
     def parse_varDec():
-        varDec_node = Node("", 'varDec')
-        varDec_node.add_child(Node(tokens.pop(0), "keyword"))  # 'var'
-        varDec_node.add_child(Node(tokens.pop(0)))  # type
-
-        while True:
-            varDec_node.add_child(Node(tokens.pop(0), "identifier"))  # varName (identifier)
-            if tokens[0] != ',':
-                break
-            varDec_node.add_child(Node(tokens.pop(0), "symbol"))  # ','
-
-        varDec_node.add_child(Node(tokens.pop(0), "symbol"))  # ';'
-        return varDec_node
+        expect('var')
+        var_type = take()
+        return VarDec(var_type, parse_var_names())
 
     def parse_statements():
-        statements_node = Node("", "statements")
-
         dispatch_table = {
             "let": parse_letStatement,
             "if": parse_ifStatement,
@@ -242,144 +402,124 @@ def parse_list_of_token(tokens):
             "return": parse_returnStatement
         }
 
-        while tokens and tokens[0] in dispatch_table:
-            statements_node.add_child(dispatch_table[tokens.pop(0)]())
+        statements = []
+        while peek() in dispatch_table:
+            statements.append(dispatch_table[peek()]())
+        return statements
 
-        return statements_node
+    def parse_block():
+        # '{' statements '}'
+        expect('{')
+        statements = parse_statements()
+        expect('}')
+        return statements
 
     def parse_letStatement():
-        letStatement_node = Node("", "letStatement")
-        children = [
-            Node(tokens.pop(0), "keyword"),  # 'let'
-            Node(tokens.pop(0), "identifier")  # varName
-        ]
-
-        if tokens[0] == '[':
-            children.extend([
-                Node(tokens.pop(0), "symbol"),  # '['
-                parse_expression(),
-                Node(tokens.pop(0), "symbol")   # ']'
-            ])
-
-        children.extend([
-            Node(tokens.pop(0), "symbol"),  # '='
-            parse_expression(),
-            Node(tokens.pop(0), "symbol")  # ';'
-        ])
-        letStatement_node.add_children(children)
-        return letStatement_node
+        line = current_line()
+        expect('let')
+        name = take()
+        index = None
+        if peek() == '[':
+            take()
+            index = parse_expression()
+            expect(']')
+        expect('=')
+        value = parse_expression()
+        expect(';')
+        return LetStatement(name, index, value, line)
 
     def parse_ifStatement():
-        ifStatement_node = Node("", "ifStatement")
-        children = [
-            Node(tokens.pop(0), "keyword"),  # 'if'
-            Node(tokens.pop(0), "symbol"),  # '('
-            parse_expression(),
-            Node(tokens.pop(0), "symbol"),  # ')'
-            Node(tokens.pop(0), "symbol"),  # '{'
-            parse_statements(),
-            Node(tokens.pop(0), "symbol")   # '}'
-        ]
-
-        if tokens[0] == 'else':
-            children.extend([
-                Node(tokens.pop(0), "keyword"),  # 'else'
-                Node(tokens.pop(0), "symbol"),  # '{'
-                parse_statements(),
-                Node(tokens.pop(0), "symbol")   # '}'
-            ])
-
-        ifStatement_node.add_children(children)
-        return ifStatement_node
+        line = current_line()
+        expect('if')
+        expect('(')
+        condition = parse_expression()
+        expect(')')
+        statements = parse_block()
+        else_statements = None
+        if peek() == 'else':
+            take()
+            else_statements = parse_block()
+        return IfStatement(condition, statements, else_statements, line)
 
     def parse_whileStatement():
-        whileStatement_node = Node("", "whileStatement")
-        whileStatement_node.add_children([
-            Node(tokens.pop(0), "keyword"),  # 'while'
-            Node(tokens.pop(0), "symbol"),  # '('
-            parse_expression(),
-            Node(tokens.pop(0), "symbol"),  # ')'
-            Node(tokens.pop(0), "symbol"),  # '{'
-            parse_statements(),
-            Node(tokens.pop(0), "symbol")  # '}'            
-        ])
-        return whileStatement_node
+        line = current_line()
+        expect('while')
+        expect('(')
+        condition = parse_expression()
+        expect(')')
+        return WhileStatement(condition, parse_block(), line)
 
     def parse_doStatement():
-        doStatement_node = Node("", "doStatement")
-        doStatement_node.add_children(
-            [Node(tokens.pop(0), "keyword")] + parse_subroutine_call() + [Node(tokens.pop(0), "symbol")]
-        )
-        return doStatement_node
+        line = current_line()
+        expect('do')
+        call = parse_subroutine_call()
+        expect(';')
+        return DoStatement(call, line)
 
     def parse_returnStatement():
-        returnStatement_node = Node("", "returnStatement")
-        returnStatement_node.add_child(Node(tokens.pop(0), "keyword"))  # 'return'
-        if tokens[0] != ';':
-            returnStatement_node.add_child(parse_expression())
-        returnStatement_node.add_child(Node(tokens.pop(0), "symbol"))  # ';'
-        return returnStatement_node
+        line = current_line()
+        expect('return')
+        value = None
+        if peek() != ';':
+            value = parse_expression()
+        expect(';')
+        return ReturnStatement(value, line)
 
     def parse_expression():
-        expression_node = Node("", "expression")
-        expression_node.add_child(parse_term())
-
-        while tokens[0] in {'+', '-', '*', '/', '&', '|', '<', '>', '='}:
-            expression_node.add_child(Node(tokens.pop(0), "symbol"))  # op
-            expression_node.add_child(parse_term())
-
-        return expression_node
+        expression = parse_term()
+        while peek() in {'+', '-', '*', '/', '&', '|', '<', '>', '='}:
+            op = take()
+            expression = BinaryExpr(op, expression, parse_term())
+        return expression
 
     def parse_term():
-        term_node = Node("", "term")
-
-        if tokens[0].isdigit():
-            term_node.add_child(Node(tokens.pop(0), "integerConstant"))
-        elif tokens[0].startswith('"'):
-            term_node.add_child(Node(tokens.pop(0)[1:-1], "stringConstant"))
-        elif tokens[0] in {"true", "false", "null", "this"}:
-            term_node.add_child(Node(tokens.pop(0), "keyword"))
-        elif tokens[0] == '(':
+        if peek().isdigit():
+            return IntegerConstant(int(take()))
+        elif peek().startswith('"'):
+            return StringConstant(take()[1:-1])
+        elif peek() in {"true", "false", "null", "this"}:
+            return KeywordConstant(take())
+        elif peek() == '(':
             #( expression )
-            term_node.add_children([Node(tokens.pop(0), "symbol") , parse_expression(), Node(tokens.pop(0), "symbol")])
-        elif tokens[0] in {'-', '~'}:
-            term_node.add_children([Node(tokens.pop(0), "symbol"), parse_term()])
-        elif len(tokens) > 1 and tokens[1] == '[':
+            take()
+            expression = parse_expression()
+            expect(')')
+            return ParenExpr(expression)
+        elif peek() in {'-', '~'}:
+            return UnaryExpr(take(), parse_term())
+        elif peek(1) == '[':
             #varName [ expression ]
-            term_node.add_children([Node(tokens.pop(0), "identifier"), Node(tokens.pop(0), "symbol"), parse_expression(), Node(tokens.pop(0), "symbol")])
-        elif len(tokens) > 1 and tokens[1] in {'.', '('}:
-            term_node.add_children(parse_subroutine_call())
+            name = take()
+            take()
+            index = parse_expression()
+            expect(']')
+            return ArrayAccess(name, index)
+        elif peek(1) in {'.', '('}:
+            return parse_subroutine_call()
         else:
-            term_node.add_child(Node(tokens.pop(0), "identifier"))  # varName
-
-        return term_node
+            return VarName(take())
 
     def parse_expressionList():
-        expressionList_node = Node("", "expressionList")
-        if tokens[0] != ')':
-            expressionList_node.add_child(parse_expression())
-            while tokens[0] == ',':
+        arguments = []
+        if peek() != ')':
+            arguments.append(parse_expression())
+            while peek() == ',':
                 #, expression
-                expressionList_node.add_children([Node(tokens.pop(0), "symbol"), parse_expression()])
-        return expressionList_node
+                take()
+                arguments.append(parse_expression())
+        return arguments
 
     def parse_subroutine_call():
-        subroutine_call_nodes = []
-        subroutine_call_nodes.append(Node(tokens.pop(0), "identifier"))  # subroutineName or className/varName
-
-        if tokens[0] == '.':
-            subroutine_call_nodes.extend([
-                Node(tokens.pop(0), "symbol"),  # '.'
-                Node(tokens.pop(0), "identifier")  # subroutineName  
-            ])
-
-        subroutine_call_nodes.extend([
-            Node(tokens.pop(0), "symbol"),  # '('
-            parse_expressionList(),
-            Node(tokens.pop(0), "symbol")  # ')'  
-        ])
-
-        return subroutine_call_nodes
+        receiver = None
+        name = take()  # subroutineName or className/varName
+        if peek() == '.':
+            take()
+            receiver = name
+            name = take()
+        expect('(')
+        arguments = parse_expressionList()
+        expect(')')
+        return SubroutineCall(receiver, name, arguments)
 
     if head == 'class':
         return parse_class()
@@ -401,54 +541,300 @@ def parse_list_of_token(tokens):
 # create_xml_file('Foo.jack')  # This will generate 'Foo.xml'
 
 def create_xml_file(filename):
-    # Step 1: Process the file to get the list of tokens
-    tokens = process_file(filename)
+    # Step 1: Process the file to get the tokens
+    tokens = tokenize_file(filename)
 
-    # Step 2: Parse the list of tokens to generate the node tree
+    # Step 2: Parse the tokens to generate the node tree
     node_tree = parse_list_of_token(tokens)
 
-    # Step 3: Convert the node tree to an XML string
-    xml_string = convert_to_xml(node_tree)
-
-    # Step 4: Save the XML string to a file
+    # Step 3: Stream the node tree as XML into the file
     xml_filename = filename.rsplit('.', 1)[0] + '.xml'  # Replace .jack with .xml
     with open(xml_filename, 'w') as f:
-        f.write(xml_string)
+        write_xml(node_tree, f)
     print(f"XML file saved as {xml_filename}")
 
 
-def convert_to_xml(node, level=0):
+# The XML and the debug dump both show the tree in the layout of the book's parse tree, punctuation included.
+# expand() rebuilds that layout from the AST on the fly: a leaf is a (type, value) pair of strings and a group is a (type, iterator over its children) pair
+
+# The XML classifies types with the keyword set of the original parser, which did not have constructor, so its output stays the same
+xml_keywords = keywords - {"constructor"}
+
+
+def type_leaf(text):
+    # A type is a keyword (int, char, boolean, void) or a class name
+    return ("keyword" if text in xml_keywords else "identifier", text)
+
+
+def expand(node):
+    """
+    Returns the group for an AST node, or for a list of statements.
     """
-    Recursively converts a node tree to XML format as a string, manually doing DFS.
-    - Nodes with children are formatted with indented children on new lines.
-    - Nodes with no children are formatted on a single line.
+    if isinstance(node, list):
+        return ("statements", map(expand, node))
+    return (node.type if node.type in statement_types or node.type in declaration_types else "term", expand_children(node))
+
+
+declaration_types = {"class", "classVarDec", "subroutineDec", "varDec"}
+statement_types = {"letStatement", "ifStatement", "whileStatement", "doStatement", "returnStatement"}
+
+
+def expression_group(expression):
+    return ("expression", expression_children(expression))
+
+
+def expression_children(expression):
+    # term (op term)*: the left spine of the BinaryExpr chain is walked back into a flat list
+    operations = []
+    while expression.type == "binaryExpr":
+        operations.append(expression)
+        expression = expression.left
+    yield ("term", expand_children(expression))
+    for operation in reversed(operations):
+        yield ("symbol", operation.op)
+        yield ("term", expand_children(operation.right))
+
+
+def var_name_list(names):
+    yield ("identifier", names[0])
+    for name in names[1:]:
+        yield ("symbol", ",")
+        yield ("identifier", name)
+    yield ("symbol", ";")
+
+
+def parameter_list(parameters):
+    for i, (var_type, name) in enumerate(parameters):
+        if i:
+            yield ("symbol", ",")
+        yield type_leaf(var_type)
+        yield ("identifier", name)
+
+
+def subroutine_body(subroutine):
+    yield ("symbol", "{")
+    for var_dec in subroutine.var_decs:
+        yield expand(var_dec)
+    yield expand(subroutine.statements)
+    yield ("symbol", "}")
+
+
+def block(statements):
+    yield ("symbol", "{")
+    yield expand(statements)
+    yield ("symbol", "}")
+
+
+def expression_list(arguments):
+    for i, argument in enumerate(arguments):
+        if i:
+            yield ("symbol", ",")
+        yield expression_group(argument)
+
+
+def subroutine_call_children(call):
+    if call.receiver is not None:
+        yield ("identifier", call.receiver)
+        yield ("symbol", ".")
+    yield ("identifier", call.name)
+    yield ("symbol", "(")
+    yield ("expressionList", expression_list(call.arguments))
+    yield ("symbol", ")")
+
+
+def expand_children(node):
+    """
+    Yields the children of an AST node in the parse tree layout. For expression nodes these are the children of their <term>.
+    """
+    match node.type:
+        case "class":
+            yield ("keyword", "class")
+            yield ("identifier", node.name)
+            yield ("symbol", "{")
+            for child in node.class_var_decs:
+                yield expand(child)
+            for child in node.subroutine_decs:
+                yield expand(child)
+            yield ("symbol", "}")
+
+        case "classVarDec":
+            yield ("keyword", node.kind)
+            yield type_leaf(node.var_type)
+            yield from var_name_list(node.names)
+
+        case "subroutineDec":
+            yield ("keyword", node.kind)
+            yield type_leaf(node.return_type)
+            yield ("identifier", node.name)
+            yield ("symbol", "(")
+            yield ("parameterList", parameter_list(node.parameters))
+            yield ("symbol", ")")
+            yield ("subroutineBody", subroutine_body(node))
+
+        case "varDec":
+            yield ("keyword", "var")
+            yield type_leaf(node.var_type)
+            yield from var_name_list(node.names)
+
+        case "letStatement":
+            yield ("keyword", "let")
+            yield ("identifier", node.name)
+            if node.index is not None:
+                yield ("symbol", "[")
+                yield expression_group(node.index)
+                yield ("symbol", "]")
+            yield ("symbol", "=")
+            yield expression_group(node.value)
+            yield ("symbol", ";")
+
+        case "ifStatement":
+            yield ("keyword", "if")
+            yield ("symbol", "(")
+            yield expression_group(node.condition)
+            yield ("symbol", ")")
+            yield from block(node.statements)
+            if node.else_statements is not None:
+                yield ("keyword", "else")
+                yield from block(node.else_statements)
+
+        case "whileStatement":
+            yield ("keyword", "while")
+            yield ("symbol", "(")
+            yield expression_group(node.condition)
+            yield ("symbol", ")")
+            yield from block(node.statements)
+
+        case "doStatement":
+            yield ("keyword", "do")
+            yield from subroutine_call_children(node.call)
+            yield ("symbol", ";")
+
+        case "returnStatement":
+            yield ("keyword", "return")
+            if node.value is not None:
+                yield expression_group(node.value)
+            yield ("symbol", ";")
+
+        case "binaryExpr":
+            # Only reached for a binary expression in term position, which the parser never builds
+            yield ("symbol", "(")
+            yield expression_group(node)
+            yield ("symbol", ")")
+
+        case "integerConstant":
+            yield ("integerConstant", str(node.value))
+
+        case "stringConstant":
+            yield ("stringConstant", node.value)
+
+        case "keywordConstant":
+            yield ("keyword", node.value)
+
+        case "varName":
+            yield ("identifier", node.name)
+
+        case "parenExpr":
+            yield ("symbol", "(")
+            yield expression_group(node.expression)
+            yield ("symbol", ")")
+
+        case "unaryExpr":
+            yield ("symbol", node.op)
+            yield ("term", expand_children(node.operand))
+
+        case "arrayAccess":
+            yield ("identifier", node.name)
+            yield ("symbol", "[")
+            yield expression_group(node.index)
+            yield ("symbol", "]")
+
+        case "subroutineCall":
+            yield from subroutine_call_children(node)
+
+
+# Both writers walk the layout with an explicit stack of child iterators instead of recursion, and write each line straight to the file
+# as soon as it is known. Nothing is accumulated, so the cost is linear in the output and deep trees cannot hit the recursion limit
+
+xml_escapes = {'<': "&lt;", '>': "&gt;", '&': "&amp;"}
+
+
+def write_xml(node, file, level=0):
     """
-    indent = "  " * level  # Current indentation based on depth level
-    xml_str = ""
-
-    if isinstance(node, Node):
-        if node.children:
-            # Nodes with children: opening tag, children on new lines, closing tag
-            xml_str += f"{indent}<{node.type}>\n"
-            for child in node.children:
-                xml_str += convert_to_xml(child, level + 1)
-            xml_str += f"{indent}</{node.type}>\n"
+    Writes a tree to an open file as XML, in one pass.
+    - Elements with children are formatted with indented children on new lines.
+    - Leaves are formatted on a single line.
+    """
+    write = file.write
+    element_type, children = expand(node)
+    indent = "  " * level
+    write(f"{indent}<{element_type}>\n")
+    stack = [(element_type, children, indent)]
+
+    while stack:
+        parent_type, siblings, parent_indent = stack[-1]
+        child = next(siblings, None)
+        if child is None:
+            stack.pop()
+            write(f"{parent_indent}</{parent_type}>\n")
+            continue
+
+        indent = parent_indent + "  "
+        element_type, content = child
+        if not isinstance(content, str):
+            # Groups: opening tag, children on new lines, closing tag
+            write(f"{indent}<{element_type}>\n")
+            stack.append((element_type, content, indent))
+        elif content:
+            # Leaves: single-line tag
+            write(f"{indent}<{element_type}> {xml_escapes.get(content, content)} </{element_type}>\n")
         else:
-            # Nodes with no children: single-line tag
-            if node.value:
-                #XML weirdness
-                if node.value == '<':
-                    xml_str += f"{indent}<{node.type}> &lt; </{node.type}>\n"
-                elif node.value == '>':
-                    xml_str += f"{indent}<{node.type}> &gt; </{node.type}>\n"
-                elif node.value == '&':
-                    xml_str += f"{indent}<{node.type}> &amp; </{node.type}>\n"
-                else:
-                    xml_str += f"{indent}<{node.type}> {node.value} </{node.type}>\n"
-            else:
-                xml_str += f"{indent}<{node.type}>\n{indent}</{node.type}>\n"
+            write(f"{indent}<{element_type}>\n{indent}</{element_type}>\n")
+
+
+def write_tree_dump(node, file, level=0):
+    """
+    Writes the debug dump of a tree to an open file: one Node(...) line per element of the parse tree layout, indented by depth.
+    """
+    write = file.write
+    element_type, children = expand(node)
+    indent = "  " * level
+    write(f"{indent}Node(type={element_type})\n")
+    stack = [(children, indent)]
+
+    while stack:
+        siblings, parent_indent = stack[-1]
+        child = next(siblings, None)
+        if child is None:
+            stack.pop()
+            continue
+
+        indent = parent_indent + "  "
+        element_type, content = child
+        if not isinstance(content, str):
+            write(f"{indent}Node(type={element_type})\n")
+            stack.append((content, indent))
+        elif content:
+            write(f"{indent}Node(value={repr(content)}, type={element_type})\n")
+        else:
+            write(f"{indent}Node(type={element_type})\n")
+
+
+def dump_tree(node, level=0):
+    """
+    Returns the debug dump of a tree as a string.
+    """
+    buffer = io.StringIO()
+    write_tree_dump(node, buffer, level)
+    return buffer.getvalue()
 
-    return xml_str
+
+def convert_to_xml(node, level=0):
+    """
+    Returns the XML of a tree as a string. create_xml_file streams it to the file with write_xml instead.
+    """
+    buffer = io.StringIO()
+    write_xml(node, buffer, level)
+    return buffer.getvalue()
 
 # Run the script with a file as input
 if __name__ == "__main__":
@@ -458,7 +844,7 @@ if __name__ == "__main__":
         filename = sys.argv[1]
         try:
             create_xml_file(filename)
-            print(parse_list_of_token( process_file(filename)))
+            write_tree_dump(parse_list_of_token(tokenize_file(filename)), sys.stdout)
         except FileNotFoundError:
             print(f"Error: File '{filename}' not found.")
         except Exception as e:
@@ -0,0 +1,52 @@
+import better_compiler
+from parser import tokenize, parse_list_of_token
+from better_compiler import compile_class
+from AST_Optimizer import FOLDS, TRUE
+from benchmark import EMULATED_CLASSES, run_emulated, changed_settings
+
+# Comparisons whose difference overflows, which the CPU answers by the sign of the wrapped difference
+OVERFLOWING_MAIN = """
+class Main {
+    function void main() {
+        var Array out;
+        let out = 8000;
+        let out[0] = 32767 < -2;
+        let out[1] = -32767 > 2;
+        let out[2] = 2 > -32767;
+        let out[3] = (-32767 - 1) < 1;
+        return;
+    }
+}
+"""
+
+
+def test_comparisons_fold_by_the_wrapped_difference():
+    assert FOLDS["<"](32767, -2) == TRUE
+    assert FOLDS[">"](-32767, 2) == TRUE
+    assert FOLDS["<"](-5, 3) == TRUE
+    assert FOLDS[">"](3, -5) == TRUE
+
+
+def test_folded_comparisons_match_the_emulator():
+    classes = dict(EMULATED_CLASSES, **{"Main.jack": OVERFLOWING_MAIN})
+    folded = run_emulated(classes)
+    with changed_settings(better_compiler, FOLD_CONSTANTS=False):
+        computed = run_emulated(classes)
+    assert folded.halted and computed.halted
+    assert folded.ram[8000:8004] == computed.ram[8000:8004]
+    assert folded.cycles < computed.cycles
+
+
+def compiled_calls(expression):
+    source = f"class Main {{ function int f(int a, int b) {{ return {expression}; }} }}"
+    return [line for line in compile_class(parse_list_of_token(tokenize(source))) if line.startswith("call")]
+
+
+def test_multiplying_by_zero_keeps_the_calls_to_math():
+    # Math.divide can fail on a division by zero, so the division has to run even though its result is not used
+    assert "call Math.divide.2 2" in compiled_calls("(a / b) * 0")
+    assert compiled_calls("(a * b) & 0") == ["call Math.multiply.2 2"]
+    assert compiled_calls("-1 | (a / 7)") == ["call Math.divide.2 2"]
+    # A multiplication turned into additions calls nothing, so it can go
+    assert compiled_calls("(a * 4) * 0") == []
+    assert compiled_calls("(a + b) & 0") == []
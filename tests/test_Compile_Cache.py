@@ -0,0 +1,75 @@
+import os
+import better_compiler
+from better_compiler import process_directory
+from benchmark import EMULATED_CLASSES
+
+
+def write_classes(directory, classes):
+    for filename, source in classes.items():
+        with open(os.path.join(directory, filename), "w") as file:
+            file.write(source)
+
+
+def read_vm_files(directory):
+    vm_files = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".vm"):
+            with open(os.path.join(directory, filename)) as file:
+                vm_files[filename] = file.read()
+    return vm_files
+
+
+def compiled_files(output):
+    # The .jack files process_directory compiled, from what it printed
+    return sorted(line.rsplit(" ", 1)[1] for line in output.splitlines() if line.startswith("Successfully created VM file from"))
+
+
+def build(directory, capsys, **options):
+    capsys.readouterr()
+    assert process_directory(str(directory), **options) == {}
+    return compiled_files(capsys.readouterr().out), read_vm_files(directory)
+
+
+def test_cache_hit_leaves_the_output_unchanged(tmp_path, capsys):
+    write_classes(tmp_path, EMULATED_CLASSES)
+    compiled, first = build(tmp_path, capsys)
+    assert compiled == sorted(EMULATED_CLASSES)
+    modified_times = {filename: os.stat(tmp_path / filename).st_mtime_ns for filename in first}
+    compiled, second = build(tmp_path, capsys)
+    assert compiled == []
+    assert second == first
+    # An unchanged .vm file is not even written again
+    assert {filename: os.stat(tmp_path / filename).st_mtime_ns for filename in second} == modified_times
+    # And it is what compiling without the cache gives
+    _, uncached = build(tmp_path, capsys, use_cache=False)
+    assert uncached == first
+
+
+def test_edited_source_is_recompiled(tmp_path, capsys):
+    write_classes(tmp_path, EMULATED_CLASSES)
+    _, before = build(tmp_path, capsys)
+    # A change of a body only: the classes calling Main keep their VM code
+    write_classes(tmp_path, {"Main.jack": EMULATED_CLASSES["Main.jack"].replace("let n = 40;", "let n = 30;")})
+    compiled, after = build(tmp_path, capsys)
+    assert compiled == ["Main.jack"]
+    assert "push constant 30" in after["Main.vm"] and after["Main.vm"] != before["Main.vm"]
+    assert {name: code for name, code in after.items() if name != "Main.vm"} == {name: code for name, code in before.items() if name != "Main.vm"}
+
+
+def test_signature_change_recompiles_the_callers(tmp_path, capsys):
+    write_classes(tmp_path, EMULATED_CLASSES)
+    build(tmp_path, capsys)
+    # Memory.alloc becomes a method, so Array and Sys, which call Memory, have to be compiled again. Math and Main do not
+    write_classes(tmp_path, {"Memory.jack": EMULATED_CLASSES["Memory.jack"].replace("function int alloc", "method int alloc")})
+    compiled, _ = build(tmp_path, capsys)
+    assert compiled == ["Array.jack", "Memory.jack", "Sys.jack"]
+
+
+def test_compiler_change_recompiles_everything(tmp_path, capsys, monkeypatch):
+    write_classes(tmp_path, EMULATED_CLASSES)
+    _, before = build(tmp_path, capsys)
+    # COMPILER_VERSION is the hash of the compiler's own modules, editing any of them changes it
+    monkeypatch.setattr(better_compiler, "COMPILER_VERSION", "0" * 16)
+    compiled, after = build(tmp_path, capsys)
+    assert compiled == sorted(EMULATED_CLASSES)
+    assert after == before
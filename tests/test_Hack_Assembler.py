@@ -0,0 +1,13 @@
+import pytest
+from Hack_Assembler import assemble, FIRST_VARIABLE_ADDRESS, LAST_VARIABLE_ADDRESS
+
+
+def test_only_R0_to_R15_are_registers():
+    assert assemble("@R0\n@R15\n@R16\n@R99\n@R16\n") == [0, 15, FIRST_VARIABLE_ADDRESS, FIRST_VARIABLE_ADDRESS + 1, FIRST_VARIABLE_ADDRESS]
+
+
+def test_variables_end_at_the_stack():
+    variables = [f"@v{i}" for i in range(LAST_VARIABLE_ADDRESS - FIRST_VARIABLE_ADDRESS + 1)]
+    assert assemble("\n".join(variables + variables[:1]))[-2:] == [LAST_VARIABLE_ADDRESS, FIRST_VARIABLE_ADDRESS]
+    with pytest.raises(ValueError, match="@one_too_many"):
+        assemble("\n".join(variables + ["@one_too_many"]))
@@ -0,0 +1,61 @@
+import contextlib
+import io
+import os
+import pytest
+import VM_translator
+from better_compiler import process_directory
+from Source_Map import A_Source_Map
+from benchmark import EMULATED_CLASSES
+from test_Compile_Cache import write_classes
+
+# Every constant is larger than the program, so the only ROM word equal to it is its A-instruction.
+# The peephole optimizer fuses the first three statements of Main.main, and Main.small is inlined into it,
+# where its code belongs to the line of the call
+MAPPED_MAIN = """class Main {
+    function int small() {
+        return 29333;
+    }
+    function void main() {
+        var Array out;
+        let out = 8000;
+        let out[0] = 31111;
+        let out[1] = Main.small();
+        let out[2] = Math.multiply(out[0], 2) + 30222;
+        return;
+    }
+}
+"""
+
+
+def read_lines(filename):
+    with open(filename) as file:
+        return file.read().split("\n")
+
+
+@pytest.mark.parametrize("options, small_origin", [
+    ({}, ("call Main.small.0 0", 9)),
+    (dict(peephole=False), ("call Main.small.0 0", 9)),
+    (dict(inline_threshold=0), ("push constant 29333", 3)),
+])
+def test_rom_addresses_map_to_their_vm_and_jack_lines(tmp_path, options, small_origin):
+    write_classes(tmp_path, dict(EMULATED_CLASSES, **{"Main.jack": MAPPED_MAIN}))
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert process_directory(str(tmp_path), use_cache=False, source_maps=True) == {}
+        VM_translator.translate_directory(str(tmp_path), assemble_output=True, source_map=True, **options)
+    asm_filename = str(tmp_path / (os.path.basename(tmp_path) + ".asm"))
+    words = [int(word, 2) for word in read_lines(asm_filename[:-4] + ".hack") if word]
+    main_vm = read_lines(tmp_path / "Main.vm")
+    source_map = A_Source_Map(asm_filename)
+
+    for constant, vm_instruction, jack_line in [
+        (31111, "push constant 31111", 8),
+        (29333, *small_origin),
+        (30222, "push constant 30222", 10),
+    ]:
+        assert words.count(constant) == 1
+        asm_line, vm_filename, vm_line, jack_filename, mapped_jack_line = source_map.locate(words.index(constant))
+        assert read_lines(asm_filename)[asm_line - 1].strip() == f"@{constant}"
+        assert (vm_filename, main_vm[vm_line - 1], jack_filename, mapped_jack_line) == ("Main.vm", vm_instruction, "Main.jack", jack_line)
+
+    # The bootstrap comes from no .vm file
+    assert source_map.locate(0)[1:] == (None, None, None, None)
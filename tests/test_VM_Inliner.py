@@ -0,0 +1,127 @@
+import os
+from better_compiler import process_directory
+from VM_Linker import split_functions
+from VM_translator import remove_comments
+from VM_Inliner import inline_functions
+from benchmark import EMULATED_CLASSES, run_emulated
+from test_Compile_Cache import write_classes
+from test_VM_translator import program_state
+
+# Small callees inlined into loops: Counter.add and Counter.get use this, and Counter.absorb its own this after other.get(),
+# Util.at points that at an array,
+# Util.clamp and Util.sign have labels and Counter.bump a static, which it can only use inlined into its own class
+INLINED_CLASSES = dict(EMULATED_CLASSES, **{
+    "Counter.jack": """
+class Counter {
+    field int count;
+    static int total;
+
+    constructor Counter new() {
+        let count = 0;
+        return this;
+    }
+    method void add(int x) {
+        let count = count + x;
+        return;
+    }
+    method int get() {
+        return count;
+    }
+    method void absorb(Counter other, int n) {
+        var int i;
+        while (i < n) {
+            let count = count + other.get();
+            let i = i + 1;
+        }
+        return;
+    }
+    function int bump(int x) {
+        let total = total + x;
+        return total;
+    }
+    function int bumpAll(int n) {
+        var int i;
+        while (i < n) {
+            do Counter.bump(i);
+            let i = i + 1;
+        }
+        return total;
+    }
+}
+""",
+    "Util.jack": """
+class Util {
+    function int at(Array a, int i) {
+        return a[i];
+    }
+    function int clamp(int x) {
+        if (x > 100) {
+            return 100;
+        }
+        return x;
+    }
+    function int sign(int x) {
+        while (x > 1) {
+            let x = 1;
+        }
+        return x;
+    }
+}
+""",
+    "Main.jack": """
+class Main {
+    function void main() {
+        var Array a, out;
+        var Counter c, d;
+        var int i;
+        let out = 8000;
+        let a = Array.new(10);
+        let c = Counter.new();
+        while (i < 10) {
+            let a[i] = i * 30;
+            let i = i + 1;
+        }
+        let i = 0;
+        while (i < 10) {
+            do c.add(Util.clamp(Util.at(a, i)));
+            let out[i + 4] = Util.sign(a[i]) + Util.at(a, 9 - i);
+            let i = i + 1;
+        }
+        let d = Counter.new();
+        do d.add(5);
+        do c.absorb(d, 3);
+        let out[0] = c.get();
+        let out[1] = Counter.bumpAll(5);
+        let out[2] = Counter.bump(100);
+        let out[3] = Counter.bumpAll(3);
+        return;
+    }
+}
+""",
+})
+INLINED_FUNCTIONS = {"Counter.add.2", "Counter.get.1", "Counter.bump.1", "Util.at.2", "Util.clamp.1", "Util.sign.1"}
+
+
+def test_callees_are_inlined(tmp_path):
+    write_classes(tmp_path, INLINED_CLASSES)
+    assert process_directory(str(tmp_path), use_cache=False) == {}
+    program = []
+    for filename in sorted(os.listdir(tmp_path)):
+        if filename.endswith(".vm"):
+            with open(tmp_path / filename) as file:
+                program.append((filename[:-3], split_functions(remove_comments(file.readlines()))))
+    _, inlined_sites = inline_functions(program)
+    assert INLINED_FUNCTIONS <= set(inlined_sites)
+    # Main.main calls Counter.bump too, but from another file
+    assert inlined_sites["Counter.bump.1"] == 1
+
+
+def test_inlined_program_gives_the_same_results():
+    called = run_emulated(INLINED_CLASSES, inline_threshold=0)
+    inlined = run_emulated(INLINED_CLASSES)
+    assert called.halted and inlined.halted
+    # The statics and the heap, SP is higher since the callers have the locals of their inlined callees on top of their own
+    assert program_state(inlined)[1:] == program_state(called)[1:]
+    assert inlined.ram[8000:8004] == [795, 10, 110, 113]
+    assert inlined.ram[8004:8014] == [(i > 0) + 30 * (9 - i) for i in range(10)]
+    assert inlined.cycles < called.cycles
@@ -0,0 +1,162 @@
+import os
+import pytest
+from better_compiler import process_directory
+from VM_translator import link_program
+from VM_Linker import light_functions
+from VM_Inliner import INLINE_THRESHOLD
+from benchmark import EMULATED_CLASSES, run_emulated
+from test_Compile_Cache import write_classes
+from test_VM_translator import program_state
+
+# Main only calls Shapes.total, and Geometry.area and Geometry.scale are only called from Shapes, another file.
+# Geometry.perimeter and Shapes.unused are called by no one
+LINKED_CLASSES = dict(EMULATED_CLASSES, **{
+    "Geometry.jack": """
+class Geometry {
+    function int area(int w, int h) {
+        return Geometry.scale(w * h, 1);
+    }
+    function int scale(int x, int factor) {
+        var int i, sum;
+        while (i < factor) {
+            let sum = sum + x;
+            let i = i + 1;
+        }
+        return sum;
+    }
+    function int perimeter(int w, int h) {
+        return (w + h) * 2;
+    }
+}
+""",
+    "Shapes.jack": """
+class Shapes {
+    function int total(int n) {
+        var int i, sum;
+        while (i < n) {
+            let sum = sum + Geometry.area(i, i + 3);
+            let i = i + 1;
+        }
+        return sum;
+    }
+    function int unused() {
+        return Geometry.perimeter(3, 4);
+    }
+}
+""",
+    "Main.jack": """
+class Main {
+    function void main() {
+        var Array out;
+        let out = 8000;
+        let out[0] = Shapes.total(10);
+        let out[1] = Geometry.scale(7, 6);
+        return;
+    }
+}
+""",
+})
+
+
+@pytest.mark.parametrize("inline_threshold", [0, INLINE_THRESHOLD])
+def test_linked_program_gives_the_same_results(inline_threshold):
+    linked = run_emulated(LINKED_CLASSES, inline_threshold=inline_threshold)
+    unlinked = run_emulated(LINKED_CLASSES, remove_unreachable=False, inline_threshold=inline_threshold)
+    assert linked.halted and unlinked.halted
+    assert program_state(linked) == program_state(unlinked)
+    assert linked.ram[8000:8002] == [sum(i * (i + 3) for i in range(10)), 42]
+
+
+def test_functions_called_from_other_files_are_kept(tmp_path):
+    write_classes(tmp_path, LINKED_CLASSES)
+    assert process_directory(str(tmp_path), use_cache=False) == {}
+    vm_files = sorted(str(tmp_path / filename) for filename in os.listdir(tmp_path) if filename.endswith(".vm"))
+    linked, unreachable = link_program(vm_files, inline_threshold=0)
+    kept = {name for _, functions in linked for name in functions}
+    assert {"Geometry.area.2", "Geometry.scale.2", "Shapes.total.1", "Math.multiply.2"} <= kept
+    assert {name for _, name, _ in unreachable} >= {"Geometry.perimeter.2", "Shapes.unused.0"}
+    assert not {name for _, name, _ in unreachable} & kept
+    # Without removing them, every function stays
+    linked, unreachable = link_program(vm_files, remove_unreachable=False, inline_threshold=0)
+    assert unreachable == [] and {"Geometry.perimeter.2", "Shapes.unused.0"} <= {name for _, functions in linked for name in functions}
+
+
+# Node.sum and Node.push are methods, which set THIS, and Node.sum is recursive. Main.fib and Main.walk are light, Main.main,
+# which writes an array, is not: it calls Main.walk, which calls the methods of the list, and Node.sum calls the light
+# Main.weight and then reads its own fields
+LIGHT_CLASSES = dict(EMULATED_CLASSES, **{
+    "Node.jack": """
+class Node {
+    field int value;
+    field Node next;
+
+    constructor Node new(int v, Node n) {
+        let value = v;
+        let next = n;
+        return this;
+    }
+    method int sum() {
+        var int here;
+        let here = Main.weight(value);
+        if (next = null) {
+            return here;
+        }
+        return here + next.sum() + value;
+    }
+    method Node push(int v) {
+        return Node.new(v, this);
+    }
+}
+""",
+    "Main.jack": """
+class Main {
+    function int weight(int v) {
+        return (v * 3) - 1;
+    }
+    function int fib(int n) {
+        if (n < 2) {
+            return n;
+        }
+        return Main.fib(n - 1) + Main.fib(n - 2);
+    }
+    function int walk(int n) {
+        var Node list;
+        var int i, total;
+        let list = Node.new(Main.fib(5), null);
+        while (i < n) {
+            let list = list.push(Main.fib(i));
+            let total = total + list.sum();
+            let i = i + 1;
+        }
+        return total;
+    }
+    function void main() {
+        var Array out;
+        let out = 8000;
+        let out[0] = Main.walk(12);
+        let out[1] = Main.fib(15);
+        return;
+    }
+}
+""",
+})
+
+
+@pytest.mark.parametrize("inline_threshold", [0, INLINE_THRESHOLD])
+def test_light_calls_give_the_same_results(inline_threshold, tmp_path):
+    write_classes(tmp_path, LIGHT_CLASSES)
+    assert process_directory(str(tmp_path), use_cache=False) == {}
+    vm_files = sorted(str(tmp_path / filename) for filename in os.listdir(tmp_path) if filename.endswith(".vm"))
+    linked, _ = link_program(vm_files, inline_threshold=inline_threshold)
+    light = light_functions({name: body for _, functions in linked for name, body in functions.items()})
+    assert "Main.fib.1" in light and not {"Node.sum.1", "Node.new.2", "Main.main.0"} & light
+    # Inlined, Node.push sets THIS inside Main.walk
+    assert ("Main.walk.1" in light) == (inline_threshold == 0)
+
+    standard = run_emulated(LIGHT_CLASSES, inline_threshold=inline_threshold, light_calls=False)
+    lighter = run_emulated(LIGHT_CLASSES, inline_threshold=inline_threshold)
+    assert standard.halted and lighter.halted
+    # The statics and the heap, SP differs since a light frame is 2 words smaller
+    assert program_state(lighter)[1:] == program_state(standard)[1:]
+    assert lighter.ram[8000:8002] == [2474, 610]
+    assert lighter.cycles < standard.cycles
@@ -0,0 +1,133 @@
+import random
+import pytest
+import Hack_Emulator
+from VM_Peephole import optimize_function, BINARY_OPERATIONS, UNARY_OPERATIONS, COMPARISONS
+from benchmark import EMULATED_CLASSES, run_emulated, build_emulated_program
+
+# Where the random groups read and write. THIS and THAT point at 3000 and 3100. The arguments are the saved frame of the call to
+# Sys.init, which never returns, and only the first three, which are below the locals whatever protocol it is called with
+WRITABLE = [f"local {i}" for i in range(8)] + [f"argument {i}" for i in range(3)] + [f"static {i}" for i in range(4)] + \
+    [f"temp {i}" for i in range(8)] + [f"this {i}" for i in range(6)] + [f"that {i}" for i in range(6)]
+READABLE = WRITABLE + ["pointer 0", "pointer 1"]
+CONSTANTS = [0, 1, 2, 3, 7, 255, 1000, 32767]
+
+
+def random_operand(rng):
+    if rng.random() < 0.25:
+        return f"constant {rng.choice(CONSTANTS)}"
+    return rng.choice(READABLE)
+
+
+def random_expression(rng, depth):
+    """
+    Returns the VM instructions pushing a random expression, which leave exactly one value on the stack.
+    """
+    if depth == 0 or rng.random() < 0.3:
+        return [f"push {random_operand(rng)}"]
+    if rng.random() < 0.3:
+        return random_expression(rng, depth - 1) + [rng.choice(sorted(UNARY_OPERATIONS))]
+    operation = rng.choice(sorted(BINARY_OPERATIONS) * 3 + sorted(COMPARISONS))
+    return random_expression(rng, depth - 1) + random_expression(rng, depth - 1) + [operation]
+
+
+def random_group(rng):
+    """
+    Returns a random stack-balanced group, more often one of the shapes the peephole optimizer fuses.
+    """
+    target = rng.choice(WRITABLE)
+    match rng.randrange(5):
+        case 0:
+            return [f"push {random_operand(rng)}", f"pop {target}"]
+        case 1:
+            operation = rng.choice(sorted(BINARY_OPERATIONS))
+            pushes = [f"push {target}", f"push {random_operand(rng)}"]
+            return (pushes if rng.random() < 0.5 else pushes[::-1]) + [operation, f"pop {target}"]
+        case 2:
+            return [f"push {target}", rng.choice(sorted(UNARY_OPERATIONS)), f"pop {target}"]
+        case _:
+            return random_expression(rng, 4) + [f"pop {target}"]
+
+
+def random_function(rng, amount_of_groups):
+    lines = ["function Sys.init.0 8", "push constant 3000", "pop pointer 0", "push constant 3100", "pop pointer 1"]
+    for location in WRITABLE:
+        lines.extend([f"push constant {rng.randrange(32768)}", f"pop {location}"])
+    for _ in range(amount_of_groups):
+        lines.extend(random_group(rng))
+        if rng.random() < 0.1:
+            # A label cuts the groups, and the top of the stack is spilled before it
+            lines.append(f"label L{len(lines)}")
+    lines.extend(["label HALT", "goto HALT"])
+    return lines
+
+
+def fused_form(instruction):
+    # "inplace add local 0 temp 1" -> "inplace add", "add local 0" -> "op S i", "move local 0 temp 1" -> "move"
+    parts = instruction.split()
+    if parts[0] == "inplace":
+        return f"inplace {parts[1]}"
+    if parts[0] in BINARY_OPERATIONS and len(parts) == 3:
+        return "op S i"
+    return parts[0]
+
+
+def final_state(computer):
+    # Everything but the stack above SP, where the values the optimized code never pushed would be,
+    # and R13 to R15, where the routines of the starter code keep return addresses in the ROM
+    SP = computer.ram[0]
+    return SP, computer.ram[:13], computer.ram[16:SP], computer.ram[2048:]
+
+
+def test_optimized_groups_leave_the_same_state():
+    rng = random.Random(2024)
+    fused = set()
+    for _ in range(60):
+        lines = random_function(rng, 40)
+        fused.update(fused_form(instruction) for instruction in optimize_function(lines))
+        program = {"Sys.vm": "\n".join(lines) + "\n"}
+        plain = run_emulated(program, peephole=False)
+        optimized = run_emulated(program)
+        assert plain.halted and optimized.halted
+        assert final_state(optimized) == final_state(plain), "\n".join(lines)
+        assert optimized.cycles < plain.cycles
+    # Every fused instruction showed up
+    assert {"move", "push-neg", "push-not", "op S i", "inplace neg", "inplace not"} | {f"inplace {operation}" for operation in BINARY_OPERATIONS} <= fused
+
+
+# Recursion far deeper than the RAM could hold frames for: 20000 calls of 7 words each
+TAIL_CALL_MAIN = """
+class Main {
+    function int count(int n, int acc) {
+        if (n = 0) { return acc; }
+        return Main.count(n - 1, acc + 1);
+    }
+    function int gcd(int a, int b) {
+        if (b = 0) { return a; }
+        return Main.gcd(b, a - ((a / b) * b));
+    }
+    function void main() {
+        var Array out;
+        let out = 8000;
+        let out[0] = Main.count(20000, 0);
+        let out[1] = Main.gcd(30030, 4199);
+        let out[2] = Main.count(10, 5);
+        return;
+    }
+}
+"""
+
+
+def test_tail_calls_run_in_constant_stack_space(tmp_path):
+    classes = dict(EMULATED_CLASSES, **{"Main.jack": TAIL_CALL_MAIN})
+    computer = Hack_Emulator.A_Hack_Computer(build_emulated_program(str(tmp_path), classes))
+    highest_SP = 0
+    while not computer.halted and computer.cycles < 10_000_000:
+        computer.run_compiled(1_000)
+        highest_SP = max(highest_SP, computer.ram[0])
+    assert computer.halted
+    assert computer.ram[8000:8003] == [20000, 13, 15]
+    # A few frames for Math.divide, which is not tail recursive, instead of one for each of the 20000 calls
+    assert highest_SP < 512
+    # Without the peephole optimizer every call takes a new frame, and the stack runs past the end of the RAM
+    with pytest.raises(IndexError):
+        run_emulated(classes, peephole=False)
@@ -0,0 +1,36 @@
+import random
+import pytest
+from benchmark import EMULATED_CLASSES, STRING_CLASSES, run_emulated
+from test_VM_Peephole import random_function, final_state
+
+# Loops, array accesses, recursive calls, methods and constructors, where the top of the stack is spilled before every label, call and return
+PROGRAMS = {
+    "sorting and recursion": EMULATED_CLASSES,
+    "strings": dict(EMULATED_CLASSES, **STRING_CLASSES),
+}
+
+
+def program_state(computer):
+    # SP, the statics and the heap, with the results in RAM[8000..]
+    return computer.ram[0], computer.ram[16:256], computer.ram[2048:]
+
+
+@pytest.mark.parametrize("peephole", [False, True])
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_cached_top_gives_the_same_results_in_fewer_cycles(name, peephole):
+    in_memory = run_emulated(PROGRAMS[name], peephole=peephole, cache_top=False)
+    cached = run_emulated(PROGRAMS[name], peephole=peephole)
+    assert in_memory.halted and cached.halted
+    assert program_state(cached) == program_state(in_memory)
+    assert cached.cycles < in_memory.cycles
+
+
+def test_cached_top_on_random_groups():
+    rng = random.Random(16)
+    for _ in range(30):
+        program = {"Sys.vm": "\n".join(random_function(rng, 40)) + "\n"}
+        for peephole in (False, True):
+            in_memory = run_emulated(program, peephole=peephole, cache_top=False)
+            cached = run_emulated(program, peephole=peephole)
+            assert final_state(cached) == final_state(in_memory)
+            assert cached.cycles < in_memory.cycles
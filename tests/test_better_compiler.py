@@ -0,0 +1,54 @@
+import re
+import better_compiler
+from parser import tokenize, parse_list_of_token
+from better_compiler import compile_class
+from Program_State import MAX_POOLED_STRINGS, STATIC_SEGMENT_SIZE
+from benchmark import EMULATED_CLASSES, STRING_CLASSES, run_emulated, changed_settings
+
+
+def many_strings_main(amount_of_strings, declared_statics=0):
+    # Every constant is evaluated twice, so the pooled ones are pushed from their static the second time
+    statics = f"static int {', '.join(f'v{i}' for i in range(declared_statics))};" if declared_statics else ""
+    lets = "\n".join(f'let s = "s{i:02}"; let x = x + s.length() + s.charAt(1);' for i in range(amount_of_strings))
+    return f"""
+class Main {{
+    {statics}
+    function void main() {{
+        var Array out;
+        var String s;
+        var int i, x, free;
+        let out = 8000;
+        let free = Memory.alloc(0);
+        let i = 0;
+        while (i < 2) {{
+            {lets}
+            let i = i + 1;
+        }}
+        let out[0] = x;
+        let out[1] = Memory.alloc(0) - free;
+        return;
+    }}
+}}
+"""
+
+
+def pooled_statics(source):
+    return {int(slot) for slot in re.findall(r"pop static (\d+)", "\n".join(compile_class(parse_list_of_token(tokenize(source)))))}
+
+
+def test_strings_past_the_pool_are_built_at_every_evaluation():
+    amount_of_strings = MAX_POOLED_STRINGS + 8
+    classes = {**EMULATED_CLASSES, **STRING_CLASSES, "Main.jack": many_strings_main(amount_of_strings)}
+    assert len(pooled_statics(classes["Main.jack"])) == MAX_POOLED_STRINGS
+    pooled = run_emulated(classes)
+    with changed_settings(better_compiler, POOL_STRINGS=False):
+        built = run_emulated(classes)
+    assert pooled.halted and built.halted
+    assert pooled.ram[8000] == built.ram[8000] == 2 * sum(3 + ord(f"{i:02}"[0]) for i in range(amount_of_strings))
+    # Every String takes the same heap words, and only the pooled ones are built once instead of twice
+    assert pooled.ram[8001] * 2 * amount_of_strings == built.ram[8001] * (2 * amount_of_strings - MAX_POOLED_STRINGS)
+
+
+def test_pool_stays_within_the_static_segment():
+    slots = pooled_statics(many_strings_main(20, declared_statics=STATIC_SEGMENT_SIZE - 10))
+    assert slots == set(range(STATIC_SEGMENT_SIZE - 10, STATIC_SEGMENT_SIZE))
@@ -0,0 +1,22 @@
+import gc
+from parser import tokenize, parse_list_of_token
+from benchmark import generate_jack_class, best_time
+
+
+def parse_time(amount_of_lines):
+    tokens = list(tokenize(generate_jack_class(amount_of_lines)))
+    gc.collect()
+    gc.disable()
+    try:
+        elapsed, _ = best_time(lambda: parse_list_of_token(tokens))
+    finally:
+        gc.enable()
+    return elapsed, len(tokens)
+
+
+def test_parse_time_grows_linearly():
+    # Ten times the tokens takes about ten times as long, a parser popping tokens from the front of a list takes about a hundred
+    small_time, small_tokens = parse_time(2_000)
+    large_time, large_tokens = parse_time(20_000)
+    assert large_tokens > 9 * small_tokens
+    assert large_time / small_time < 30
@@ -0,0 +1,23 @@
+import io
+import os
+import glob
+import pytest
+from parser import tokenize, parse_list_of_token, write_xml
+
+# The XML the parser wrote before it streamed to files, for the MY_OS classes that parse and for sample classes next to it.
+# MY_OS/Memory.jack and MY_OS/String.jack do not parse yet, so they have none
+XML_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xml")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = [(os.path.join(XML_DIRECTORY, name[:-4] + ".jack"), os.path.join(XML_DIRECTORY, name)) for name in sorted(os.listdir(XML_DIRECTORY)) if name.endswith(".xml")]
+CASES += [(os.path.join(ROOT, "MY_OS", os.path.basename(xml)[:-4] + ".jack"), xml) for xml in sorted(glob.glob(os.path.join(XML_DIRECTORY, "MY_OS", "*.xml")))]
+
+
+@pytest.mark.parametrize("jack_filename, xml_filename", CASES, ids=[os.path.basename(jack) for jack, _ in CASES])
+def test_write_xml_is_byte_identical(jack_filename, xml_filename):
+    with open(jack_filename) as jack_file:
+        tree = parse_list_of_token(tokenize(jack_file.read()))
+    with open(xml_filename) as xml_file:
+        expected = xml_file.read()
+    written = io.StringIO()
+    write_xml(tree, written)
+    assert written.getvalue() == expected